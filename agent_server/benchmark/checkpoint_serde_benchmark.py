@@ -0,0 +1,137 @@
+'''
+检查点序列化基准测试，对比不压缩和各压缩算法下每轮对话写入的字节数和读取最新检查点的延迟。
+在 agent_server 目录下运行：python -m benchmark.checkpoint_serde_benchmark --turns 20
+'''
+
+import json
+from argparse import ArgumentParser
+from asyncio import run
+from random import Random
+from time import perf_counter
+from uuid import uuid4
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from langgraph.graph import END, START, MessagesState, StateGraph
+from psycopg import AsyncConnection
+from psycopg_pool import AsyncConnectionPool
+
+from src.server.assist import CompressedSerializer
+from src.server.assist.compressed_serializer import zstd
+from src.server.config import settings
+
+THREAD_BYTES_SQL = '''\
+SELECT
+    (SELECT COALESCE(SUM(pg_column_size(c.*)), 0) FROM checkpoints c WHERE thread_id = %(thread_id)s),
+    (SELECT COALESCE(SUM(pg_column_size(b.*)), 0) FROM checkpoint_blobs b WHERE thread_id = %(thread_id)s),
+    (SELECT COALESCE(SUM(pg_column_size(w.*)), 0) FROM checkpoint_writes w WHERE thread_id = %(thread_id)s)
+'''
+
+
+def search_results(random: Random, query: str) -> str:
+    '''模拟 Tavily 搜索结果，长文本工具输出'''
+
+    words = ['检查点', '序列化', '压缩', '数据库', '对话', '智能体', 'LangGraph', 'Postgres', 'search', 'result']
+    results = [
+        {
+            'title': f'{query} - 结果 {i}',
+            'url': f'https://example.com/{query}/{i}',
+            'content': ' '.join(random.choice(words) for _ in range(random.randint(300, 600))),
+            'score': round(random.random(), 4),
+        }
+        for i in range(5)
+    ]
+    return json.dumps({'query': query, 'results': results}, ensure_ascii=False)
+
+
+def build_graph(saver: AsyncPostgresSaver, random: Random):
+    '''构建模拟对话轮次的图，模型调用工具，工具返回搜索结果，模型回答'''
+
+    def call_tool(state: MessagesState):
+        query = state['messages'][-1].content
+        tool_call = {'name': 'tavily_search', 'args': {'query': query}, 'id': str(uuid4())}
+        return {'messages': [AIMessage('', tool_calls=[tool_call])]}
+
+    def run_tool(state: MessagesState):
+        tool_call = state['messages'][-1].tool_calls[0]
+        return {
+            'messages': [ToolMessage(search_results(random, tool_call['args']['query']), tool_call_id=tool_call['id'])]
+        }
+
+    def answer(state: MessagesState):
+        return {'messages': [AIMessage('根据搜索结果，' + state['messages'][-1].content[:500])]}
+
+    builder = StateGraph(MessagesState)
+    builder.add_node('call_tool', call_tool)
+    builder.add_node('run_tool', run_tool)
+    builder.add_node('answer', answer)
+    builder.add_edge(START, 'call_tool')
+    builder.add_edge('call_tool', 'run_tool')
+    builder.add_edge('run_tool', 'answer')
+    builder.add_edge('answer', END)
+    return builder.compile(checkpointer=saver)
+
+
+async def thread_bytes(pool: AsyncConnectionPool, thread_id: str) -> int:
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(THREAD_BYTES_SQL, {'thread_id': thread_id})
+            return sum(await cur.fetchone())
+
+
+async def benchmark(pool: AsyncConnectionPool, name: str, serde, turns: int, reads: int, seed: int) -> dict:
+    saver = AsyncPostgresSaver(pool, serde=serde)
+    graph = build_graph(saver, Random(seed))
+    thread_id = f'benchmark-{name}-{uuid4()}'
+    config = {'configurable': {'thread_id': thread_id}}
+
+    written, read_latency = [], []
+    previous_bytes = 0
+    for turn in range(turns):
+        await graph.ainvoke({'messages': [HumanMessage(f'问题 {turn}')]}, config)
+        current_bytes = await thread_bytes(pool, thread_id)
+        written.append(current_bytes - previous_bytes)
+        previous_bytes = current_bytes
+
+        started_at = perf_counter()
+        for _ in range(reads):
+            await saver.aget_tuple(config)
+        read_latency.append((perf_counter() - started_at) / reads * 1000)
+
+    return {
+        'serde': name,
+        'total_bytes': previous_bytes,
+        'bytes_per_turn': round(sum(written) / turns),
+        'last_turn_bytes': written[-1],
+        'read_ms_per_turn': round(sum(read_latency) / turns, 3),
+        'last_turn_read_ms': round(read_latency[-1], 3),
+    }
+
+
+async def main():
+    parser = ArgumentParser(description='检查点序列化基准测试')
+    parser.add_argument('--uri', default=settings.POSTGRES_CONNECTION_STRING, help='数据库连接字符串')
+    parser.add_argument('--turns', type=int, default=20, help='每种序列化器运行的对话轮数')
+    parser.add_argument('--reads', type=int, default=10, help='每轮读取最新检查点的次数')
+    parser.add_argument('--threshold', type=int, default=1024, help='压缩阈值，单位字节')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    async with await AsyncConnection.connect(args.uri, autocommit=True) as conn:
+        await AsyncPostgresSaver(conn).setup()
+
+    serdes = {'plain': JsonPlusSerializer(), 'zlib': CompressedSerializer(threshold=args.threshold, codec='zlib')}
+    if zstd:
+        serdes['zstd'] = CompressedSerializer(threshold=args.threshold, codec='zstd')
+
+    async with AsyncConnectionPool(args.uri, kwargs={'autocommit': True, 'prepare_threshold': 0}, open=False) as pool:
+        reports = [
+            await benchmark(pool, name, serde, args.turns, args.reads, args.seed) for name, serde in serdes.items()
+        ]
+
+    print(json.dumps(reports, ensure_ascii=False, indent=4))
+
+
+if __name__ == '__main__':
+    run(main())
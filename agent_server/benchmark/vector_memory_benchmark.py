@@ -0,0 +1,247 @@
+'''
+向量记忆基准测试，生成合成的情景记忆并分批写入长期记忆存储，在各数据规模下测量检索延迟 p50/p99、相对暴力检索的召回率和写入吞吐量。
+覆盖 HNSW 索引参数 m、ef_construction、ef_search 和距离类型，每组索引参数使用独立的模式，结果写入 JSON 报告。
+暴力检索使用同一存储和同一查询，关闭索引扫描后由数据库顺序扫描计算精确结果。
+在 agent_server 目录下运行：python -m benchmark.vector_memory_benchmark --sizes 10000,100000 --output vector_memory.json
+'''
+
+import json
+from argparse import ArgumentParser
+from asyncio import run
+from itertools import product
+from random import Random
+from time import perf_counter
+from zlib import crc32
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langgraph.store.base import PutOp
+from langgraph.store.postgres import AsyncPostgresStore
+from psycopg import AsyncConnection
+from psycopg_pool import AsyncConnectionPool
+
+from src.server.assist import EpisodeMemory
+from src.server.config import settings
+
+FIELDS = ['content.observation', 'content.thought', 'content.action', 'content.result']
+
+
+class HashEmbeddings(Embeddings):
+    '''确定性的模拟嵌入模型，每个词由词的哈希值生成固定的随机向量，文本向量为词向量之和归一化，相同词越多越相似'''
+
+    def __init__(self, dims: int, seed: int = 0):
+        self._dims = dims
+        self._seed = seed
+        self._token_vectors: dict[str, np.ndarray] = {}
+
+    def _token_vector(self, token: str) -> np.ndarray:
+        vector = self._token_vectors.get(token)
+        if vector is None:
+            rng = np.random.default_rng([self._seed, crc32(token.encode())])
+            vector = self._token_vectors[token] = rng.standard_normal(self._dims, dtype=np.float32)
+        return vector
+
+    def _embed(self, text: str) -> list[float]:
+        vector = np.zeros(self._dims, dtype=np.float32)
+        for token in text.split():
+            vector += self._token_vector(token)
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed(text)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return self.embed_query(text)
+
+
+def sentence(random: Random, topic: int, topics: int, length: int) -> str:
+    '''生成句子，大部分词来自主题词表，其余词来自公共词表和相邻主题，使主题内相似、主题间部分重叠'''
+
+    words = []
+    for _ in range(length):
+        roll = random.random()
+        if roll < 0.6:
+            words.append(f'topic{topic}_{random.randrange(30)}')
+        elif roll < 0.8:
+            words.append(f'topic{(topic + random.choice((-1, 1))) % topics}_{random.randrange(30)}')
+        else:
+            words.append(f'common_{random.randrange(500)}')
+    return ' '.join(words)
+
+
+def episode(random: Random, topics: int) -> dict:
+    '''生成一条情景记忆，格式与记忆管理器写入存储的值相同'''
+
+    topic = random.randrange(topics)
+    memory = EpisodeMemory(
+        observation=sentence(random, topic, topics, 24),
+        thought=sentence(random, topic, topics, 24),
+        action=sentence(random, topic, topics, 12),
+        result=sentence(random, topic, topics, 12),
+    )
+    return {'kind': 'EpisodeMemory', 'content': memory.model_dump(mode='json')}
+
+
+def percentile(values: list[float], q: float) -> float:
+    return round(float(np.percentile(values, q)), 3)
+
+
+def connection_pool(uri: str, schema: str, *parameters: str) -> AsyncConnectionPool:
+    '''在指定模式下连接的连接池，向量扩展位于 public 模式，parameters 为连接级的数据库参数'''
+
+    options = ' '.join([f'-c search_path={schema},public', *(f'-c {parameter}' for parameter in parameters)])
+    return AsyncConnectionPool(
+        uri,
+        min_size=1,
+        max_size=1,
+        kwargs={'autocommit': True, 'prepare_threshold': 0, 'options': options},
+        open=False,
+    )
+
+
+async def load(store: AsyncPostgresStore, namespace: tuple[str, ...], random: Random, start: int, stop: int, args):
+    '''写入第 start 到 stop 条情景记忆，返回写入耗时'''
+
+    elapsed = 0.0
+    for batch_start in range(start, stop, args.batch_size):
+        ops = [
+            PutOp(namespace, f'episode-{i}', episode(random, args.topics), FIELDS)
+            for i in range(batch_start, min(stop, batch_start + args.batch_size))
+        ]
+        started_at = perf_counter()
+        await store.abatch(ops)
+        elapsed += perf_counter() - started_at
+    return elapsed
+
+
+async def search(store: AsyncPostgresStore, namespace: tuple[str, ...], queries: list[str], limit: int):
+    '''逐条检索，返回每条查询的结果键和延迟'''
+
+    results, latency = [], []
+    for query in queries:
+        started_at = perf_counter()
+        items = await store.asearch(namespace, query=query, limit=limit)
+        latency.append((perf_counter() - started_at) * 1000)
+        results.append([item.key for item in items])
+    return results, latency
+
+
+async def benchmark(args, distance_type: str, m: int, ef_construction: int) -> list[dict]:
+    schema = f'benchmark_vector_{distance_type}_m{m}_ef{ef_construction}'
+    async with await AsyncConnection.connect(args.uri, autocommit=True) as conn:
+        await conn.execute(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+        await conn.execute(f'CREATE SCHEMA {schema}')
+
+    embeddings = HashEmbeddings(args.dims, args.seed)
+    index_config = {
+        'dims': args.dims,
+        'embed': embeddings,
+        'fields': FIELDS,
+        'distance_type': distance_type,
+        'ann_index_config': {'kind': 'hnsw', 'vector_type': 'vector', 'm': m, 'ef_construction': ef_construction},
+    }
+    namespace = ('memories', 'benchmark-user')
+    random = Random(args.seed)
+    query_random = Random(args.seed + 1)
+    queries = [
+        sentence(query_random, query_random.randrange(args.topics), args.topics, 16) for _ in range(args.queries)
+    ]
+
+    reports = []
+    loaded = 0
+    async with connection_pool(args.uri, schema) as pool:
+        store = AsyncPostgresStore(pool, index=index_config)
+        await store.setup()
+
+        for size in args.sizes:
+            elapsed = await load(store, namespace, random, loaded, size, args)
+            inserted, loaded = size - loaded, size
+
+            async with connection_pool(
+                args.uri, schema, 'enable_indexscan=off', 'enable_bitmapscan=off'
+            ) as exact_pool:
+                exact, exact_latency = await search(
+                    AsyncPostgresStore(exact_pool, index=index_config), namespace, queries, args.limit
+                )
+
+            for ef_search in args.ef_search:
+                async with connection_pool(args.uri, schema, f'hnsw.ef_search={ef_search}') as ann_pool:
+                    ann_store = AsyncPostgresStore(ann_pool, index=index_config)
+                    await search(ann_store, namespace, queries[: args.warmup], args.limit)  # 预热
+                    results, latency = await search(ann_store, namespace, queries, args.limit)
+
+                hits = sum(len(set(result) & set(truth)) for result, truth in zip(results, exact))
+                report = {
+                    'distance_type': distance_type,
+                    'm': m,
+                    'ef_construction': ef_construction,
+                    'ef_search': ef_search,
+                    'size': size,
+                    'dims': args.dims,
+                    'limit': args.limit,
+                    'queries': len(queries),
+                    'search_p50_ms': percentile(latency, 50),
+                    'search_p99_ms': percentile(latency, 99),
+                    'exact_search_p50_ms': percentile(exact_latency, 50),
+                    'recall': round(hits / max(1, sum(len(truth) for truth in exact)), 4),
+                    'inserted': inserted,
+                    'insert_per_second': round(inserted / elapsed, 1) if elapsed else None,
+                }
+                print(json.dumps(report, ensure_ascii=False))
+                reports.append(report)
+
+    if not args.keep:
+        async with await AsyncConnection.connect(args.uri, autocommit=True) as conn:
+            await conn.execute(f'DROP SCHEMA {schema} CASCADE')
+    return reports
+
+
+def int_list(value: str) -> list[int]:
+    return [int(item) for item in value.split(',')]
+
+
+async def main():
+    parser = ArgumentParser(description='向量记忆基准测试')
+    parser.add_argument('--uri', default=settings.POSTGRES_CONNECTION_STRING, help='数据库连接字符串')
+    parser.add_argument('--sizes', type=int_list, default=[10000, 100000, 1000000], help='数据规模，逗号分隔，递增')
+    parser.add_argument('--dims', type=int, default=1024, help='向量维度')
+    parser.add_argument('--distance-types', default='cosine', help='距离类型，逗号分隔，l2, inner_product, cosine')
+    parser.add_argument('--m', type=int_list, default=[16], help='HNSW 每个节点的最大连接数，逗号分隔')
+    parser.add_argument('--ef-construction', type=int_list, default=[64], help='HNSW 构建时的候选列表大小，逗号分隔')
+    parser.add_argument('--ef-search', type=int_list, default=[40, 100], help='HNSW 检索时的候选列表大小，逗号分隔')
+    parser.add_argument('--queries', type=int, default=200, help='每组参数的查询数')
+    parser.add_argument('--warmup', type=int, default=20, help='预热查询数')
+    parser.add_argument('--limit', type=int, default=10, help='每次检索返回的结果数')
+    parser.add_argument('--topics', type=int, default=1000, help='合成情景记忆的主题数')
+    parser.add_argument('--batch-size', type=int, default=500, help='每批写入的情景记忆数')
+    parser.add_argument('--output', help='JSON 报告路径，不指定时输出到标准输出')
+    parser.add_argument('--keep', action='store_true', help='保留测试模式和数据')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    args.sizes = sorted(args.sizes)
+
+    reports = []
+    for distance_type, m, ef_construction in product(args.distance_types.split(','), args.m, args.ef_construction):
+        reports.extend(await benchmark(args, distance_type, m, ef_construction))
+
+    report = json.dumps(
+        {'arguments': {k: v for k, v in vars(args).items() if k != 'uri'}, 'results': reports},
+        ensure_ascii=False,
+        indent=4,
+    )
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    run(main())
@@ -1,5 +1,5 @@
 import logging
-from asyncio import CancelledError, Event, Queue, create_task
+from asyncio import CancelledError, Queue, create_task
 from contextlib import asynccontextmanager
 from traceback import format_exc
 
@@ -17,9 +17,13 @@ from set_logger import set_logger
 from src.server import Agent, Config
 from src.server.assist import (
     ActivationRequest,
+    ChatHistoryRequest,
+    ChatSearchRequest,
     LLMActivationRequest,
     StateChangeEvent,
     WebSocketConnectionManager,
+    checkpoint_compaction_scheduler,
+    episode_consolidation_scheduler,
     remind_task_scheduler,
 )
 
@@ -32,7 +36,6 @@ logger.info('<main.py> 日志器启动')
 # 辅助相关
 websocket_connection_manager = WebSocketConnectionManager(logger)  # WebSocket 连接管理器实例
 state_change_event_queue = Queue()  # 状态变化事件队列
-remind_task_scheduler_wakeup_event = Event()  # 提醒任务调度器唤醒事件
 
 
 async def state_change_event_consumer():
@@ -74,20 +77,32 @@ async def lifespan(app: FastAPI):
         state_change_event_consumer_task = create_task(state_change_event_consumer())
 
         global agent
-        agent = Agent(config, state_change_event_queue, remind_task_scheduler_wakeup_event)
+        agent = Agent(config, state_change_event_queue)
         await agent.init()
 
         global remind_task_scheduler_task
         remind_task_scheduler_task = create_task(
             remind_task_scheduler(
                 agent._remind_task_manager,
-                remind_task_scheduler_wakeup_event,
                 websocket_connection_manager,
                 'liling',
                 logger,
             )
         )
 
+        if agent._checkpoint_compactor:
+            global checkpoint_compaction_scheduler_task
+            checkpoint_compaction_scheduler_task = create_task(
+                checkpoint_compaction_scheduler(
+                    agent._checkpoint_compactor, config.checkpoint_compaction_interval, logger
+                )
+            )
+
+        global episode_consolidation_scheduler_task
+        episode_consolidation_scheduler_task = create_task(
+            episode_consolidation_scheduler(agent._episode_consolidator, config.episode_consolidation_interval, logger)
+        )
+
         yield
     except Exception:
         e = format_exc()
@@ -129,6 +144,16 @@ async def lifespan(app: FastAPI):
                 remind_task_scheduler_task.cancel()
                 await remind_task_scheduler_task
                 logger.info('<lifespan> 清理提醒任务调度器任务完成')
+
+            if 'checkpoint_compaction_scheduler_task' in globals() and not checkpoint_compaction_scheduler_task.done():
+                checkpoint_compaction_scheduler_task.cancel()
+                await checkpoint_compaction_scheduler_task
+                logger.info('<lifespan> 清理检查点压缩调度器任务完成')
+
+            if 'episode_consolidation_scheduler_task' in globals() and not episode_consolidation_scheduler_task.done():
+                episode_consolidation_scheduler_task.cancel()
+                await episode_consolidation_scheduler_task
+                logger.info('<lifespan> 清理情景记忆整理调度器任务完成')
         except CancelledError:
             logger.warning('<lifespan> 清理任务被取消，此动作应该正常！')
         except Exception:
@@ -200,12 +225,25 @@ async def activate_gpt_sovits(request: ActivationRequest):
 
 
 @app.post('/load_chat_history')
-async def load_chat_history():
+async def load_chat_history(request: ChatHistoryRequest | None = None):
     if not agent:
         raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, 'Agent 未初始化！！！')
 
-    chat_history = await agent.load_chat_history()
-    return {'chat_history': chat_history}
+    request = request or ChatHistoryRequest()
+    try:
+        chat_history, next_cursor = await agent.load_chat_history(request.limit, request.cursor)
+    except ValueError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, str(e))
+    return {'chat_history': chat_history, 'next_cursor': next_cursor}
+
+
+@app.post('/search_chats')
+async def search_chats(request: ChatSearchRequest):
+    if not agent:
+        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, 'Agent 未初始化！！！')
+
+    results, next_offset = await agent.search_chats(request.query, request.limit, request.offset)
+    return {'results': results, 'next_offset': next_offset}
 
 
 @app.post('/load_chat/{thread_id}')
@@ -217,6 +255,14 @@ async def load_chat(thread_id: str):
     return {'chat': chat}
 
 
+@app.post('/metrics')
+async def metrics():
+    if not agent:
+        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, 'Agent 未初始化！！！')
+
+    return {'metrics': agent.metrics()}
+
+
 @app.websocket('/ws/notification/{user_id}')
 async def websocket_notification(user_id: str, websocket: WebSocket):
     if not agent:
@@ -259,7 +305,7 @@ async def websocket_chat(thread_id: str, websocket: WebSocket):
     await websocket.accept()
     websocket_connection_manager.connect_chat(thread_id, websocket)
 
-    await agent.reset_chat_state()
+    await agent.reset_chat_state(thread_id)
 
     agent.current_thread_id = thread_id
 
@@ -0,0 +1,164 @@
+'''
+长期记忆向量迁移工具，在全精度，半精度，二值量化和 Matryoshka 截断之间切换长期记忆向量的索引格式。
+向量表始终保留全精度向量，切换格式时先并发建立新格式的索引再删除旧索引，检索不中断，可选重新嵌入所有记忆。
+迁移后以全精度暴力检索为基准，抽样检查紧凑索引加重新打分的召回率，并输出迁移前后的索引大小。
+在 agent_server 目录下运行：python -m scripts.migrate_memory_vectors --format binary --compact-dims 512 --verify 50
+迁移后把配置中的 memory_vector_format 和 memory_vector_compact_dims 改为相同的值再启动智能体。
+'''
+
+import json
+from argparse import ArgumentParser
+from asyncio import run
+from random import Random
+from time import perf_counter
+
+from langchain_core.embeddings import Embeddings
+from langchain_ollama import OllamaEmbeddings
+from langgraph.store.base import get_text_at_path, tokenize_path
+from psycopg import AsyncConnection
+from psycopg_pool import AsyncConnectionPool
+
+from src.server.assist import CompactVectorStore
+from src.server.config import settings
+
+FIELDS = ['content.observation', 'content.thought', 'content.action', 'content.result']
+
+SELECT_VECTOR_TEXTS_SQL = '''\
+SELECT sv.prefix, sv.key, sv.field_name, s.value FROM store_vectors sv
+JOIN store s ON s.prefix = sv.prefix AND s.key = sv.key
+WHERE (sv.prefix, sv.key, sv.field_name) > (%s, %s, %s)
+ORDER BY sv.prefix, sv.key, sv.field_name
+LIMIT %s
+'''
+
+UPDATE_VECTOR_SQL = (
+    'UPDATE store_vectors SET embedding = %s::vector WHERE prefix = %s AND key = %s AND field_name = %s'
+)
+
+SELECT_SAMPLE_SQL = '''\
+SELECT s.prefix, s.value FROM store s
+WHERE s.prefix LIKE 'memories.%'
+    AND EXISTS (SELECT 1 FROM store_vectors sv WHERE sv.prefix = s.prefix AND sv.key = s.key)
+'''
+
+
+def index_config(embeddings: Embeddings) -> dict:
+    '''与智能体相同的索引配置'''
+
+    return {
+        'dims': 1024,
+        'embed': embeddings,
+        'fields': FIELDS,
+        'distance_type': 'cosine',
+        'ann_index_config': {'kind': 'hnsw', 'vector_type': 'vector'},
+    }
+
+
+async def reembed(conn: AsyncConnection, embeddings: Embeddings, batch_size: int) -> int:
+    '''按向量表主键分批重新嵌入所有字段，直接更新向量，不改变记忆的更新时间'''
+
+    reembedded = 0
+    after = ('', '', '')
+    while True:
+        async with conn.cursor() as cur:
+            await cur.execute(SELECT_VECTOR_TEXTS_SQL, (*after, batch_size))
+            rows = await cur.fetchall()
+        if not rows:
+            return reembedded
+
+        texts = [' '.join(get_text_at_path(value, tokenize_path(field_name))) for _, _, field_name, value in rows]
+        vectors = await embeddings.aembed_documents(texts)
+        async with conn.cursor() as cur:
+            await cur.executemany(
+                UPDATE_VECTOR_SQL,
+                [
+                    (str(vector), prefix, key, field_name)
+                    for vector, (prefix, key, field_name, _) in zip(vectors, rows)
+                ],
+            )
+        reembedded += len(rows)
+        after = rows[-1][:3]
+
+
+async def verify(uri: str, config: dict, store: CompactVectorStore, samples: int, limit: int, seed: int) -> dict:
+    '''抽样记忆的情景作为查询，对比紧凑索引加重新打分与关闭索引扫描的全精度暴力检索，计算召回率'''
+
+    async with await AsyncConnection.connect(uri) as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(SELECT_SAMPLE_SQL)
+            rows = await cur.fetchall()
+    queries = [(tuple(prefix.split('.')), value['content']['observation']) for prefix, value in rows]
+    queries = Random(seed).sample(queries, min(samples, len(queries)))
+    if not queries:
+        return {'samples': 0}
+
+    options = '-c enable_indexscan=off -c enable_bitmapscan=off'
+    async with AsyncConnectionPool(uri, kwargs={'autocommit': True, 'options': options}, open=False) as pool:
+        exact_store = CompactVectorStore(pool, index=config)
+        truths = [
+            {item.key for item in await exact_store.asearch(namespace, query=query, limit=limit)}
+            for namespace, query in queries
+        ]
+
+    hits, latency = 0, []
+    for (namespace, query), truth in zip(queries, truths):
+        started_at = perf_counter()
+        items = await store.asearch(namespace, query=query, limit=limit)
+        latency.append((perf_counter() - started_at) * 1000)
+        hits += len({item.key for item in items} & truth)
+    return {
+        'samples': len(queries),
+        'limit': limit,
+        'recall': round(hits / max(1, sum(len(truth) for truth in truths)), 4),
+        'avg_search_ms': round(sum(latency) / len(latency), 3),
+    }
+
+
+async def migrate(uri: str, embeddings: Embeddings, args) -> dict:
+    config = index_config(embeddings)
+    report = {'format': args.format, 'compact_dims': args.compact_dims}
+    async with AsyncConnectionPool(uri, kwargs={'autocommit': True}, open=False) as pool:
+        store = CompactVectorStore(
+            pool,
+            index=config,
+            vector_format=args.format,
+            compact_dims=args.compact_dims,
+            rescore_factor=args.rescore_factor,
+        )
+        async with await AsyncConnection.connect(uri, autocommit=True) as conn:
+            report['indexes_before'] = await store.list_indexes(conn)
+            if args.reembed:
+                started_at = perf_counter()
+                report['reembedded'] = await reembed(conn, embeddings, args.batch_size)
+                report['reembed_seconds'] = round(perf_counter() - started_at, 3)
+
+            started_at = perf_counter()
+            report['index_created'] = await store.setup_vector_index(conn, drop_others=not args.keep_old)
+            report['index_seconds'] = round(perf_counter() - started_at, 3)
+            report['indexes_after'] = await store.list_indexes(conn)
+
+        if args.verify:
+            report['verify'] = await verify(uri, config, store, args.verify, args.limit, args.seed)
+    return report
+
+
+async def main():
+    parser = ArgumentParser(description='长期记忆向量迁移工具')
+    parser.add_argument('--uri', default=settings.POSTGRES_CONNECTION_STRING, help='数据库连接字符串')
+    parser.add_argument('--format', choices=['vector', 'halfvec', 'binary'], default='vector', help='目标向量格式')
+    parser.add_argument('--compact-dims', type=int, help='Matryoshka 截断维度，如 256 或 512，为空时不截断')
+    parser.add_argument('--rescore-factor', type=int, default=4, help='重新打分的候选数倍数，用于召回率检查')
+    parser.add_argument('--reembed', action='store_true', help='用当前的嵌入模型重新嵌入所有记忆')
+    parser.add_argument('--batch-size', type=int, default=64, help='重新嵌入时每批的字段数')
+    parser.add_argument('--keep-old', action='store_true', help='保留旧格式的索引')
+    parser.add_argument('--verify', type=int, default=0, help='召回率检查的抽样查询数，为 0 时不检查')
+    parser.add_argument('--limit', type=int, default=10, help='召回率检查时每次检索返回的结果数')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    report = await migrate(args.uri, OllamaEmbeddings(model='bge-m3:latest'), args)
+    print(json.dumps(report, ensure_ascii=False, indent=4))
+
+
+if __name__ == '__main__':
+    run(main())
@@ -1,8 +1,9 @@
 import logging
-from asyncio import Event, Queue, create_task, to_thread
+from asyncio import CancelledError, Queue, create_task, gather
+from os import makedirs, path
 from pathlib import Path
-from textwrap import dedent
 
+import aiosqlite
 from fastapi import WebSocket
 from langchain_core.messages.ai import AIMessageChunk
 from langchain_core.messages.human import HumanMessage
@@ -10,18 +11,40 @@ from langchain_core.runnables.config import RunnableConfig
 from langchain_mcp_adapters.client import MultiServerMCPClient
 from langchain_ollama import OllamaEmbeddings
 from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
 from langgraph.store.postgres import AsyncPostgresStore
 from langgraph.store.postgres.base import PostgresIndexConfig
 from langmem import create_memory_store_manager
 from psycopg import AsyncConnection
-from psycopg.rows import dict_row
 from psycopg_pool import AsyncConnectionPool
 
 from .assist import (
+    AdmittedChatModel,
+    ChatSearchIndex,
+    CheckpointCompactor,
+    CompactVectorStore,
+    CompressedSerializer,
     DurableReflectionExecutor,
+    EpisodeConsolidator,
     EpisodeMemory,
+    EpisodeRetriever,
+    HedgedChatModel,
+    LatencyHedger,
+    LLMAdmissionController,
+    LLMPriority,
+    MemoryContextCache,
+    MicroBatchedEmbeddings,
+    PendingReflectionManager,
     RemindTaskManager,
+    SchemaMigrator,
+    SqliteChatSearchIndex,
+    SqlitePendingReflectionManager,
+    SqliteRemindTaskManager,
+    SqliteSchemaMigrator,
+    SqliteThreadIndexManager,
+    SqliteVectorStore,
     StateChangeEvent,
+    ThreadIndexManager,
     chat_title_executor,
     connect_deepseek_llm,
     connect_ollama_llm,
@@ -38,22 +61,7 @@ logger = logging.getLogger(__name__)
 class Agent:
     '''智能体'''
 
-    QUERY_SQL = dedent(
-        '''\
-        WITH LatestCheckpoints AS (
-            SELECT thread_id, checkpoint_id, metadata,
-                ROW_NUMBER() OVER (PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC) as rn
-            FROM checkpoints
-            WHERE checkpoint_ns = ''
-        )
-        SELECT thread_id, metadata->>'title' as title
-        FROM LatestCheckpoints
-        WHERE rn = 1
-        ORDER BY checkpoint_id DESC
-        '''
-    )
-
-    def __init__(self, config: Config, state_change_event_queue: Queue, remind_task_scheduler_wakeup_event: Event):
+    def __init__(self, config: Config, state_change_event_queue: Queue):
         self._config: Config | None = config
 
         # 状态相关
@@ -61,14 +69,11 @@ class Agent:
         self._graph_readied: bool = False
         self._llm_activated: bool = False
 
-        # 提醒任务相关
-        self._remind_task_scheduler_wakeup_event: Event | None = remind_task_scheduler_wakeup_event
-
         # 对话标题相关
         self._chat_title_executor_set: set[str] | None = set()
 
         # 初始化相关
-        self._init_variable_about_postgres()
+        self._init_variable_about_storage()
         self._init_variable_about_graph()
         self._init_variable_about_episode_memory()
         self._init_variable_about_llm()
@@ -81,28 +86,50 @@ class Agent:
 
         try:
             logger.info('<init> 初始化')
-            await self._init_postgres()
+            await self._init_storage()
             await self._compile_graph()
+            self._chat_search_index_backfill_task = create_task(self._backfill_chat_search_index())
+            self._message_count_backfill_task = create_task(self._backfill_message_count())
             logger.info('<init> 初始化完成')
         except Exception:
             raise
 
-    def _init_variable_about_postgres(self):
+    def _init_variable_about_storage(self):
+        self._storage_backend = self._config.storage_backend  # 存储后端，'postgres', 'sqlite'
+
+        self._embedding_model = None  # 嵌入模型
+        self._index_config = None  # 索引配置
+        self._store = None  # 长期记忆存储
+        self._checkpointer = None  # 异步检查点保存器
+        self._thread_index_manager: ThreadIndexManager | None = None  # 对话索引管理器
+        self._chat_search_index: ChatSearchIndex | None = None  # 对话搜索索引
+        self._chat_search_index_backfill_task = None  # 对话搜索索引回填任务
+        self._message_count_backfill_task = None  # 对话消息数回填任务
+        self._pending_reflection_manager: PendingReflectionManager | None = None  # 待办反思管理器
+        self._checkpoint_compactor: CheckpointCompactor | None = None  # 检查点压缩器
+        self._episode_consolidator: EpisodeConsolidator | None = None  # 情景记忆整理器
+        self._episode_retriever: EpisodeRetriever | None = None  # 情景记忆检索器
+        self._memory_context_cache: MemoryContextCache | None = None  # 情景记忆上下文缓存
+
+        # Postgres 相关
         self._postgres_connection_string = settings.POSTGRES_CONNECTION_STRING  # 数据库连接字符串
-
-        self._postgres_index_config = None  # 数据库索引配置
         self._postgres_connection_pool = None  # 数据库连接池
-        self._postgres = None  # 数据库
-        self._async_postgres_saver = None  # 异步数据库检查点保存器
 
-    async def _init_postgres(self):
-        '''初始化 Postgres 数据库'''
+        # SQLite 相关
+        self._sqlite_checkpointer_connection = None  # 检查点保存器独占的连接
+        self._sqlite_connection = None  # 提醒任务和对话索引共用的连接
+
+    async def _init_storage(self):
+        '''初始化存储，按配置选择 Postgres 或单机嵌入式的 SQLite 存储后端'''
 
         try:
-            logger.info('<_init_postgres> 初始化 Postgres 数据库')
-            logger.info('<_init_postgres> 初始化数据库索引配置')
-            self._embedding_model = OllamaEmbeddings(model='bge-m3:latest')
-            self._postgres_index_config: PostgresIndexConfig = {
+            logger.info(f'<_init_storage> 初始化存储，存储后端：{self._storage_backend}')
+            self._embedding_model = MicroBatchedEmbeddings(
+                OllamaEmbeddings(model='bge-m3:latest'),
+                self._config.embedding_max_batch_size,
+                self._config.embedding_max_wait_ms,
+            )  # 微批嵌入模型，合并并发的嵌入请求
+            self._index_config = {
                 'dims': 1024,  # 向量维度，嵌入模型输出向量的维度
                 'embed': self._embedding_model,
                 'fields': [
@@ -111,36 +138,155 @@ class Agent:
                     'content.action',
                     'content.result',
                 ],  # 文本内容提取规则，提取 content 对象下的字段并拼接用于生成向量
+                'distance_type': 'cosine',  # 距离类型，距离度量算法，'l2', 'inner_product', 'cosine'
+            }
+            self._checkpoint_serde = CompressedSerializer(
+                threshold=self._config.checkpoint_compression_threshold,
+                codec=self._config.checkpoint_compression_codec,
+                level=self._config.checkpoint_compression_level,
+            )
+
+            if self._storage_backend == 'postgres':
+                await self._init_postgres()
+            elif self._storage_backend == 'sqlite':
+                await self._init_sqlite()
+            else:
+                raise ValueError(f'不支持的存储后端：{self._storage_backend}')
+
+            logger.info('<_init_storage> 初始化情景记忆整理器，检索器和上下文缓存')
+            self._episode_consolidator = EpisodeConsolidator(
+                self._store,
+                self._config.episode_similarity_threshold,
+                self._config.episode_max_memories_per_user,
+            )
+            self._episode_retriever = EpisodeRetriever(
+                self._store,
+                self._config.episode_retrieval_threshold,
+                self._config.episode_retrieval_candidates,
+                self._config.episode_retrieval_max_episodes,
+                self._config.episode_retrieval_mmr_lambda,
+                self._config.episode_retrieval_token_budget,
+            )
+            self._memory_context_cache = MemoryContextCache(
+                self._episode_retriever,
+                self._embedding_model,
+                self._config.memory_context_drift_threshold,
+                self._config.memory_context_refresh_timeout,
+                self._config.memory_context_max_threads,
+            )
+        except Exception:
+            raise
+
+    async def _init_postgres(self):
+        '''初始化 Postgres 数据库'''
+
+        try:
+            logger.info('<_init_postgres> 初始化 Postgres 数据库')
+            logger.info('<_init_postgres> 初始化数据库索引配置')
+            compact_vector = self._config.memory_vector_format != 'vector' or self._config.memory_vector_compact_dims
+            postgres_index_config: PostgresIndexConfig = {
+                **self._index_config,
                 'ann_index_config': {
-                    'kind': 'hnsw',
+                    'kind': 'flat' if compact_vector else 'hnsw',
                     'vector_type': 'vector',
-                },  # 近似最近邻索引配置，近似最近邻检索，索引类型，向量类型
-                'distance_type': 'cosine',  # 距离类型，距离度量算法，'l2', 'inner_product', 'cosine'
+                },  # 近似最近邻索引配置，近似最近邻检索，索引类型，向量类型，使用紧凑表示时由紧凑向量存储建立索引
             }
 
-            logger.info('<_init_postgres> 初始化数据库准备所需动作')
-            async with await AsyncConnection.connect(self._postgres_connection_string, autocommit=True) as conn:
-                temporary_postgres = AsyncPostgresStore(conn, index=self._postgres_index_config)
-                await temporary_postgres.setup()
-                await AsyncPostgresSaver(conn).setup()
-                await RemindTaskManager.setup(conn)
+            logger.info('<_init_postgres> 初始化模式迁移器')
+            schema_migrator = SchemaMigrator(self._postgres_connection_string)
+            schema_migrator.register(
+                'store',
+                [lambda conn: AsyncPostgresStore(conn, index=postgres_index_config).setup()],
+                len(AsyncPostgresStore.MIGRATIONS) + len(AsyncPostgresStore.VECTOR_MIGRATIONS),
+            )
+            schema_migrator.register(
+                'checkpoints', [lambda conn: AsyncPostgresSaver(conn).setup()], len(AsyncPostgresSaver.MIGRATIONS)
+            )
+            schema_migrator.register('remind_tasks', RemindTaskManager.MIGRATIONS)
+            schema_migrator.register('threads', ThreadIndexManager.MIGRATIONS)
+            schema_migrator.register('chat_messages', ChatSearchIndex.MIGRATIONS)
+            schema_migrator.register('pending_reflections', PendingReflectionManager.MIGRATIONS)
 
-            logger.info('<_init_postgres> 初始化数据库连接池')
+            logger.info('<_init_postgres> 迁移数据库模式，同时初始化数据库连接池')
             self._postgres_connection_pool = AsyncConnectionPool(
                 self._postgres_connection_string, min_size=3, max_size=5, open=False
             )
-            await self._postgres_connection_pool.open()
+            applied, _ = await gather(schema_migrator.migrate(), self._postgres_connection_pool.open(wait=True))
+            logger.info(f'<_init_postgres> 数据库模式迁移完成：{applied or '模式已是最新'}')
 
             logger.info('<_init_postgres> 创建数据库')
-            self._postgres = AsyncPostgresStore(self._postgres_connection_pool, index=self._postgres_index_config)
+            self._store = CompactVectorStore(
+                self._postgres_connection_pool,
+                index=postgres_index_config,
+                vector_format=self._config.memory_vector_format,
+                compact_dims=self._config.memory_vector_compact_dims,
+                rescore_factor=self._config.memory_vector_rescore_factor,
+            )
+            if self._store.compact:
+                logger.info(f'<_init_postgres> 检查紧凑向量索引：{self._store.signature}')
+                async with await AsyncConnection.connect(self._postgres_connection_string, autocommit=True) as conn:
+                    if await self._store.setup_vector_index(conn):
+                        logger.warning('<_init_postgres> 紧凑向量索引不存在，已在启动时建立')
 
             logger.info('<_init_postgres> 初始化异步数据库检查点保存器')
-            self._async_postgres_saver = AsyncPostgresSaver(self._postgres_connection_pool)
+            self._checkpointer = AsyncPostgresSaver(self._postgres_connection_pool, serde=self._checkpoint_serde)
+
+            logger.info('<_init_postgres> 初始化对话索引管理器，对话搜索索引，待办反思管理器和提醒任务管理器')
+            self._thread_index_manager = ThreadIndexManager(self._postgres_connection_pool)
+            self._chat_search_index = ChatSearchIndex(self._postgres_connection_pool)
+            self._pending_reflection_manager = PendingReflectionManager(self._postgres_connection_pool)
+            self._remind_task_manager = RemindTaskManager(self._postgres_connection_pool)
+
+            logger.info('<_init_postgres> 初始化检查点压缩器')
+            self._checkpoint_compactor = CheckpointCompactor(
+                self._postgres_connection_pool,
+                self._config.checkpoint_keep_latest,
+                self._config.checkpoint_keep_turn_boundaries,
+                self._config.checkpoint_min_age_seconds,
+                self._config.checkpoint_compaction_batch_size,
+            )
 
             logger.info('<_init_postgres> 初始化 Postgres 数据库完成')
         except Exception:
             raise
 
+    async def _init_sqlite(self):
+        '''初始化 SQLite 数据库，检查点，提醒任务和对话索引保存在同一个数据库文件中，向量保存在内存映射文件中'''
+
+        try:
+            logger.info('<_init_sqlite> 初始化 SQLite 数据库')
+            makedirs(path.dirname(self._config.sqlite_path), exist_ok=True)
+
+            logger.info('<_init_sqlite> 创建长期记忆存储')
+            self._store = SqliteVectorStore(
+                self._config.sqlite_path, self._config.sqlite_vector_path, index=self._index_config
+            )
+            await self._store.setup()
+
+            logger.info('<_init_sqlite> 初始化异步数据库检查点保存器')
+            self._sqlite_checkpointer_connection = await aiosqlite.connect(self._config.sqlite_path)
+            await self._sqlite_checkpointer_connection.execute('PRAGMA journal_mode = WAL')
+            self._checkpointer = AsyncSqliteSaver(self._sqlite_checkpointer_connection, serde=self._checkpoint_serde)
+            await self._checkpointer.setup()
+
+            logger.info('<_init_sqlite> 初始化对话索引管理器，对话搜索索引，待办反思管理器和提醒任务管理器')
+            self._sqlite_connection = await aiosqlite.connect(self._config.sqlite_path)
+            await self._sqlite_connection.execute('PRAGMA busy_timeout = 5000')
+            schema_migrator = SqliteSchemaMigrator(self._sqlite_connection)
+            schema_migrator.register('remind_tasks', SqliteRemindTaskManager.MIGRATIONS)
+            schema_migrator.register('threads', SqliteThreadIndexManager.MIGRATIONS)
+            schema_migrator.register('chat_messages', SqliteChatSearchIndex.MIGRATIONS)
+            schema_migrator.register('pending_reflections', SqlitePendingReflectionManager.MIGRATIONS)
+            await schema_migrator.migrate()
+            self._thread_index_manager = SqliteThreadIndexManager(self._sqlite_connection)
+            self._chat_search_index = SqliteChatSearchIndex(self._sqlite_connection)
+            self._pending_reflection_manager = SqlitePendingReflectionManager(self._sqlite_connection)
+            self._remind_task_manager = SqliteRemindTaskManager(self._sqlite_connection)
+
+            logger.info('<_init_sqlite> 初始化 SQLite 数据库完成')
+        except Exception:
+            raise
+
     def _init_variable_about_graph(self):
         self.current_thread_id = None
         self.user_id = 'liling'
@@ -155,28 +301,26 @@ class Agent:
 
         try:
             logger.info('<_compile_graph> 编译图')
-            if self._async_postgres_saver:
-                self._remind_task_manager = RemindTaskManager(
-                    self._postgres_connection_pool, self._remind_task_scheduler_wakeup_event
-                )
-
+            if self._checkpointer:
                 graph_builder = await create_main_graph_builder(
                     chat_node, self._llm_bind_tools, self._remind_task_manager, self._mcp_tools
                 )
-                self._graph = graph_builder.compile(self._async_postgres_saver)
+                self._graph = graph_builder.compile(self._checkpointer)
 
                 self._graph_readied = True
                 await self._ready_check()
                 logger.info('<_compile_graph> 编译图完成')
             else:
-                raise NameError('''name '_async_postgres_saver(异步 Postgres 数据库检查点保存器)' is not defined''')
+                raise NameError('''name '_checkpointer(异步检查点保存器)' is not defined''')
         except:
             raise
 
     def _init_variable_about_episode_memory(self):
         self._after_seconds = 60 * 3
-        self._episode_memory_count: int = 0  # 情景记忆计数
-        self._is_first_handle_episode_memory = True
+        self._reflection_context_messages = 4  # 反思时水位线之前附带的上下文消息数
+        self._reflection_max_messages = 40  # 反思载荷的最大消息数，载荷大小不随对话长度增长
+        self._reflection_batch_window = 60  # 反思合并窗口，单位秒，窗口内到期的多个对话合并为一次反思
+        self._reflection_max_batch_size = 8  # 每次合并反思的最大对话数
 
         self._memory_store_manager = None  # 记忆存储管理器
         self._durable_reflection_executor = None  # 持久化反思执行器
@@ -188,15 +332,19 @@ class Agent:
             logger.info('<_init_episode_memory> 初始化情景记忆')
             logger.info('<_init_episode_memory> 创建记忆存储管理器')
             self._memory_store_manager = create_memory_store_manager(
-                self._llm,
+                self._background_llm,
                 schemas=[EpisodeMemory],
                 namespace=('memories', self.user_id),
-                store=self._postgres,
+                store=self._store,
             )
 
             logger.debug('<_init_episode_memory> 创建持久反思化执行器')
             self._durable_reflection_executor = await DurableReflectionExecutor.ainit(
-                self._memory_store_manager, self._postgres
+                self._memory_store_manager,
+                self._pending_reflection_manager,
+                batch_window=self._reflection_batch_window,
+                max_batch_size=self._reflection_max_batch_size,
+                on_reflected=self._memory_context_cache.invalidate,  # 写入新记忆后情景记忆上下文缓存失效
             )
             logger.info('<_init_episode_memory> 初始化情景记忆完成')
         except:
@@ -205,9 +353,22 @@ class Agent:
     # 功能相关
     def _init_variable_about_llm(self):
         self._llm_connectors = {'ollama': connect_ollama_llm, 'deepseek': connect_deepseek_llm}
+        self._llm_hedger = LatencyHedger(
+            self._config.hedge_percentile,
+            self._config.hedge_default_delay,
+            self._config.hedge_min_delay,
+            self._config.hedge_max_delay,
+            self._config.hedge_min_samples,
+        )  # 延迟对冲器，跨 LLM 激活保留各供应商的延迟直方图
+        self._llm_admission_controller = LLMAdmissionController(
+            self._config.llm_concurrency_limits,
+            self._config.llm_default_concurrency_limit,
+            self._config.llm_foreground_reserved_slots,
+        )  # LLM 准入控制器
 
         self._embedding_model = None  # 嵌入模型，目前定死
         self._llm = None
+        self._background_llm = None  # 后台优先级的 LLM，用于对话标题和情景记忆反思
         self._llm_bind_tools = self._llm
 
     async def activate_llm(self, platform: str, llm: str):
@@ -215,6 +376,7 @@ class Agent:
 
         self._llm_bind_tools = None
         self._llm = None
+        self._background_llm = None
         self._llm_activated = False
 
         if not platform or not llm:  # 清理
@@ -224,7 +386,7 @@ class Agent:
         try:  # 创建
             logger.info('<activate_llm> 创建 LLM')
             if platform in self._llm_connectors:
-                self._llm = await self._llm_connectors[platform](llm, None, None, None)
+                self._llm, self._background_llm = await self._connect_llm(platform, llm)
 
                 self._llm_activated = True
                 await self._update_tools_bind()
@@ -233,6 +395,44 @@ class Agent:
         except Exception:
             raise
 
+    async def _connect_llm(self, platform: str, llm: str):
+        '''连接 LLM，返回前台和后台两种优先级的 LLM，配置了不同的备用 LLM 时包装为对冲聊天模型'''
+
+        models = [(f'{platform}/{llm}', platform, await self._llm_connectors[platform](llm, None, None, None))]
+
+        backup_platform = self._config.hedge_backup_platform
+        backup_llm = self._config.hedge_backup_llm
+        if backup_platform in self._llm_connectors and backup_llm and (backup_platform, backup_llm) != (platform, llm):
+            logger.info(f'<_connect_llm> 启用对冲，备用 LLM 为 {backup_platform} 的 {backup_llm}')
+            backup = await self._llm_connectors[backup_platform](backup_llm, None, None, None)
+            models.append((f'{backup_platform}/{backup_llm}', backup_platform, backup))
+
+        return self._wrap_llm(models, LLMPriority.FOREGROUND), self._wrap_llm(models, LLMPriority.BACKGROUND)
+
+    def _wrap_llm(self, models: list[tuple], priority: LLMPriority):
+        '''包装 LLM，每个模型经过准入控制，存在备用模型时再包装为对冲聊天模型'''
+
+        admitted_models = [
+            (
+                name,
+                AdmittedChatModel(
+                    inner=model, controller=self._llm_admission_controller, provider=provider, priority=priority
+                ),
+            )
+            for name, provider, model in models
+        ]
+        if len(admitted_models) == 1:
+            return admitted_models[0][1]
+
+        (primary_name, primary), (backup_name, backup) = admitted_models
+        return HedgedChatModel(
+            primary=primary,
+            backup=backup,
+            primary_name=primary_name,
+            backup_name=backup_name,
+            hedger=self._llm_hedger,
+        )
+
     def _init_variable_about_mcp_client(self):
         self._multi_server_mcp_client = None
         self._mcp_tools = []
@@ -294,21 +494,79 @@ class Agent:
         except Exception:
             raise
 
-    async def load_chat_history(self):
-        '''加载对话历史'''
+    async def load_chat_history(self, limit: int | None, cursor: str | None = None) -> tuple[list[dict], str | None]:
+        '''加载对话历史，从对话索引键集分页读取，消息数为 None 表示从检查点回填的对话消息数尚未补全'''
 
-        chat_history = []
         try:
-            async with self._postgres_connection_pool.connection() as conn:
-                async with conn.cursor(row_factory=dict_row) as cur:
-                    await cur.execute(self.QUERY_SQL)
-                    rows = await cur.fetchall()
-                    for row in rows:
-                        chat_history.append({'thread_id': row['thread_id'], 'title': row['title']})
-            return chat_history
+            rows, next_cursor = await self._thread_index_manager.list_threads(limit, cursor)
+            chat_history = [
+                {
+                    'thread_id': row['thread_id'],
+                    'title': row['title'],
+                    'message_count': row['message_count'],
+                    'updated_at': row['updated_at'],
+                }
+                for row in rows
+            ]
+            return chat_history, next_cursor
         except Exception:
             raise
 
+    async def search_chats(self, query: str, limit: int, offset: int = 0) -> tuple[list[dict], int | None]:
+        '''搜索对话，从对话搜索索引读取，不读取检查点'''
+
+        try:
+            return await self._chat_search_index.search(query, limit, offset)
+        except Exception:
+            raise
+
+    async def _backfill_chat_search_index(self):
+        '''回填对话搜索索引，启动时为建立索引前的对话从最新检查点读取消息，之后的对话在轮次提交时增量索引'''
+
+        try:
+            thread_ids = await self._chat_search_index.unindexed_threads()
+            if not thread_ids:
+                return
+
+            logger.info(f'<_backfill_chat_search_index> 回填对话搜索索引，对话数：{len(thread_ids)}')
+            for thread_id in thread_ids:
+                checkpoint_tuple = await self._checkpointer.aget_tuple(
+                    RunnableConfig(configurable={'thread_id': thread_id})
+                )
+                if checkpoint_tuple:
+                    messages = checkpoint_tuple.checkpoint['channel_values'].get('messages', [])
+                    try:
+                        await self._chat_search_index.index_messages(thread_id, messages)
+                    except Exception as e:  # 跳过索引失败的对话，不影响其他对话的回填
+                        logger.error(f'<_backfill_chat_search_index> 回填对话 {thread_id} 报错！！！\n{e}')
+            logger.info('<_backfill_chat_search_index> 回填对话搜索索引完成')
+        except CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f'<_backfill_chat_search_index> 回填对话搜索索引报错！！！\n{e}')
+
+    async def _backfill_message_count(self):
+        '''回填对话消息数，启动时为从检查点回填的对话从最新检查点读取消息数，之后的对话在轮次提交时记录'''
+
+        try:
+            thread_ids = await self._thread_index_manager.unknown_message_count_threads()
+            if not thread_ids:
+                return
+
+            logger.info(f'<_backfill_message_count> 回填对话消息数，对话数：{len(thread_ids)}')
+            for thread_id in thread_ids:
+                checkpoint_tuple = await self._checkpointer.aget_tuple(
+                    RunnableConfig(configurable={'thread_id': thread_id})
+                )
+                if checkpoint_tuple:
+                    messages = checkpoint_tuple.checkpoint['channel_values'].get('messages', [])
+                    await self._thread_index_manager.fill_message_count(thread_id, len(messages))
+            logger.info('<_backfill_message_count> 回填对话消息数完成')
+        except CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f'<_backfill_message_count> 回填对话消息数报错！！！\n{e}')
+
     async def load_chat(self, thread_id: str):
         '''加载对话'''
 
@@ -323,7 +581,7 @@ class Agent:
                 }
             )
 
-            checkpoint_tuple = await self._async_postgres_saver.aget_tuple(config)
+            checkpoint_tuple = await self._checkpointer.aget_tuple(config)
             messages = checkpoint_tuple.checkpoint['channel_values']['messages']
             chat = []
             for message in messages:
@@ -342,7 +600,6 @@ class Agent:
 
         chat_title_executor_activated = False
 
-        episode_memory = ''
         config = RunnableConfig(
             configurable={
                 'thread_id': self.current_thread_id,
@@ -351,46 +608,17 @@ class Agent:
         )
         try:
             # 对话标题相关
-            metadata_to_save = {}
-            checkpoint_tuple = await self._async_postgres_saver.aget_tuple(config)
-            is_new_chat = checkpoint_tuple is None
-
-            if is_new_chat:
-                metadata_to_save = {'title': '新对话', 'title_generated': False, 'chat_round': 1}
-            else:
-                metadata_to_save = checkpoint_tuple.metadata.copy()
-                if not metadata_to_save.get('title_generated', False):
-                    current_chat_round = metadata_to_save.get('chat_round', 0)
-                    new_count = current_chat_round + 1
-                    metadata_to_save['chat_round'] = new_count
-                    if new_count >= 3:
-                        chat_title_executor_activated = True
-
-            config_with_metadata = config.copy()
-            config_with_metadata['metadata'] = metadata_to_save
+            chat_round, title_generated = await self._thread_index_manager.begin_turn(self.current_thread_id)
+            is_new_chat = chat_round == 1
+            if not title_generated and chat_round >= 3:
+                chat_title_executor_activated = True
 
             # 情景记忆相关
-            episodes = await self._postgres.asearch(('memories', self.user_id), query=user_content, limit=2)
-            if episodes:
-                for i, episode in enumerate(episodes):
-                    episode_value = episode.value['content']
-                    episode_memory += dedent(
-                        f'''\
-                        情景记忆 {self._episode_memory_count + 1} :
-                            观察：{episode_value['observation']}
-                            思考：{episode_value['thought']}
-                            行动：{episode_value['action']}
-                            结果：{episode_value['result']}\n
-                        '''
-                    )
-                    self._episode_memory_count += 1
-                if self._is_first_handle_episode_memory:
-                    system_prompt = (
-                        self._config.state['system_prompt'] + self._config.episode_memeory_prompt + episode_memory
-                    )
-                    self._is_first_handle_episode_memory = False
-                else:
-                    system_prompt = self._config.state['system_prompt'] + episode_memory
+            episode_memory = await self._memory_context_cache.get(self.current_thread_id, self.user_id, user_content)
+            if episode_memory:  # 系统提示词每轮替换，有情景记忆时每轮都附带情景记忆的说明
+                system_prompt = (
+                    self._config.state['system_prompt'] + self._config.episode_memeory_prompt + episode_memory
+                )
             else:
                 system_prompt = self._config.state['system_prompt']
 
@@ -405,7 +633,9 @@ class Agent:
             }
 
             # 图运行相关
-            async for event in self._graph.astream_events(current_state, config_with_metadata, version='v1'):
+            async for event in self._graph.astream_events(
+                current_state, config, version='v1', durability=self._config.checkpoint_durability
+            ):
                 event_name = event['name']
                 event_type = event['event']
 
@@ -446,6 +676,15 @@ class Agent:
             if self._gpt_sovits:
                 await self._gpt_sovits.emit_text_final_signal()
 
+            # 对话索引相关
+            final_state = await self._graph.aget_state(config)
+            messages = final_state.values['messages']
+            await self._thread_index_manager.record_turn(self.current_thread_id, len(messages))
+            try:
+                await self._chat_search_index.index_messages(self.current_thread_id, messages)
+            except Exception as e:  # 索引失败不影响对话，未索引的消息在下一轮索引时补上
+                logger.error(f'<chat> 索引对话消息报错！！！\n{e}')
+
             # 对话标题相关
             if is_new_chat:
                 await self._state_change_event_queue.put(StateChangeEvent('chat_title_generated', True))
@@ -458,7 +697,7 @@ class Agent:
                     async def _chat_title_executor_task():
                         try:
                             await chat_title_executor(
-                                checkpoint_tuple, self._llm, self._postgres_connection_pool, thread_id
+                                messages, self._background_llm, self._thread_index_manager, thread_id
                             )
                             await self._state_change_event_queue.put(StateChangeEvent('chat_title_generated', True))
                         except Exception:
@@ -470,13 +709,15 @@ class Agent:
 
             # 情景记忆相关
             if self._durable_reflection_executor:
-                final_state = await self._graph.aget_state(config)
-                messages = final_state.values['messages']
-                serializable_messages = [message.dict() for message in messages]
+                watermark = await self._durable_reflection_executor.aget_watermark(self.current_thread_id)
+                delta_start = max(watermark, len(messages) - self._reflection_max_messages)
+                start = max(0, delta_start - self._reflection_context_messages)
+                serializable_messages = [message.dict() for message in messages[start:]]
                 await self._durable_reflection_executor.asubmit(
                     {'messages': serializable_messages},
                     config=config,
                     after_seconds=self._after_seconds,
+                    watermark=len(messages),
                 )
 
         except Exception:
@@ -484,12 +725,26 @@ class Agent:
         finally:
             await self._state_change_event_queue.put(StateChangeEvent('input_ready', True))
 
-    async def reset_chat_state(self):
-        '''重置对话状态'''
+    async def reset_chat_state(self, thread_id: str):
+        '''重置对话状态，删除对话的情景记忆上下文缓存，连接对话后的第一轮重新检索情景记忆'''
+
+        logger.info(f'<reset_chat_state> 重置对话状态，对话 ID：{thread_id}')
+        if self._memory_context_cache:
+            self._memory_context_cache.discard(thread_id)
+
+    def metrics(self) -> dict:
+        '''获取运行指标'''
 
-        logger.info('<reset_chat_state> 重置对话状态')
-        self._episode_memory_count = 0
-        self._is_first_handle_episode_memory = True
+        return {
+            'llm_admission': self._llm_admission_controller.snapshot(),
+            'llm_hedge': self._llm_hedger.snapshot(),
+            'checkpoint_compaction': self._checkpoint_compactor.last_report if self._checkpoint_compactor else None,
+            'episode_consolidation': self._episode_consolidator.last_report if self._episode_consolidator else None,
+            'reflection': self._durable_reflection_executor.snapshot() if self._durable_reflection_executor else None,
+            'embedding': self._embedding_model.snapshot() if self._embedding_model else None,
+            'episode_retrieval': self._episode_retriever.snapshot() if self._episode_retriever else None,
+            'memory_context': self._memory_context_cache.snapshot() if self._memory_context_cache else None,
+        }
 
     # 辅助相关
     async def _ready_check(self):
@@ -522,7 +777,7 @@ class Agent:
 
             if self._durable_reflection_executor:
                 logger.info('<clean> 关闭并清理持久化反思执行器')
-                await to_thread(self._durable_reflection_executor.shutdown, wait=True, cancel_futures=True)
+                await self._durable_reflection_executor.ashutdown()
                 self._durable_reflection_executor = None
 
             if self._memory_store_manager:
@@ -532,25 +787,53 @@ class Agent:
             if self._graph_readied:
                 logger.info('<clean> 清理图')
                 self._graph_readied = False
-                self._remind_task_manager = None
                 self.graph = None
 
-            if self._async_postgres_saver:
-                logger.info('<clean> 清理异步数据库检查点保存器')
-                self._async_postgres_saver = None
-
-            if self._postgres:
-                logger.debug('<clean> 清理数据库')
-                self._postgres = None
+            if self._chat_search_index_backfill_task:
+                self._chat_search_index_backfill_task.cancel()
+                await gather(self._chat_search_index_backfill_task, return_exceptions=True)
+                self._chat_search_index_backfill_task = None
+
+            if self._message_count_backfill_task:
+                self._message_count_backfill_task.cancel()
+                await gather(self._message_count_backfill_task, return_exceptions=True)
+                self._message_count_backfill_task = None
+
+            if self._checkpointer:
+                logger.info('<clean> 清理异步检查点保存器')
+                self._checkpointer = None
+                self._thread_index_manager = None
+                self._chat_search_index = None
+                self._pending_reflection_manager = None
+                self._remind_task_manager = None
+                self._checkpoint_compactor = None
+
+            if self._store:
+                logger.debug('<clean> 清理长期记忆存储')
+                self._episode_consolidator = None
+                self._episode_retriever = None
+                if self._memory_context_cache:
+                    self._memory_context_cache.clear()
+                    self._memory_context_cache = None
+                if isinstance(self._store, SqliteVectorStore):
+                    self._store.close()
+                self._store = None
 
             if self._postgres_connection_pool:
                 logger.debug('<clean> 关闭并清理数据库连接池')
                 await self._postgres_connection_pool.close()  # 安全地关闭所有数据库连接并清理资源，确保程序干净退出
                 self._postgres_connection_pool = None
 
-            if self._postgres_index_config:
-                logger.debug('<clean> 清理数据库索引配置')
-                self._postgres_index_config = None
+            if self._sqlite_connection:
+                logger.debug('<clean> 关闭并清理 SQLite 数据库连接')
+                await self._sqlite_connection.close()
+                await self._sqlite_checkpointer_connection.close()
+                self._sqlite_connection = None
+                self._sqlite_checkpointer_connection = None
+
+            if self._index_config:
+                logger.debug('<clean> 清理索引配置')
+                self._index_config = None
                 self._embedding_model = None
 
             logger.debug('<clean> 清理完毕')
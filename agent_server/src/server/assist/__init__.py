@@ -1,5 +1,35 @@
-from .assist import chat_title_executor, connect_deepseek_llm, connect_ollama_llm, remind_task_scheduler
+from .assist import (
+    chat_title_executor,
+    checkpoint_compaction_scheduler,
+    connect_deepseek_llm,
+    connect_ollama_llm,
+    episode_consolidation_scheduler,
+    remind_task_scheduler,
+)
+from .chat_search_index import ChatSearchIndex, SqliteChatSearchIndex
+from .checkpoint_compactor import CheckpointCompactor
+from .compact_vector_store import CompactVectorStore
+from .compressed_serializer import CompressedSerializer
 from .durable_reflection import DurableReflectionExecutor
-from .remind_task_manager import RemindTaskManager
-from .type import ActivationRequest, EpisodeMemory, LLMActivationRequest, StateChangeEvent
+from .episode_consolidator import EpisodeConsolidator
+from .episode_retriever import EpisodeRetriever, estimate_tokens
+from .hedged_chat_model import HedgedChatModel, LatencyHedger
+from .llm_admission_controller import AdmittedChatModel, LLMAdmissionController, LLMPriority
+from .memory_context_cache import MemoryContextCache
+from .memory_vectors import MemoryVectors, load_memory_vectors, memory_index_stats
+from .micro_batched_embeddings import MicroBatchedEmbeddings
+from .pending_reflection_manager import PendingReflectionManager, SqlitePendingReflectionManager
+from .recurrence import Recurrence
+from .remind_task_manager import RemindTaskManager, RemindTaskQueue, SqliteRemindTaskManager
+from .schema_migrator import SchemaMigrator, SqliteSchemaMigrator
+from .sqlite_vector_store import SqliteVectorStore
+from .thread_index_manager import SqliteThreadIndexManager, ThreadIndexManager
+from .type import (
+    ActivationRequest,
+    ChatHistoryRequest,
+    ChatSearchRequest,
+    EpisodeMemory,
+    LLMActivationRequest,
+    StateChangeEvent,
+)
 from .websocket_connection_manager import WebSocketConnectionManager
@@ -1,4 +1,4 @@
-from asyncio import CancelledError, Event, TimeoutError, sleep, wait_for
+from asyncio import CancelledError, Event, TimeoutError, create_task, sleep, wait_for
 from datetime import datetime
 from logging import Logger
 from os import getenv
@@ -6,11 +6,14 @@ from textwrap import dedent
 from traceback import format_exc
 
 from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
 from langchain_deepseek import ChatDeepSeek
 from langchain_ollama import ChatOllama
-from langgraph.checkpoint.base import CheckpointTuple
 
-from .remind_task_manager import RemindTaskManager
+from .checkpoint_compactor import CheckpointCompactor
+from .episode_consolidator import EpisodeConsolidator
+from .remind_task_manager import RemindTaskManager, RemindTaskQueue
+from .thread_index_manager import ThreadIndexManager
 from .websocket_connection_manager import WebSocketConnectionManager
 
 
@@ -44,49 +47,133 @@ async def connect_deepseek_llm(model, api_key, temperature, max_tokens):
 # 提醒任务相关
 async def remind_task_scheduler(
     remind_task_manager: RemindTaskManager,
-    remind_task_scheduler_wakeup_event: Event,
     websocket_connection_manager: WebSocketConnectionManager,
     user_id: str,
     logger: Logger,
+    claim_batch_size: int = 100,
 ):
-    '''提醒任务调度器'''
+    '''
+    提醒任务调度器，未完成任务的 id 和到期时间保存在内存中的最小堆里，等待到堆顶任务到期时才批量认领并发送提醒。
+    每批认领只需一条语句，多个进程同时调度时每个任务只由认领到的进程提醒。
+    认领时即标记完成，发送失败或被取消时释放未发送的任务，恢复为未完成后重新认领，每个任务至少提醒一次。
+    新任务通过提醒任务管理器的通知加入堆中，监听建立或重连后重新读取一次未完成的任务，补上断开期间错过的通知。
+    '''
+
+    queue = RemindTaskQueue()
+    wakeup = Event()  # 堆顶变化时唤醒
+
+    async def listen():
+        while True:
+            try:
+                async with remind_task_manager.listen() as notifications:
+                    queue.clear()
+                    for task_id, due_time in await remind_task_manager.get_pending_tasks():
+                        queue.push(task_id, due_time)
+                    wakeup.set()
+                    logger.info(f'<remind_task_scheduler> 开始监听提醒任务，未完成的任务数：{len(queue)}')
+
+                    async for task_id, due_time in notifications:
+                        queue.push(task_id, due_time)
+                        wakeup.set()
+            except CancelledError:
+                raise
+            except Exception:
+                logger.error(f'<remind_task_scheduler> 监听提醒任务报错，5 秒后重连！！！\n{format_exc()}')
+            await sleep(5)
+
+    listener_task = create_task(listen())
+    try:
+        while True:
+            try:
+                wakeup.clear()
+                due_tasks = queue.pop_due(datetime.now())
+                if due_tasks:
+                    try:
+                        while True:
+                            tasks = await remind_task_manager.claim_due_tasks(claim_batch_size)
+                            sent = 0
+                            try:
+                                for task in tasks:
+                                    payload = f'提醒：{task['description']}\n上下文：{task['context']}'
+                                    if task.get('next_due_time'):
+                                        payload += f'\n下次提醒：{task['next_due_time']:%Y-%m-%d %H:%M}'
+                                    message = {'type': 'remind_task', 'payload': payload}
+                                    await websocket_connection_manager.broadcast_notification(user_id, message)
+                                    sent += 1
+                            except BaseException:
+                                await remind_task_manager.release_tasks(tasks[sent:])
+                                raise
+                            if len(tasks) < claim_batch_size:
+                                break
+                    except Exception:
+                        for task_id, due_time in due_tasks:
+                            queue.push(task_id, due_time)  # 认领失败时放回堆中，重试时再认领
+                        raise
+                    continue
+
+                due_time = queue.next_due_time()
+                timeout = max(0, (due_time - datetime.now()).total_seconds()) if due_time else None
+                try:
+                    await wait_for(wakeup.wait(), timeout=timeout)
+                except TimeoutError:
+                    pass
+            except CancelledError:
+                break
+            except Exception:
+                e = format_exc()
+                logger.error(f'<remind_task_scheduler> 提醒任务调度器报错！！！\n{e}')
+                await sleep(5)
+    finally:
+        listener_task.cancel()
+
+
+# 检查点相关
+async def checkpoint_compaction_scheduler(checkpoint_compactor: CheckpointCompactor, interval: float, logger: Logger):
+    '''检查点压缩调度器，按间隔在后台压缩检查点'''
 
     while True:
         try:
-            remind_task_scheduler_wakeup_event.clear()
+            report = await checkpoint_compactor.compact()
+            logger.info(
+                f'<checkpoint_compaction_scheduler> 检查点压缩完成，删除检查点 {report['checkpoints']} 个，'
+                f'写入 {report['writes']} 个，通道数据 {report['blobs']} 个，回收 {report['bytes']} 字节'
+            )
+            await sleep(interval)
+        except CancelledError:
+            break
+        except Exception:
+            e = format_exc()
+            logger.error(f'<checkpoint_compaction_scheduler> 检查点压缩调度器报错！！！\n{e}')
+            await sleep(interval)
 
-            due_time = await remind_task_manager.get_next_task_due_time()
-            if due_time:
-                wait_tiem = max(1, (due_time - datetime.now()).total_seconds())
-            else:
-                wait_tiem = 30
-                if logger:
-                    logger.info(f'<remind_task_scheduler> 当前没有提醒任务，调度器将在 {wait_tiem} 秒后再次检查。')
 
-            try:
-                await wait_for(remind_task_scheduler_wakeup_event.wait(), timeout=wait_tiem)
-            except TimeoutError:
-                pass
-
-            due_tasks = await remind_task_manager.get_due_tasks()
-            for task in due_tasks:
-                message = {'type': 'remind_task', 'payload': f'提醒：{task['description']}\n上下文：{task['context']}'}
-                await websocket_connection_manager.broadcast_notification(user_id, message)
-                await remind_task_manager.mark_task_completed(task.get('id'))
+# 情景记忆相关
+async def episode_consolidation_scheduler(episode_consolidator: EpisodeConsolidator, interval: float, logger: Logger):
+    '''情景记忆整理调度器，按间隔在后台整理情景记忆'''
+
+    while True:
+        try:
+            report = await episode_consolidator.consolidate()
+            logger.info(
+                f'<episode_consolidation_scheduler> 情景记忆整理完成，删除重复记忆 {report['duplicates']} 条，'
+                f'超出上限的记忆 {report['capped']} 条，向量 {report['vectors_before']} -> {report['vectors_after']}'
+            )
+            await sleep(interval)
         except CancelledError:
             break
         except Exception:
             e = format_exc()
-            logger.error(f'<remind_task_scheduler> 提醒任务调度器报错！！！\n{e}')
-            await sleep(5)
+            logger.error(f'<episode_consolidation_scheduler> 情景记忆整理调度器报错！！！\n{e}')
+            await sleep(interval)
 
 
 # 对话历史相关
-async def chat_title_executor(checkpoint_tuple: CheckpointTuple, llm: BaseChatModel, connection_pool, thread_id):
+async def chat_title_executor(
+    messages: list[BaseMessage], llm: BaseChatModel, thread_index_manager: ThreadIndexManager, thread_id
+):
     '''对话标题处理器'''
 
     try:
-        messages = checkpoint_tuple.checkpoint['channel_values']['messages']
         contents = '\n'.join([f'{message.type}: {message.content}' for message in messages[:]])
 
         chat_title_executor_prompt = dedent(
@@ -105,26 +192,6 @@ async def chat_title_executor(checkpoint_tuple: CheckpointTuple, llm: BaseChatMo
         if not title:
             return
 
-        UPDATE_SQL = dedent(
-            '''\
-            UPDATE checkpoints
-            SET metadata = jsonb_set(
-                jsonb_set(
-                    metadata,
-                    '{title}',
-                    to_jsonb(%s::text),
-                    true
-                ),
-                '{title_generated}',
-                'true'::jsonb,
-                true
-            )
-            WHERE thread_id = %s
-            '''
-        )
-        async with connection_pool.connection() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(UPDATE_SQL, (title, thread_id))
-            await conn.commit()
+        await thread_index_manager.set_title(thread_id, title)
     except Exception:
         raise
@@ -0,0 +1,308 @@
+import re
+from textwrap import dedent
+
+import aiosqlite
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from psycopg import AsyncConnection
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+from .sqlite_transaction import sqlite_transaction
+
+CJK_PATTERN = re.compile(r'[㐀-䶿一-鿿豈-﫿]+')
+WORD_PATTERN = re.compile(r'[㐀-䶿一-鿿豈-﫿]+|[^\W_㐀-䶿一-鿿豈-﫿]+')  # 中文和其他文字在边界处切开
+
+
+def tokenize(text: str) -> list[str]:
+    '''分词，中文按字切分为一元和二元词，其他文字按单词切分并转为小写，返回按出现顺序排列的词'''
+
+    tokens = []
+    for match in WORD_PATTERN.finditer(text):
+        word = match.group()
+        if not CJK_PATTERN.fullmatch(word):
+            tokens.append(word.lower())
+            continue
+
+        for i, char in enumerate(word):
+            tokens.append(char)
+            if i < len(word) - 1:
+                tokens.append(word[i : i + 2])
+    return tokens
+
+
+def tokenize_query(query: str) -> list[list[str]]:
+    '''
+    查询分词，返回词组列表，词组之间为与，词组内为或。
+    两个字以上的中文只使用二元词，词组内任一二元词命中即可，如“北京天气”可命中“北京的天气”，命中越多排名越高。
+    '''
+
+    groups = []
+    for match in WORD_PATTERN.finditer(query):
+        word = match.group()
+        if CJK_PATTERN.fullmatch(word) and len(word) > 1:
+            groups.append(list(dict.fromkeys(word[i : i + 2] for i in range(len(word) - 1))))
+        else:
+            groups.append([word.lower()])
+    return groups
+
+
+def highlight(content: str, query: str, context: int = 40) -> tuple[str, list[tuple[int, int]]]:
+    '''高亮，截取首个命中词附近的片段，返回片段和片段内命中词的起止位置'''
+
+    words = sorted({token for group in tokenize_query(query) for token in group}, key=len, reverse=True)
+    if not words:
+        return content[: context * 2], []
+
+    pattern = re.compile('|'.join(re.escape(word) for word in words), re.IGNORECASE)
+    first = pattern.search(content)
+    start = max(0, first.start() - context) if first else 0
+    end = min(len(content), (first.end() if first else 0) + context * 2)
+    snippet = content[start:end]
+    return snippet, [(match.start(), match.end()) for match in pattern.finditer(snippet)]
+
+
+class ChatSearchIndex:
+    '''对话搜索索引，对话轮次提交后增量写入消息文本的倒排索引，查询时不读取检查点'''
+
+    CREATE_TABLE_SQL = dedent(
+        '''\
+        CREATE TABLE IF NOT EXISTS chat_messages (
+            thread_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            tsv TSVECTOR NOT NULL,
+            created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT LOCALTIMESTAMP NOT NULL,
+            PRIMARY KEY (thread_id, seq)
+        );
+        '''
+    )
+
+    CREATE_INDEX_SQL = 'CREATE INDEX IF NOT EXISTS chat_messages_tsv_idx ON chat_messages USING GIN (tsv);'
+
+    SELECT_CONTENTS_SQL = 'SELECT thread_id, seq, content FROM chat_messages'
+
+    UPDATE_TSV_SQL = 'UPDATE chat_messages SET tsv = %s::tsvector WHERE thread_id = %s AND seq = %s'
+
+    @staticmethod
+    async def _retokenize(conn: AsyncConnection):
+        '''重新分词已索引的消息，中文和其他文字改为在边界处切开后，旧的词不再被查询命中'''
+
+        async with conn.cursor() as cur:
+            await cur.execute(ChatSearchIndex.SELECT_CONTENTS_SQL)
+            rows = await cur.fetchall()
+            await cur.executemany(
+                ChatSearchIndex.UPDATE_TSV_SQL,
+                [
+                    (ChatSearchIndex._to_tsvector(tokenize(content)), thread_id, seq)
+                    for thread_id, seq, content in rows
+                ],
+            )
+
+    MIGRATIONS = [CREATE_TABLE_SQL, CREATE_INDEX_SQL, _retokenize]  # 模式迁移，只能追加
+
+    SELECT_NEXT_SEQ_SQL = 'SELECT COALESCE(MAX(seq) + 1, 0) FROM chat_messages WHERE thread_id = %s'
+
+    INSERT_SQL = dedent(
+        '''\
+        INSERT INTO chat_messages (thread_id, seq, role, content, tsv)
+        VALUES (%s, %s, %s, %s, %s::tsvector)
+        ON CONFLICT (thread_id, seq) DO NOTHING
+        '''
+    )
+
+    SELECT_UNINDEXED_THREADS_SQL = dedent(
+        '''\
+        SELECT DISTINCT thread_id FROM checkpoints
+        WHERE checkpoint_ns = '' AND thread_id NOT IN (SELECT thread_id FROM chat_messages)
+        '''
+    )
+
+    SEARCH_SQL = dedent(
+        '''\
+        SELECT m.thread_id, m.seq, m.role, m.content, m.created_at, t.title, ts_rank_cd(m.tsv, q.query) AS rank
+        FROM chat_messages m
+            CROSS JOIN (SELECT %s::tsquery AS query) q
+            LEFT JOIN threads t ON t.thread_id = m.thread_id
+        WHERE m.tsv @@ q.query
+        ORDER BY rank DESC, m.created_at DESC, m.seq DESC
+        LIMIT %s OFFSET %s
+        '''
+    )
+
+    MAX_LEXEME_BYTES = 2046  # tsvector 中单个词的字节数上限，超出时整条插入报错
+
+    def __init__(self, pool: AsyncConnectionPool):
+        self._pool = pool
+
+    @staticmethod
+    def _quote(token: str) -> str:
+        return "'" + token.replace('\\', '\\\\').replace("'", "''") + "'"
+
+    @classmethod
+    def _to_tsvector(cls, tokens: list[str]) -> str:
+        '''生成带位置的 tsvector 文本，词由 Python 切分，不经过数据库的文本解析器，跳过超长的词'''
+
+        positions: dict[str, list[int]] = {}
+        for position, token in enumerate(tokens[:16383], start=1):  # tsvector 位置上限为 16383
+            if len(token.encode()) <= cls.MAX_LEXEME_BYTES:
+                positions.setdefault(token, []).append(position)
+        return ' '.join(f'{cls._quote(token)}:{','.join(map(str, p[:256]))}' for token, p in positions.items())
+
+    @classmethod
+    def _to_tsquery(cls, groups: list[list[str]]) -> str:
+        return ' & '.join(f'({' | '.join(cls._quote(token) for token in group)})' for group in groups)
+
+    @staticmethod
+    def _indexable(messages: list[BaseMessage], start: int) -> list[tuple[int, str, str]]:
+        '''可索引的消息，只索引用户消息和有文本内容的 AI 消息，跳过工具调用和工具输出'''
+
+        indexable = []
+        for seq in range(start, len(messages)):
+            message = messages[seq]
+            if isinstance(message, (HumanMessage, AIMessage)) and isinstance(message.content, str):
+                if message.content.strip():
+                    indexable.append((seq, message.type, message.content))
+        return indexable
+
+    async def index_messages(self, thread_id: str, messages: list[BaseMessage]):
+        '''索引消息，只写入上次索引之后新增的消息'''
+
+        async with self._pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(self.SELECT_NEXT_SEQ_SQL, (thread_id,))
+                (start,) = await cur.fetchone()
+                rows = [
+                    (thread_id, seq, role, content, self._to_tsvector(tokenize(content)))
+                    for seq, role, content in self._indexable(messages, start)
+                ]
+                if rows:
+                    await cur.executemany(self.INSERT_SQL, rows)
+            await conn.commit()
+
+    async def unindexed_threads(self) -> list[str]:
+        '''获取尚未索引的对话，用于回填，以根命名空间检查点为准，包含建立对话索引前的对话'''
+
+        async with self._pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(self.SELECT_UNINDEXED_THREADS_SQL)
+                return [row[0] for row in await cur.fetchall()]
+
+    async def search(self, query: str, limit: int, offset: int = 0) -> tuple[list[dict], int | None]:
+        '''搜索，按相关度排序分页，返回本页结果和下一页偏移量'''
+
+        groups = tokenize_query(query)
+        if not groups:
+            return [], None
+
+        async with self._pool.connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                await cur.execute(self.SEARCH_SQL, (self._to_tsquery(groups), limit + 1, offset))
+                rows = await cur.fetchall()
+
+        return self._present(rows[:limit], query), offset + limit if len(rows) > limit else None
+
+    @staticmethod
+    def _present(rows: list[dict], query: str) -> list[dict]:
+        results = []
+        for row in rows:
+            snippet, highlights = highlight(row['content'], query)
+            results.append(
+                {
+                    'thread_id': row['thread_id'],
+                    'title': row['title'],
+                    'seq': row['seq'],
+                    'is_user': row['role'] == 'human',
+                    'snippet': snippet,
+                    'highlights': highlights,
+                    'rank': round(float(row['rank']), 6),
+                    'created_at': row['created_at'],
+                }
+            )
+        return results
+
+
+class SqliteChatSearchIndex(ChatSearchIndex):
+    '''SQLite 对话搜索索引，使用 FTS5 全文索引，词由 Python 切分后以空格连接写入'''
+
+    CREATE_TABLE_SQL = dedent(
+        '''\
+        CREATE VIRTUAL TABLE IF NOT EXISTS chat_messages USING fts5 (
+            thread_id UNINDEXED,
+            seq UNINDEXED,
+            role UNINDEXED,
+            content UNINDEXED,
+            created_at UNINDEXED,
+            tokens,
+            tokenize = 'unicode61'
+        );
+        '''
+    )
+
+    SELECT_CONTENTS_SQL = 'SELECT rowid, content FROM chat_messages'
+
+    UPDATE_TOKENS_SQL = 'UPDATE chat_messages SET tokens = ? WHERE rowid = ?'
+
+    @staticmethod
+    async def _retokenize(conn: aiosqlite.Connection):
+        '''重新分词已索引的消息，中文和其他文字改为在边界处切开后，旧的词不再被查询命中'''
+
+        async with conn.execute(SqliteChatSearchIndex.SELECT_CONTENTS_SQL) as cur:
+            rows = await cur.fetchall()
+        await conn.executemany(
+            SqliteChatSearchIndex.UPDATE_TOKENS_SQL, [(' '.join(tokenize(content)), rowid) for rowid, content in rows]
+        )
+
+    MIGRATIONS = [CREATE_TABLE_SQL, _retokenize]
+
+    SELECT_NEXT_SEQ_SQL = 'SELECT COALESCE(MAX(seq) + 1, 0) FROM chat_messages WHERE thread_id = ?'
+
+    INSERT_SQL = dedent(
+        '''\
+        INSERT INTO chat_messages (thread_id, seq, role, content, created_at, tokens)
+        VALUES (?, ?, ?, ?, datetime('now', 'localtime'), ?)
+        '''
+    )
+
+    SEARCH_SQL = dedent(
+        '''\
+        SELECT m.thread_id, m.seq, m.role, m.content, m.created_at, t.title, -bm25(chat_messages) AS rank
+        FROM chat_messages m
+            LEFT JOIN threads t ON t.thread_id = m.thread_id
+        WHERE chat_messages MATCH ?
+        ORDER BY rank DESC, m.created_at DESC, m.seq DESC
+        LIMIT ? OFFSET ?
+        '''
+    )
+
+    def __init__(self, conn: aiosqlite.Connection):
+        self._conn = conn
+
+    async def index_messages(self, thread_id: str, messages: list[BaseMessage]):
+        async with sqlite_transaction(self._conn) as conn:  # 读取序号和插入在同一事务中，并发索引不会重复插入
+            async with conn.execute(self.SELECT_NEXT_SEQ_SQL, (thread_id,)) as cur:
+                (start,) = await cur.fetchone()
+            rows = [
+                (thread_id, seq, role, content, ' '.join(tokenize(content)))
+                for seq, role, content in self._indexable(messages, start)
+            ]
+            if rows:
+                await conn.executemany(self.INSERT_SQL, rows)
+
+    async def unindexed_threads(self) -> list[str]:
+        async with self._conn.execute(self.SELECT_UNINDEXED_THREADS_SQL) as cur:
+            return [row[0] for row in await cur.fetchall()]
+
+    async def search(self, query: str, limit: int, offset: int = 0) -> tuple[list[dict], int | None]:
+        groups = tokenize_query(query)
+        if not groups:
+            return [], None
+
+        match = ' AND '.join(
+            f'({' OR '.join(f'"{token.replace('"', '""')}"' for token in group)})' for group in groups
+        )
+        async with self._conn.execute(self.SEARCH_SQL, (match, limit + 1, offset)) as cur:
+            columns = [column[0] for column in cur.description]
+            rows = [dict(zip(columns, row)) for row in await cur.fetchall()]
+
+        return self._present(rows[:limit], query), offset + limit if len(rows) > limit else None
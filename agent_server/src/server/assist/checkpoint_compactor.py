@@ -0,0 +1,172 @@
+from asyncio import sleep
+from datetime import datetime
+from textwrap import dedent
+
+from psycopg.errors import LockNotAvailable
+from psycopg_pool import AsyncConnectionPool
+
+
+class CheckpointCompactor:
+    '''检查点压缩器，按保留策略分批删除旧的超步检查点和不再可达的子图检查点，及其写入和不再被引用的通道数据，统计回收的空间'''
+
+    SELECT_THREADS_SQL = dedent(
+        '''\
+        SELECT DISTINCT thread_id FROM checkpoints
+        WHERE thread_id > %s
+        ORDER BY thread_id LIMIT %s
+        '''
+    )
+
+    # 保留策略只作用于根命名空间的检查点，子图命名空间的检查点依附于运行时的根检查点，记录在 metadata 的 parents 中，
+    # 根检查点已删除或本次删除后，子图检查点不再可达，一并删除
+    # 轮次边界检查点即没有紧随其后的超步检查点的检查点，其子检查点是下一轮的输入检查点，已被删除，
+    # 或是只在轮次结束时持久化的下一轮检查点，超步数不连续，多次压缩结果不变
+    # 数据修改 CTE 共享同一快照，检查点和写入在同一语句中删除
+    DELETE_CHECKPOINTS_SQL = dedent(
+        '''\
+        WITH Ranked AS (
+            SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, metadata,
+                (checkpoint->>'ts')::timestamptz AS ts,
+                ROW_NUMBER() OVER (PARTITION BY thread_id ORDER BY checkpoint_id DESC) AS rn
+            FROM checkpoints
+            WHERE thread_id = ANY(%(thread_ids)s) AND checkpoint_ns = ''
+        ),
+        ExpiredRoots AS (
+            SELECT r.thread_id, r.checkpoint_ns, r.checkpoint_id FROM Ranked r
+            WHERE r.rn > %(keep_latest)s AND r.ts < now() - make_interval(secs => %(min_age_seconds)s)
+                AND (
+                    NOT %(keep_turn_boundaries)s
+                    OR EXISTS (
+                        SELECT 1 FROM Ranked child
+                        WHERE child.thread_id = r.thread_id AND child.parent_checkpoint_id = r.checkpoint_id
+                            AND child.metadata->>'source' = 'loop'
+                            AND (child.metadata->>'step')::integer = (r.metadata->>'step')::integer + 1
+                    )
+                )
+        ),
+        ExpiredSubgraphs AS (
+            SELECT s.thread_id, s.checkpoint_ns, s.checkpoint_id FROM checkpoints s
+            WHERE s.thread_id = ANY(%(thread_ids)s) AND s.checkpoint_ns <> ''
+                AND (s.checkpoint->>'ts')::timestamptz < now() - make_interval(secs => %(min_age_seconds)s)
+                AND NOT EXISTS (
+                    SELECT 1 FROM Ranked r
+                    WHERE r.thread_id = s.thread_id AND r.checkpoint_id = s.metadata->'parents'->>''
+                        AND NOT EXISTS (
+                            SELECT 1 FROM ExpiredRoots e
+                            WHERE e.thread_id = r.thread_id AND e.checkpoint_id = r.checkpoint_id
+                        )
+                )
+        ),
+        Expired AS (
+            SELECT * FROM ExpiredRoots
+            UNION ALL
+            SELECT * FROM ExpiredSubgraphs
+        ),
+        DeletedCheckpoints AS (
+            DELETE FROM checkpoints c USING Expired e
+            WHERE c.thread_id = e.thread_id AND c.checkpoint_ns = e.checkpoint_ns AND c.checkpoint_id = e.checkpoint_id
+            RETURNING pg_column_size(c.*) AS size
+        ),
+        DeletedWrites AS (
+            DELETE FROM checkpoint_writes w USING Expired e
+            WHERE w.thread_id = e.thread_id AND w.checkpoint_ns = e.checkpoint_ns AND w.checkpoint_id = e.checkpoint_id
+            RETURNING pg_column_size(w.*) AS size
+        )
+        SELECT
+            (SELECT COUNT(*) FROM DeletedCheckpoints), (SELECT COALESCE(SUM(size), 0) FROM DeletedCheckpoints),
+            (SELECT COUNT(*) FROM DeletedWrites), (SELECT COALESCE(SUM(size), 0) FROM DeletedWrites)
+        '''
+    )
+
+    # 通道数据只在版本变化时写入，剩余检查点的通道版本中不再出现的版本才能删除
+    DELETE_BLOBS_SQL = dedent(
+        '''\
+        WITH DeletedBlobs AS (
+            DELETE FROM checkpoint_blobs b
+            WHERE b.thread_id = ANY(%(thread_ids)s)
+                AND NOT EXISTS (
+                    SELECT 1 FROM checkpoints c
+                    WHERE c.thread_id = b.thread_id AND c.checkpoint_ns = b.checkpoint_ns
+                        AND c.checkpoint->'channel_versions'->>b.channel = b.version
+                )
+            RETURNING pg_column_size(b.*) AS size
+        )
+        SELECT COUNT(*), COALESCE(SUM(size), 0) FROM DeletedBlobs
+        '''
+    )
+
+    def __init__(
+        self,
+        pool: AsyncConnectionPool,
+        keep_latest: int = 1,
+        keep_turn_boundaries: bool = True,
+        min_age_seconds: float = 600,
+        thread_batch_size: int = 20,
+        batch_pause: float = 0.5,
+        lock_timeout: str = '1s',
+    ):
+        self._pool = pool
+        self._keep_latest = max(1, keep_latest)  # 最新检查点总是保留，对话从最新检查点继续
+        self._keep_turn_boundaries = keep_turn_boundaries
+        self._min_age_seconds = min_age_seconds
+        self._thread_batch_size = thread_batch_size
+        self._batch_pause = batch_pause
+        self._lock_timeout = lock_timeout
+
+        self.last_report: dict | None = None
+
+    async def _compact_batch(self, thread_ids: list[str]) -> dict:
+        '''压缩一批对话，在同一事务中删除检查点，写入和通道数据，锁等待超时则放弃本批，不阻塞对话'''
+
+        params = {
+            'thread_ids': thread_ids,
+            'keep_latest': self._keep_latest,
+            'keep_turn_boundaries': self._keep_turn_boundaries,
+            'min_age_seconds': self._min_age_seconds,
+        }
+        async with self._pool.connection() as conn:
+            async with conn.transaction():
+                async with conn.cursor() as cur:
+                    await cur.execute(f"SET LOCAL lock_timeout = '{self._lock_timeout}'")
+                    await cur.execute(self.DELETE_CHECKPOINTS_SQL, params)
+                    checkpoints, checkpoint_bytes, writes, write_bytes = await cur.fetchone()
+                    await cur.execute(self.DELETE_BLOBS_SQL, params)
+                    blobs, blob_bytes = await cur.fetchone()
+
+        return {
+            'checkpoints': checkpoints,
+            'writes': writes,
+            'blobs': blobs,
+            'bytes': checkpoint_bytes + write_bytes + blob_bytes,
+        }
+
+    async def compact(self) -> dict:
+        '''压缩，按对话编号分批遍历所有对话，批次之间让出连接，返回删除的行数和回收的字节数'''
+
+        started_at = datetime.now()
+        report = {'threads': 0, 'checkpoints': 0, 'writes': 0, 'blobs': 0, 'bytes': 0, 'skipped_batches': 0}
+        last_thread_id = ''
+        while True:
+            async with self._pool.connection() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute(self.SELECT_THREADS_SQL, (last_thread_id, self._thread_batch_size))
+                    thread_ids = [row[0] for row in await cur.fetchall()]
+            if not thread_ids:
+                break
+
+            try:
+                batch_report = await self._compact_batch(thread_ids)
+            except LockNotAvailable:  # 锁等待超时，下次压缩再处理
+                report['skipped_batches'] += 1
+            else:
+                for key, value in batch_report.items():
+                    report[key] += value
+
+            report['threads'] += len(thread_ids)
+            last_thread_id = thread_ids[-1]
+            await sleep(self._batch_pause)
+
+        report['started_at'] = started_at.isoformat()
+        report['seconds'] = round((datetime.now() - started_at).total_seconds(), 3)
+        self.last_report = report
+        return report
@@ -0,0 +1,203 @@
+from asyncio import gather
+from textwrap import dedent
+from typing import Iterable, Literal
+
+from langgraph.store.base import Op, Result, SearchItem, SearchOp
+from langgraph.store.postgres import AsyncPostgresStore
+from langgraph.store.postgres.base import PostgresIndexConfig
+from psycopg import AsyncConnection
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+VectorFormat = Literal['vector', 'halfvec', 'binary']
+
+DISTANCE_OPERATORS = {'cosine': ('<=>', 'cosine_ops'), 'l2': ('<->', 'l2_ops'), 'inner_product': ('<#>', 'ip_ops')}
+
+
+class CompactVectorStore(AsyncPostgresStore):
+    '''
+    紧凑向量存储，向量表保留全精度向量，只对紧凑表示建立 HNSW 表达式索引，索引内存随紧凑表示缩小。
+    紧凑表示为半精度 halfvec，二值量化 binary 或截断到前 compact_dims 维的 Matryoshka 向量，截断可与前两者组合。
+    检索时先用紧凑索引取出 rescore_factor 倍的候选向量，再用全精度向量重新打分排序。
+    不带查询或带过滤条件的检索，以及写入和读取，沿用 AsyncPostgresStore 的实现。
+    '''
+
+    INDEX_NAME = 'store_vectors_compact_idx'
+    FULL_INDEX_NAME = 'store_vectors_embedding_idx'  # AsyncPostgresStore 建立的全精度索引
+
+    SELECT_INDEXES_SQL = dedent(
+        '''\
+        SELECT indexrelid::regclass::text AS name, obj_description(indexrelid, 'pg_class') AS signature,
+            pg_relation_size(indexrelid) AS bytes
+        FROM pg_index
+        WHERE indrelid = 'store_vectors'::regclass AND indexrelid::regclass::text IN (%s, %s)
+        '''
+    )
+
+    SEARCH_SQL = dedent(
+        '''\
+        WITH candidates AS (
+            SELECT sv.prefix, sv.key, sv.embedding FROM store_vectors sv
+            WHERE sv.prefix LIKE %(prefix)s
+            ORDER BY {compact_distance}
+            LIMIT %(candidates)s
+        ),
+        rescored AS (
+            SELECT prefix, key, MIN(embedding {operator} %(query)s::vector) AS distance
+            FROM candidates
+            GROUP BY prefix, key
+        )
+        SELECT s.prefix, s.key, s.value, s.created_at, s.updated_at, {score} AS score
+        FROM rescored r
+            JOIN store s ON s.prefix = r.prefix AND s.key = r.key
+        ORDER BY r.distance ASC
+        LIMIT %(limit)s OFFSET %(offset)s
+        '''
+    )
+
+    def __init__(
+        self,
+        conn: AsyncConnectionPool,
+        *,
+        index: PostgresIndexConfig,
+        vector_format: VectorFormat = 'vector',
+        compact_dims: int | None = None,
+        rescore_factor: int = 4,
+    ):
+        super().__init__(conn, index=index)
+        self._dims = index['dims']
+        self._compact_dims = compact_dims if compact_dims and compact_dims < self._dims else None
+        self._vector_format = vector_format
+        self._rescore_factor = rescore_factor  # 候选数为需要的向量数的倍数，越大召回越高，重新打分越慢
+        self._num_fields = len(index.get('fields') or ['$'])
+
+        distance_type = index.get('distance_type', 'cosine')
+        if vector_format not in ('vector', 'halfvec', 'binary'):
+            raise ValueError(f'不支持的向量格式：{vector_format}')
+        if distance_type not in DISTANCE_OPERATORS:
+            raise ValueError(f'不支持的距离类型：{distance_type}')
+        self._operator, ops_suffix = DISTANCE_OPERATORS[distance_type]
+        self._score = {'cosine': '1 - r.distance', 'l2': '-r.distance', 'inner_product': '-r.distance'}[distance_type]
+
+        # 紧凑表达式，索引和查询使用同一表达式，查询向量以全精度传入后在数据库中转换
+        self.compact = vector_format != 'vector' or self._compact_dims is not None
+        n = self._compact_dims or self._dims
+        self._index_expression = self._compact_expression('embedding', n)
+        self._query_expression = self._compact_expression(f'%(query)s::vector({self._dims})', n)
+        if vector_format == 'binary':
+            self._compact_operator, self._ops = '<~>', 'bit_hamming_ops'
+        else:
+            self._compact_operator, self._ops = self._operator, f'{vector_format}_{ops_suffix}'
+        self.signature = f'{self._ops}:{n}'  # 紧凑表示签名，记录在索引注释中，签名变化时重建紧凑索引
+
+        ann_index_config = index.get('ann_index_config', {})
+        self._index_params = {k: ann_index_config[k] for k in ('m', 'ef_construction') if k in ann_index_config}
+
+    def _compact_expression(self, vector: str, n: int) -> str:
+        if self._compact_dims:
+            vector = f'(({vector})::real[])[1:{n}]::vector({n})'  # Matryoshka 截断，只保留前 n 维
+        if self._vector_format == 'halfvec':
+            return f'(({vector})::halfvec({n}))'
+        if self._vector_format == 'binary':
+            return f'(binary_quantize({vector})::bit({n}))'
+        return f'({vector})'
+
+    def index_definition(self) -> str:
+        '''紧凑索引的建立语句，不紧凑时为全精度索引'''
+
+        name, expression, ops = self.INDEX_NAME, self._index_expression, self._ops
+        if not self.compact:
+            name, expression = self.FULL_INDEX_NAME, 'embedding'
+        params = ', '.join(f'{k}={int(v)}' for k, v in self._index_params.items())
+        return (
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON store_vectors '
+            f'USING hnsw ({expression} {ops}){f' WITH ({params})' if params else ''}'
+        )
+
+    async def list_indexes(self, conn: AsyncConnection) -> list[dict]:
+        '''获取全精度索引和紧凑索引，返回索引名，紧凑表示签名和占用的字节数'''
+
+        async with conn.cursor(row_factory=dict_row) as cur:
+            await cur.execute(self.SELECT_INDEXES_SQL, (self.INDEX_NAME, self.FULL_INDEX_NAME))
+            return await cur.fetchall()
+
+    async def setup_vector_index(self, conn: AsyncConnection, drop_others: bool = False) -> bool:
+        '''
+        建立当前格式的向量索引，conn 需为自动提交的连接，索引已存在时跳过，返回是否新建了索引。
+        drop_others 为真时删除另一种索引，切换格式时先建立新索引再删除旧索引，检索不中断。
+        '''
+
+        target = self.INDEX_NAME if self.compact else self.FULL_INDEX_NAME
+        indexes = {index['name']: index for index in await self.list_indexes(conn)}
+        if target in indexes and self.compact and indexes[target]['signature'] != self.signature:
+            await conn.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {target}')  # 紧凑表示变化，重建紧凑索引
+            del indexes[target]
+
+        created = target not in indexes
+        if created:
+            await conn.execute(self.index_definition())
+            if self.compact:
+                await conn.execute(f"COMMENT ON INDEX {target} IS '{self.signature}'")
+        if drop_others:
+            for name in indexes.keys() - {target}:
+                await conn.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+        return created
+
+    async def abatch(self, ops: Iterable[Op]) -> list[Result]:
+        ops = list(ops)
+        compact_indexes = [
+            i for i, op in enumerate(ops) if self.compact and isinstance(op, SearchOp) and op.query and not op.filter
+        ]
+        if not compact_indexes:
+            return await super().abatch(ops)
+
+        results: list[Result] = [None] * len(ops)
+        other_indexes = [i for i in range(len(ops)) if i not in set(compact_indexes)]
+        if other_indexes:
+            for i, result in zip(other_indexes, await super().abatch([ops[i] for i in other_indexes])):
+                results[i] = result
+
+        queries = list(dict.fromkeys(ops[i].query for i in compact_indexes))
+        vectors = dict(zip(queries, await gather(*(self.embeddings.aembed_query(query) for query in queries))))
+        for i in compact_indexes:
+            results[i] = await self._search(ops[i], vectors[ops[i].query])
+        return results
+
+    async def _search(self, op: SearchOp, query_vector: list[float]) -> list[SearchItem]:
+        '''紧凑索引检索候选向量，全精度向量重新打分，同一条目的多个字段取最高分'''
+
+        sql = self.SEARCH_SQL.format(
+            compact_distance=f'{self._index_expression} {self._compact_operator} {self._query_expression}',
+            operator=self._operator,
+            score=self._score,
+        )
+        candidates = (op.limit + op.offset) * self._num_fields * self._rescore_factor
+        params = {
+            'prefix': f'{'.'.join(op.namespace_prefix)}%',
+            'query': str(query_vector),
+            'candidates': candidates,
+            'limit': op.limit,
+            'offset': op.offset,
+        }
+        async with self.conn.connection() as conn:
+            async with conn.transaction():
+                async with conn.cursor(row_factory=dict_row) as cur:
+                    # HNSW 索引扫描最多返回 ef_search 个结果，候选数超过默认值时在事务内调大
+                    await cur.execute(
+                        "SELECT set_config('hnsw.ef_search', %s, true)", (str(min(1000, max(40, candidates))),)
+                    )
+                    await cur.execute(sql, params)
+                    rows = await cur.fetchall()
+
+        return [
+            SearchItem(
+                namespace=tuple(row['prefix'].split('.')),
+                key=row['key'],
+                value=row['value'],
+                created_at=row['created_at'],
+                updated_at=row['updated_at'],
+                score=float(row['score']),
+            )
+            for row in rows
+        ]
+
@@ -0,0 +1,68 @@
+import zlib
+from typing import Any
+
+from langgraph.checkpoint.serde.base import SerializerProtocol
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+try:  # zstd 为可选依赖，Python 3.14 起为标准库，否则使用 zstandard 包，都不可用时使用 zlib
+    from compression import zstd
+except ImportError:
+    try:
+        import zstandard as zstd
+    except ImportError:
+        zstd = None
+
+
+class CompressedSerializer(SerializerProtocol):
+    '''
+    压缩序列化器，包装检查点序列化器，序列化结果超过阈值时压缩，读取时透明解压。
+    压缩算法名以 '类型+算法' 的形式追加到类型标记中，未压缩的旧数据类型标记不变，可直接读取，无需迁移。
+    '''
+
+    CODECS = ('zstd', 'zlib')
+
+    def __init__(
+        self,
+        serde: SerializerProtocol | None = None,
+        threshold: int = 1024,
+        codec: str | None = None,
+        level: int = 3,
+    ):
+        self._serde = serde or JsonPlusSerializer()
+        self._threshold = threshold  # 压缩阈值，单位字节，小于阈值的数据不压缩
+        self._codec = codec or ('zstd' if zstd else 'zlib')  # 压缩算法，默认优先使用 zstd
+        self._level = level
+
+        if self._codec not in self.CODECS or (self._codec == 'zstd' and not zstd):
+            raise ValueError(f'不支持的压缩算法：{self._codec}')
+
+    def _compress(self, data: bytes) -> bytes:
+        if self._codec == 'zstd':
+            return zstd.compress(data, level=self._level)
+        return zlib.compress(data, self._level)
+
+    @staticmethod
+    def _decompress(codec: str, data: bytes) -> bytes:
+        if codec == 'zstd':
+            if not zstd:
+                raise ValueError('缺少解压所需的 zstd，请使用 Python 3.14 或安装 zstandard')
+            return zstd.decompress(data)
+        return zlib.decompress(data)
+
+    def dumps_typed(self, obj: Any) -> tuple[str, bytes]:
+        typ, data = self._serde.dumps_typed(obj)
+        if len(data) < self._threshold:
+            return typ, data
+
+        compressed = self._compress(data)
+        if len(compressed) >= len(data):  # 不可压缩的数据原样保存
+            return typ, data
+        return f'{typ}+{self._codec}', compressed
+
+    def loads_typed(self, data: tuple[str, bytes]) -> Any:
+        typ, payload = data
+        if '+' in typ:
+            inner_typ, codec = typ.rsplit('+', 1)
+            if codec in self.CODECS:
+                return self._serde.loads_typed((inner_typ, self._decompress(codec, payload)))
+        return self._serde.loads_typed(data)
@@ -1,112 +1,303 @@
 from __future__ import annotations  # 自动前向引用，不在代码运行时立即计算类型提示，而是当作字符串先存起来
 
 import asyncio
+import logging
 import typing
 import uuid
-from asyncio import create_task, gather, to_thread, wrap_future
-from concurrent.futures import Future
+from asyncio import CancelledError, Event, Queue, TimeoutError, create_task, gather, get_running_loop, sleep, wait_for
+from dataclasses import dataclass
+from heapq import heappop, heappush
+from itertools import count
 from time import time
-from traceback import format_exc
-from typing import Any, Optional
+from typing import Any, Callable, Optional
 
 from langchain_core.runnables import Runnable, RunnableConfig
-from langgraph.store.base import BaseStore, SearchItem
-from langmem.reflection import LocalReflectionExecutor, MemoryItem
 
-PENDING_TASKS_NAMESPACE = ('memories', 'pending_tasks')
-SEARCH_LIMIT_FOR_RECOVERY = 1000000
-SENTINEL = object()
+from .pending_reflection_manager import PendingReflectionManager
 
+logger = logging.getLogger(__name__)
 
-class DurableReflectionExecutor:
-    '''持久化反思执行器，LocalReflectionExecutor 包装器，持久化待办任务并提供重启恢复'''
+RECOVERY_BATCH_SIZE = 100  # 恢复时每页读取的待办任务数
+RECOVERY_BATCH_PAUSE = 0.05  # 恢复时页间的暂停时间，单位秒
+RUNNING_RETRY_SECONDS = 1  # 同一对话的反思正在运行时，到期任务推迟的时间，单位秒
+SENTINEL = object()
 
-    def __init__(self, reflector: Runnable, store: BaseStore):
-        self._inner_executor = LocalReflectionExecutor(reflector, store=store)
-        self._store = store
 
-    @classmethod
-    def init(cls, reflector: Runnable, store: BaseStore) -> DurableReflectionExecutor:
-        instance = cls(reflector, store)
-        instance._resume_pending_tasks()
-        return instance
+@dataclass
+class _ReflectionTask:
+    '''反思任务'''
 
-    @classmethod
-    async def ainit(cls, reflector: Runnable, store: BaseStore) -> DurableReflectionExecutor:
-        instance = cls(reflector, store)
-        await instance._aresume_pending_tasks()
-        return instance
+    thread_id: str
+    payload: dict[str, Any]
+    config: RunnableConfig
+    execute_at: float
+    watermark: int | None
+    future: asyncio.Future
+    generation: int  # 提交序号，堆中序号不一致的条目已被防抖替换
 
-    # 辅助相关
-    def _resume_pending_items(self, items: list[SearchItem]):
-        '''恢复待办项'''
 
-        if not items:
-            return
+class DurableReflectionExecutor:
+    '''
+    持久化反思执行器，待办任务持久化到待办反思表并提供重启恢复，基于 asyncio 调度，不使用线程。
+    到期时间保存在堆中，由调度协程按时分派给固定数量的工作协程；同一对话的新提交替换未执行的旧提交（防抖），同一对话同时只运行一个反思。
+    合并窗口大于 0 时，有任务到期后顺带取出窗口内即将到期的其他对话的任务，按记忆命名空间分组，每组合并为一次反思，减少 LLM 调用次数。
+    提交时可附带水位线，即载荷中最后一条消息在对话中的序号，反思成功后记录为该对话的水位线，下次只需提交水位线之后的消息。
+    反思成功后以写入的记忆命名空间调用 on_reflected，供记忆缓存失效。
+    '''
+
+    def __init__(
+        self,
+        reflector: Runnable,
+        pending_reflection_manager: PendingReflectionManager,
+        workers: int = 2,
+        batch_window: float = 0,
+        max_batch_size: int = 8,
+        on_reflected: Callable[[tuple[str, ...] | None], Any] | None = None,
+    ):
+        self._reflector = reflector
+        self._pending_reflection_manager = pending_reflection_manager
+        self._workers = workers  # 工作协程数
+        self._batch_window = batch_window  # 合并窗口，单位秒，为 0 时不合并
+        self._max_batch_size = max_batch_size  # 每次合并反思的最大对话数
+        self._on_reflected = on_reflected  # 反思成功后的回调，参数为写入的记忆命名空间
+
+        # 调度相关
+        self._heap: list[tuple[float, int, str]] = []  # (执行时间, 提交序号, thread_id)
+        self._scheduled: dict[str, _ReflectionTask] = {}  # 每个对话最新的未执行任务
+        self._running: set[str] = set()  # 正在反思的对话
+        self._ready: Queue[list[_ReflectionTask]] = Queue()  # 已到期待执行的任务批次
+        self._wakeup = Event()  # 调度协程唤醒事件，堆顶变化时设置
+        self._generation = count()
+        self._dispatcher_task = None
+        self._worker_tasks = []
+
+        # 指标相关
+        self._submitted = 0
+        self._debounced = 0
+        self._completed = 0
+        self._failed = 0
+        self._batches = 0  # 合并反思次数
+        self._batched = 0  # 合并反思的任务数
+        self._last_lag = 0.0
+        self._max_lag = 0.0
+
+        # 恢复相关
+        self._recovery_task = None  # 后台恢复任务
+        self._recovery_seen: set[str] = set()  # 恢复期间已恢复或已重新提交的对话，恢复时跳过
 
-        now = time()
-        for item in items:
-            try:
-                task_data = item.value
-                payload = task_data.get('payload')
-                config = task_data.get('config')
-                execute_at = task_data.get('execute_at')
+    @classmethod
+    async def ainit(
+        cls,
+        reflector: Runnable,
+        pending_reflection_manager: PendingReflectionManager,
+        workers: int = 2,
+        batch_window: float = 0,
+        max_batch_size: int = 8,
+        on_reflected: Callable[[tuple[str, ...] | None], Any] | None = None,
+    ) -> DurableReflectionExecutor:
+        '''异步初始化，启动调度协程和工作协程，待办任务在后台分页恢复，不等待恢复完成'''
+
+        instance = cls(reflector, pending_reflection_manager, workers, batch_window, max_batch_size, on_reflected)
+        instance._dispatcher_task = create_task(instance._dispatch())
+        instance._worker_tasks = [create_task(instance._work()) for _ in range(workers)]
+        instance._recovery_task = create_task(instance._aresume_pending_tasks())
+        return instance
 
-                if not payload or not config or not execute_at:
-                    continue
+    # 调度相关
+    def _schedule(
+        self,
+        payload: dict[str, Any],
+        config: RunnableConfig,
+        execute_at: float,
+        resolved_thread_id: str,
+        watermark: int | None = None,
+    ) -> asyncio.Future:
+        '''调度反思任务，取消同一对话未执行的旧任务'''
 
-                remaining_seconds = max(0, execute_at - now)
-                self.submit(payload, config, after_seconds=remaining_seconds)
-            except Exception:
-                print(f'<_resume_pending_items> 恢复待办项报错！！！\n{format_exc()}')
+        existing = self._scheduled.pop(resolved_thread_id, None)
+        if existing:
+            existing.future.cancel()
+            self._debounced += 1
 
-    async def _aresume_pending_items(self, items: list[SearchItem]):
-        '''恢复待办项'''
+        future = get_running_loop().create_future()
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())  # 调用方可不等待结果，避免未获取异常的警告
+        task = _ReflectionTask(
+            resolved_thread_id, payload, config, execute_at, watermark, future, next(self._generation)
+        )
+        self._scheduled[resolved_thread_id] = task
+        heappush(self._heap, (task.execute_at, task.generation, resolved_thread_id))
+        self._submitted += 1
+        self._wakeup.set()
+        return future
 
-        if not items:
-            return
+    def _namespace_key(self, task: _ReflectionTask) -> tuple[str, ...] | None:
+        '''任务写入的记忆命名空间，同一命名空间的任务才能合并反思'''
+
+        namespace = getattr(self._reflector, 'namespace', None)
+        return tuple(namespace(task.config)) if namespace else None
+
+    def _take_due_batches(self, now: float) -> list[list[_ReflectionTask]]:
+        '''取出到期任务和合并窗口内即将到期的任务，按命名空间分组并按最大合并数切分'''
+
+        groups: dict[tuple[str, ...] | None, list[_ReflectionTask]] = {}
+        deferred = []
+        while self._heap and self._heap[0][0] <= now + self._batch_window:
+            execute_at, generation, thread_id = heappop(self._heap)
+            task = self._scheduled.get(thread_id)
+            if not task or task.generation != generation:  # 已被防抖替换
+                continue
+            if thread_id in self._running:
+                deferred.append((max(execute_at, now + RUNNING_RETRY_SECONDS), generation, thread_id))
+                continue
+
+            del self._scheduled[thread_id]
+            self._running.add(thread_id)
+            groups.setdefault(self._namespace_key(task), []).append(task)
+
+        for entry in deferred:
+            heappush(self._heap, entry)
+        return [
+            tasks[i : i + self._max_batch_size]
+            for tasks in groups.values()
+            for i in range(0, len(tasks), self._max_batch_size)
+        ]
+
+    async def _dispatch(self):
+        '''调度协程，等待堆顶任务到期或被唤醒，把到期任务按批次放入就绪队列'''
+
+        while True:
+            now = time()
+            if self._heap and self._heap[0][0] <= now:
+                for batch in self._take_due_batches(now):
+                    self._ready.put_nowait(batch)
+
+            self._wakeup.clear()
+            try:
+                await wait_for(self._wakeup.wait(), self._heap[0][0] - now if self._heap else None)
+            except TimeoutError:
+                pass
+
+    @staticmethod
+    def _merge_payloads(tasks: list[_ReflectionTask]) -> dict[str, Any]:
+        '''合并多个对话的载荷，每个对话的消息前插入分隔消息'''
+
+        messages = []
+        for task in tasks:
+            messages.append({'type': 'system', 'content': f'以下是对话 {task.thread_id} 的消息'})
+            messages.extend(task.payload['messages'])
+        return {'messages': messages}
+
+    async def _work(self):
+        '''工作协程，执行反思，成功后清理待办任务并推进水位线，失败的待办任务保留在待办反思表中，重启后恢复'''
+
+        while True:
+            tasks = await self._ready.get()
+            thread_ids = ', '.join(task.thread_id for task in tasks)
+            try:
+                now = time()
+                self._last_lag = max(0.0, max(now - task.execute_at for task in tasks))
+                self._max_lag = max(self._max_lag, self._last_lag)
+
+                if len(tasks) == 1:
+                    await self._reflector.ainvoke(tasks[0].payload, config=tasks[0].config)
+                else:
+                    await self._reflector.ainvoke(self._merge_payloads(tasks), config=tasks[0].config)
+                    self._batches += 1
+                    self._batched += len(tasks)
+                self._completed += len(tasks)
+                if self._on_reflected:
+                    try:
+                        self._on_reflected(self._namespace_key(tasks[0]))
+                    except Exception:
+                        logger.error('<_work> 反思回调报错！！！', exc_info=True)
+
+                for task in tasks:
+                    try:
+                        await self._pending_reflection_manager.complete(
+                            task.thread_id, task.execute_at, task.watermark
+                        )
+                    except Exception:
+                        logger.error('<_work> 清理报错！！！', exc_info=True)
+                    if not task.future.done():
+                        task.future.set_result(None)
+            except CancelledError:
+                for task in tasks:
+                    task.future.cancel()
+                raise
+            except Exception as e:
+                self._failed += len(tasks)
+                logger.error(f'<_work> 反思任务 {thread_ids} 报错！！！', exc_info=True)
+                for task in tasks:
+                    if not task.future.done():
+                        task.future.set_exception(e)
+            finally:
+                for task in tasks:
+                    self._running.discard(task.thread_id)
+                self._ready.task_done()
+
+    def snapshot(self) -> dict:
+        '''获取调度指标'''
 
         now = time()
-        resume_pending_tasks = []
-        for item in items:
+        due = [task.execute_at for task in self._scheduled.values() if task.execute_at <= now]
+        return {
+            'workers': self._workers,
+            'scheduled': len(self._scheduled),
+            'due': len(due),
+            'ready': self._ready.qsize(),
+            'running': len(self._running),  # 包括就绪队列中的任务
+            'recovering': self._recovery_task is not None,
+            'submitted': self._submitted,
+            'debounced': self._debounced,
+            'completed': self._completed,
+            'failed': self._failed,
+            'batches': self._batches,
+            'batched': self._batched,
+            'oldest_due_lag_seconds': round(now - min(due), 3) if due else 0.0,
+            'last_lag_seconds': round(self._last_lag, 3),
+            'max_lag_seconds': round(self._max_lag, 3),
+        }
+
+    # 恢复相关
+    def _resume_pending_rows(self, rows: list[dict]) -> int:
+        '''恢复待办任务，只重新调度，不重复写入，不等待反思完成，跳过恢复期间已重新提交的对话，返回恢复数'''
+
+        resumed = 0
+        for row in rows:
             try:
-                task_data = item.value
-                payload = task_data.get('payload')
-                config = task_data.get('config')
-                execute_at = task_data.get('execute_at')
-
-                if not payload or not config or not execute_at:
+                if row['thread_id'] in self._recovery_seen:
                     continue
-
-                remaining_seconds = max(0, execute_at - now)
-                resume_pending_tasks.append(await self.asubmit(payload, config, after_seconds=remaining_seconds))
+                self._recovery_seen.add(row['thread_id'])
+                self._schedule(
+                    row['payload'], row['config'], row['execute_at'], row['thread_id'], row['pending_watermark']
+                )
+                resumed += 1
             except Exception:
-                print(f'<_resume_pending_items> 恢复待办项报错！！！\n{format_exc()}')
-
-        try:
-            if resume_pending_tasks:
-                await gather(*resume_pending_tasks)
-        except Exception:
-            print(f'<_resume_pending_items> 恢复待办项报错！！！\n{format_exc()}')
-
-    def _resume_pending_tasks(self):
-        '''恢复待办任务'''
-
-        try:
-            pending_items = self._store.search(PENDING_TASKS_NAMESPACE, limit=SEARCH_LIMIT_FOR_RECOVERY)
-            self._resume_pending_items(pending_items)
-        except Exception:
-            print(f'<_resume_pending_tasks> 恢复待办任务报错！！！\n{format_exc()}')
+                logger.error('<_resume_pending_rows> 恢复待办任务报错！！！', exc_info=True)
+        return resumed
 
     async def _aresume_pending_tasks(self):
-        '''恢复待办任务'''
+        '''恢复待办任务，在后台按执行时间键集分页读取，每页数量有上限，页间让出事件循环'''
 
         try:
-            pending_items = await self._store.asearch(PENDING_TASKS_NAMESPACE, limit=SEARCH_LIMIT_FOR_RECOVERY)
-            await self._aresume_pending_items(pending_items)
+            resumed, after = 0, None
+            while True:
+                rows = await self._pending_reflection_manager.list_pending(RECOVERY_BATCH_SIZE, after)
+                resumed += self._resume_pending_rows(rows)
+                if len(rows) < RECOVERY_BATCH_SIZE:
+                    break
+                after = (rows[-1]['execute_at'], rows[-1]['thread_id'])
+                await sleep(RECOVERY_BATCH_PAUSE)
+            logger.info(f'<_aresume_pending_tasks> 恢复待办任务完成，任务数：{resumed}')
+        except CancelledError:
+            pass
         except Exception:
-            print(f'<_aresume_pending_tasks> 恢复待办任务报错！！！\n{format_exc()}')
+            logger.error('<_aresume_pending_tasks> 恢复待办任务报错！！！', exc_info=True)
+        finally:
+            self._recovery_task = None
+            self._recovery_seen.clear()
 
+    # 辅助相关
     def _resolve_thread_id(
         self,
         config: RunnableConfig,
@@ -123,37 +314,6 @@ class DurableReflectionExecutor:
         return str(resolved_thread_id)
 
     # 功能相关
-    def submit(
-        self,
-        payload: dict[str, Any],
-        /,
-        config: RunnableConfig | None = None,
-        *,
-        after_seconds: int = 0,
-        thread_id: Optional[typing.Union[str, uuid.UUID]] = SENTINEL,
-    ) -> Future:
-        resolved_thread_id = self._resolve_thread_id(config, thread_id)
-        execute_at = time() + after_seconds
-        task_data = {'payload': payload, 'config': config, 'execute_at': execute_at}
-        try:
-            self._store.put(PENDING_TASKS_NAMESPACE, resolved_thread_id, task_data)
-        except Exception:
-            print(f'<submit> 提交反思待办任务 {resolved_thread_id} 失败！！！\n{format_exc()}')
-
-        future = self._inner_executor.submit(
-            payload, config, after_seconds=after_seconds, thread_id=resolved_thread_id
-        )
-
-        def _clean_on_done(future: Future):
-            if not future.cancelled() and future.exception() is None:
-                try:
-                    self._store.delete(PENDING_TASKS_NAMESPACE, resolved_thread_id)
-                except Exception:
-                    print(f'<_clean_on_done> 清理报错！！！\n{format_exc()}')
-
-        future.add_done_callback(_clean_on_done)
-        return future
-
     async def asubmit(
         self,
         payload: dict[str, Any],
@@ -162,54 +322,50 @@ class DurableReflectionExecutor:
         *,
         after_seconds: int = 0,
         thread_id: Optional[typing.Union[str, uuid.UUID]] = SENTINEL,
+        watermark: int | None = None,
     ) -> asyncio.Future:
         resolved_thread_id = self._resolve_thread_id(config, thread_id)
         execute_at = time() + after_seconds
-        task_data = {'payload': payload, 'config': config, 'execute_at': execute_at}
         try:
-            await self._store.aput(PENDING_TASKS_NAMESPACE, resolved_thread_id, task_data)
+            await self._pending_reflection_manager.upsert(resolved_thread_id, payload, config, execute_at, watermark)
         except Exception:
-            print(f'<asubmit> 提交反思待办任务 {resolved_thread_id} 失败！！！\n{format_exc()}')
-
-        future = await to_thread(
-            self._inner_executor.submit,
-            payload,
-            config=config,
-            after_seconds=after_seconds,
-            thread_id=resolved_thread_id,
-        )
+            logger.error(f'<asubmit> 提交反思待办任务 {resolved_thread_id} 失败！！！', exc_info=True)
 
-        async def _async_clean_on_done(future: Future):
-            try:
-                await wrap_future(future)
-                if not future.cancelled() and future.exception() is None:
-                    await self._store.adelete(PENDING_TASKS_NAMESPACE, resolved_thread_id)
-            except Exception:
-                print(f'<_async_clean_on_done> 清理报错！！！\n{format_exc()}')
+        if self._recovery_task:
+            self._recovery_seen.add(resolved_thread_id)
+        return self._schedule(payload, config, execute_at, resolved_thread_id, watermark)
 
-        create_task(_async_clean_on_done(future))
-        return wrap_future(future)
+    async def acancel(self, thread_id: str):
+        '''取消对话未执行的反思任务，保留水位线'''
 
-    # 代理相关
-    def search(self, *args, **kwargs) -> list[MemoryItem]:
-        return self._inner_executor.search(*args, **kwargs)
+        task = self._scheduled.pop(thread_id, None)
+        if task:
+            task.future.cancel()
+        await self._pending_reflection_manager.cancel(thread_id)
 
-    def asearch(self, *args, **kwargs) -> list[MemoryItem]:
-        return self._inner_executor.asearch(*args, **kwargs)
+    async def aget_watermark(self, thread_id: str) -> int:
+        '''获取对话的水位线，未反思过的对话为 0'''
 
-    def shutdown(self, wait=True, *, cancel_futures=False):
-        self._inner_executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+        return await self._pending_reflection_manager.get_watermark(thread_id)
 
-    def __enter__(self):
-        return self
+    async def ashutdown(self):
+        '''关闭，取消恢复，调度和工作协程，以及未执行的任务，未完成的待办任务保留在待办反思表中，重启后恢复'''
 
-    def __aenter__(self):
-        return self
+        tasks = [task for task in (self._recovery_task, self._dispatcher_task, *self._worker_tasks) if task]
+        for task in tasks:
+            task.cancel()
+        await gather(*tasks, return_exceptions=True)
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        self.shutdown(wait=True, cancel_futures=True)
-        return False
+        for task in self._scheduled.values():
+            task.future.cancel()
+        self._scheduled.clear()
+        self._heap.clear()
+        self._dispatcher_task = None
+        self._worker_tasks = []
+
+    async def __aenter__(self):
+        return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await to_thread(self.shutdown, wait=True, cancel_futures=True)
+        await self.ashutdown()
         return False
@@ -0,0 +1,108 @@
+from asyncio import sleep, to_thread
+from datetime import datetime
+
+import numpy as np
+from langgraph.store.base import BaseStore, PutOp
+
+from .memory_vectors import MemoryVectors, load_memory_vectors, memory_index_stats
+
+
+class EpisodeConsolidator:
+    '''
+    情景记忆整理器，按用户读取情景记忆的向量，分块计算余弦相似度找出近似重复的记忆簇，每簇只保留最新的一条，
+    再按更新时间淘汰超出每个用户上限的旧记忆，通过存储接口删除，统计整理前后的向量索引大小。
+    Postgres 删除的向量在清理后才释放索引页，供之后写入复用，索引字节数不会立即下降。
+    '''
+
+    def __init__(
+        self,
+        store: BaseStore,
+        similarity_threshold: float = 0.95,
+        max_memories_per_user: int = 2000,
+        block_size: int = 512,
+        delete_batch_size: int = 100,
+        namespace_prefix: tuple[str, ...] = ('memories',),
+    ):
+        self._store = store
+        self._similarity_threshold = similarity_threshold  # 余弦相似度不低于该阈值的两条记忆视为重复
+        self._max_memories_per_user = max_memories_per_user
+        self._block_size = block_size  # 每次计算相似度的行数，相似度矩阵分块大小为 block_size * 记忆数
+        self._delete_batch_size = delete_batch_size
+        self._namespace_prefix = namespace_prefix
+
+        self.last_report: dict | None = None
+
+    def _cluster(self, vectors: np.ndarray) -> np.ndarray:
+        '''分块计算相似度，用并查集合并相似度超过阈值的记忆对，返回每条记忆所属簇的根'''
+
+        parent = np.arange(len(vectors))
+
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for start in range(0, len(vectors), self._block_size):
+            block = vectors[start : start + self._block_size]
+            similar = np.triu(block @ vectors[start:].T >= self._similarity_threshold, k=1)  # 只比较之后的记忆
+            for i, j in zip(*np.nonzero(similar)):
+                root_i, root_j = find(start + i), find(start + j)
+                if root_i != root_j:
+                    parent[max(root_i, root_j)] = min(root_i, root_j)
+        return np.array([find(i) for i in range(len(vectors))], np.int64)
+
+    def _plan(self, memories: MemoryVectors) -> tuple[list[str], list[str]]:
+        '''规划删除，返回重复的记忆和超出上限的记忆'''
+
+        if not memories.keys:
+            return [], []
+
+        newest: dict[int, int] = {}  # 簇的根 -> 簇中最新的记忆
+        for i, root in enumerate(self._cluster(memories.vectors).tolist()):
+            if root not in newest or memories.updated_at[i] > memories.updated_at[newest[root]]:
+                newest[root] = i
+        survivors = set(newest.values())
+        duplicates = [key for i, key in enumerate(memories.keys) if i not in survivors]
+
+        ranked = sorted(survivors, key=lambda i: memories.updated_at[i], reverse=True)
+        capped = [memories.keys[i] for i in ranked[self._max_memories_per_user :]]
+        return duplicates, capped
+
+    async def _delete(self, namespace: tuple[str, ...], keys: list[str]):
+        for start in range(0, len(keys), self._delete_batch_size):
+            await self._store.abatch(
+                [PutOp(namespace, key, None) for key in keys[start : start + self._delete_batch_size]]
+            )
+            await sleep(0)  # 批次之间让出事件循环，不阻塞对话
+
+    async def consolidate(self) -> dict:
+        '''整理，逐个用户删除重复和超出上限的记忆，返回删除的记忆数和整理前后的向量索引大小'''
+
+        started_at = datetime.now()
+        before = await memory_index_stats(self._store)
+        report = {'users': 0, 'memories': 0, 'duplicates': 0, 'capped': 0}
+
+        namespaces = await self._store.alist_namespaces(
+            prefix=self._namespace_prefix, max_depth=len(self._namespace_prefix) + 1
+        )
+        for namespace in namespaces:
+            if len(namespace) != len(self._namespace_prefix) + 1:
+                continue
+
+            memories = await load_memory_vectors(self._store, namespace)
+            duplicates, capped = await to_thread(self._plan, memories)  # 相似度计算在线程中进行，不阻塞事件循环
+            await self._delete(namespace, duplicates + capped)
+
+            report['users'] += 1
+            report['memories'] += len(memories.keys)
+            report['duplicates'] += len(duplicates)
+            report['capped'] += len(capped)
+
+        after = await memory_index_stats(self._store)
+        report['vectors_before'], report['vectors_after'] = before['vectors'], after['vectors']
+        report['index_bytes_before'], report['index_bytes_after'] = before['index_bytes'], after['index_bytes']
+        report['started_at'] = started_at.isoformat()
+        report['seconds'] = round((datetime.now() - started_at).total_seconds(), 3)
+        self.last_report = report
+        return report
@@ -0,0 +1,123 @@
+from math import ceil
+from textwrap import dedent
+
+import numpy as np
+from langgraph.store.base import BaseStore, SearchItem
+
+from .chat_search_index import CJK_PATTERN
+from .memory_vectors import load_memory_vectors
+
+
+def estimate_tokens(text: str) -> int:
+    '''估算 token 数，中文每个字约一个 token，其他文字每四个字符约一个 token'''
+
+    cjk = sum(len(match) for match in CJK_PATTERN.findall(text))
+    return cjk + ceil((len(text) - cjk) / 4)
+
+
+class EpisodeRetriever:
+    '''
+    情景记忆检索器，从较大的候选集中去掉相似度低于阈值的记忆，用最大边际相关性重排，兼顾相关性和多样性，
+    再按 token 预算依次选入记忆，渲染为系统提示词中的情景记忆块，每轮对话从 1 开始编号。
+    '''
+
+    def __init__(
+        self,
+        store: BaseStore,
+        similarity_threshold: float = 0.5,
+        candidate_limit: int = 12,
+        max_episodes: int = 3,
+        mmr_lambda: float = 0.7,
+        token_budget: int = 800,
+    ):
+        self._store = store
+        self._similarity_threshold = similarity_threshold  # 与查询的相似度低于该阈值的记忆不进入提示词
+        self._candidate_limit = candidate_limit
+        self._max_episodes = max_episodes
+        self._mmr_lambda = mmr_lambda  # 相关性的权重，越小越偏向多样性
+        self._token_budget = token_budget  # 情景记忆块的 token 上限
+
+        # 指标相关
+        self._retrievals = 0
+        self._candidates = 0
+        self._below_threshold = 0
+        self._over_budget = 0
+        self._selected = 0
+        self._tokens = 0
+
+    def _mmr(self, relevance: np.ndarray, vectors: np.ndarray) -> list[int]:
+        '''最大边际相关性排序，每次选出相关性减去与已选记忆最大相似度的加权差最大的记忆，返回全部候选的顺序'''
+
+        similarity = vectors @ vectors.T
+        max_similarity = np.zeros(len(relevance), np.float32)
+        remaining = np.ones(len(relevance), bool)
+        order = []
+        for _ in range(len(relevance)):
+            scores = self._mmr_lambda * relevance - (1 - self._mmr_lambda) * max_similarity
+            i = int(np.argmax(np.where(remaining, scores, -np.inf)))
+            order.append(i)
+            remaining[i] = False
+            max_similarity = np.maximum(max_similarity, similarity[i])
+        return order
+
+    @staticmethod
+    def _render_episode(number: int, episode: SearchItem) -> str:
+        content = episode.value['content']
+        return dedent(
+            f'''\
+            情景记忆 {number} :
+                观察：{content['observation']}
+                思考：{content['thought']}
+                行动：{content['action']}
+                结果：{content['result']}\n
+            '''
+        )
+
+    async def retrieve(self, user_id: str, query: str) -> str:
+        '''检索情景记忆，返回渲染后的情景记忆块，没有足够相关的记忆时返回空字符串'''
+
+        namespace = ('memories', user_id)
+        candidates = await self._store.asearch(namespace, query=query, limit=self._candidate_limit)
+        relevant = [c for c in candidates if c.score is not None and c.score >= self._similarity_threshold]
+        self._retrievals += 1
+        self._candidates += len(candidates)
+        self._below_threshold += len(candidates) - len(relevant)
+        if not relevant:
+            return ''
+
+        order = list(range(len(relevant)))
+        if len(relevant) > 1:
+            memories = await load_memory_vectors(self._store, namespace, [c.key for c in relevant])
+            rows = {key: i for i, key in enumerate(memories.keys)}
+            if all(c.key in rows for c in relevant):
+                vectors = memories.vectors[[rows[c.key] for c in relevant]]
+                order = self._mmr(np.array([c.score for c in relevant], np.float32), vectors)
+
+        blocks, tokens = [], 0
+        for i in order:
+            if len(blocks) >= self._max_episodes:
+                break
+            block = self._render_episode(len(blocks) + 1, relevant[i])
+            block_tokens = estimate_tokens(block)
+            if tokens + block_tokens > self._token_budget:
+                self._over_budget += 1
+                continue  # 跳过放不下的记忆，后面较短的记忆仍可能放得下
+            blocks.append(block)
+            tokens += block_tokens
+
+        self._selected += len(blocks)
+        self._tokens += tokens
+        return ''.join(blocks)
+
+    def snapshot(self) -> dict:
+        '''获取检索指标'''
+
+        return {
+            'retrievals': self._retrievals,
+            'candidates': self._candidates,
+            'below_threshold': self._below_threshold,
+            'over_budget': self._over_budget,
+            'selected': self._selected,
+            'avg_selected': round(self._selected / self._retrievals, 2) if self._retrievals else 0.0,
+            'avg_tokens': round(self._tokens / self._retrievals, 1) if self._retrievals else 0.0,
+        }
@@ -0,0 +1,279 @@
+import logging
+from asyncio import FIRST_COMPLETED, Task, create_task, gather, get_running_loop, wait
+from bisect import bisect_left
+from functools import partial
+from traceback import format_exc
+from typing import Any, AsyncIterator, Callable
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel, agenerate_from_stream
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import Runnable, RunnableConfig
+
+logger = logging.getLogger(__name__)
+
+EXHAUSTED = object()  # 迭代器耗尽哨兵
+
+
+class LatencyHistogram:
+    '''延迟直方图，几何分桶统计延迟，样本数超过上限时计数减半，让直方图跟随近期延迟变化'''
+
+    BUCKET_BOUNDS = tuple(round(0.05 * 1.5**i, 3) for i in range(20))  # 桶上界，0.05 秒到约 110 秒
+
+    def __init__(self, max_samples: int = 1000):
+        self._max_samples = max_samples
+        self._counts = [0] * (len(self.BUCKET_BOUNDS) + 1)
+        self._total = 0
+
+    @property
+    def total(self) -> int:
+        return self._total
+
+    def observe(self, seconds: float):
+        '''记录一次延迟'''
+
+        self._counts[bisect_left(self.BUCKET_BOUNDS, seconds)] += 1
+        self._total += 1
+        if self._total > self._max_samples:
+            self._counts = [count // 2 for count in self._counts]
+            self._total = sum(self._counts)
+
+    def percentile(self, q: float) -> float | None:
+        '''获取分位数，返回分位数所在桶的上界，没有样本时返回 None'''
+
+        if not self._total:
+            return None
+
+        threshold = q * self._total
+        cumulative = 0
+        for bound, count in zip(self.BUCKET_BOUNDS, self._counts):
+            cumulative += count
+            if cumulative >= threshold:
+                return bound
+        return self.BUCKET_BOUNDS[-1]
+
+    def snapshot(self) -> dict:
+        return {
+            'total': self._total,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+        }
+
+
+class LatencyHedger:
+    '''延迟对冲器，按供应商延迟直方图计算对冲阈值，主请求首个输出超过阈值时发起备用请求并保留先产出的一方'''
+
+    def __init__(
+        self,
+        percentile: float = 0.95,
+        default_delay: float = 3.0,
+        min_delay: float = 0.5,
+        max_delay: float = 15.0,
+        min_samples: int = 20,
+    ):
+        self._percentile = percentile
+        self._default_delay = default_delay
+        self._min_delay = min_delay
+        self._max_delay = max_delay
+        self._min_samples = min_samples
+
+        self._histograms: dict[str, LatencyHistogram] = {}
+        self._hedged_count = 0
+        self._backup_win_count = 0
+        self._cleanup_tasks: set[Task] = set()
+
+    def _histogram(self, name: str) -> LatencyHistogram:
+        if name not in self._histograms:
+            self._histograms[name] = LatencyHistogram()
+        return self._histograms[name]
+
+    def hedge_delay(self, name: str) -> float:
+        '''获取对冲延迟，样本不足时使用默认延迟'''
+
+        histogram = self._histogram(name)
+        if histogram.total < self._min_samples:
+            return self._default_delay
+        return min(self._max_delay, max(self._min_delay, histogram.percentile(self._percentile)))
+
+    async def arace(self, candidates: list[tuple[str, Callable[[], AsyncIterator]]]) -> tuple[Any, AsyncIterator]:
+        '''竞速，返回最先产出的首个输出和对应的迭代器，其余请求被取消'''
+
+        loop_time = get_running_loop().time
+        pending_candidates = list(candidates)
+        iterators: dict[str, AsyncIterator] = {}
+        started_at: dict[str, float] = {}
+        tasks: dict[Task, str] = {}
+        errors: list[BaseException] = []
+
+        def _start():
+            name, start = pending_candidates.pop(0)
+            iterators[name] = aiter(start())
+            started_at[name] = loop_time()
+            tasks[create_task(anext(iterators[name], EXHAUSTED))] = name
+
+        _start()
+        primary_name = candidates[0][0]
+        try:
+            while tasks:
+                timeout = self.hedge_delay(primary_name) if pending_candidates else None
+                done, _ = await wait(tasks.keys(), timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    logger.info(f'<arace> {primary_name} 首个输出超过 {timeout} 秒，发起备用请求')
+                    self._hedged_count += 1
+                    _start()
+                    continue
+
+                for task in done:
+                    name = tasks.pop(task)
+                    if task.exception() is not None:
+                        errors.append(task.exception())
+                        continue
+
+                    now = loop_time()
+                    self._histogram(name).observe(now - started_at[name])
+                    for loser in tasks.values():
+                        # 落败方尚未产出，已等待的时间是其延迟的下界，记录下界避免直方图只收集快样本，对冲阈值持续下降
+                        self._histogram(loser).observe(now - started_at[loser])
+                    if name != primary_name:
+                        self._backup_win_count += 1
+                    iterator = iterators.pop(name)
+                    return task.result(), iterator
+
+                if not tasks and pending_candidates:  # 先发请求全部失败，立即发起备用请求
+                    _start()
+            raise errors[0]
+        finally:
+            for task in tasks:
+                task.cancel()
+            if tasks or iterators:
+                cleanup_task = create_task(self._aclose_losers(list(tasks), list(iterators.values())))
+                self._cleanup_tasks.add(cleanup_task)
+                cleanup_task.add_done_callback(self._cleanup_tasks.discard)
+
+    @staticmethod
+    async def _aclose_losers(tasks: list[Task], iterators: list[AsyncIterator]):
+        '''关闭落败方，等待被取消的任务结束后关闭其迭代器，释放底层连接'''
+
+        await gather(*tasks, return_exceptions=True)
+        for iterator in iterators:
+            try:
+                if hasattr(iterator, 'aclose'):
+                    await iterator.aclose()
+            except Exception:
+                logger.warning(f'<_aclose_losers> 关闭落败方迭代器报错！！！\n{format_exc()}')
+
+    def snapshot(self) -> dict:
+        return {
+            'hedged_count': self._hedged_count,
+            'backup_win_count': self._backup_win_count,
+            'histograms': {name: histogram.snapshot() for name, histogram in self._histograms.items()},
+        }
+
+
+def _invoke_with_failover(candidates: list[tuple[str, Runnable]], *args, **kwargs) -> Any:
+    '''同步调用，不对冲，按顺序调用，报错时改用下一个，全部报错时抛出最后一个异常'''
+
+    logger.warning(f'<_invoke_with_failover> 同步调用不对冲，只在报错时按顺序改用：{[name for name, _ in candidates]}')
+    for i, (name, runnable) in enumerate(candidates):
+        try:
+            return runnable.invoke(*args, **kwargs)
+        except Exception:
+            if i == len(candidates) - 1:
+                raise
+            logger.warning(f'<_invoke_with_failover> {name} 报错，改用备用请求！！！\n{format_exc()}')
+
+
+class HedgedChatModel(BaseChatModel):
+    '''
+    对冲聊天模型，包装主备两个模型，主模型首个 token 超过对冲阈值时发起备用请求，保留最先产出 token 的流。
+    只有异步接口对冲，同步调用无法取消落败方的请求，不对冲，只在主模型报错时改用备用模型，Agent 只使用异步接口。
+    '''
+
+    primary: Runnable
+    backup: Runnable
+    primary_name: str
+    backup_name: str
+    hedger: LatencyHedger
+
+    @property
+    def _llm_type(self) -> str:
+        return 'hedged-chat-model'
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        message = _invoke_with_failover(
+            [(self.primary_name, self.primary), (self.backup_name, self.backup)], messages, stop=stop, **kwargs
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: AsyncCallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        return await agenerate_from_stream(self._astream(messages, stop, run_manager, **kwargs))
+
+    async def _astream(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: AsyncCallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        chunk, iterator = await self.hedger.arace(
+            [
+                (self.primary_name, partial(self.primary.astream, messages, stop=stop, **kwargs)),
+                (self.backup_name, partial(self.backup.astream, messages, stop=stop, **kwargs)),
+            ]
+        )
+        while chunk is not EXHAUSTED:
+            yield ChatGenerationChunk(message=chunk)
+            chunk = await anext(iterator, EXHAUSTED)
+
+    def bind_tools(self, tools, **kwargs) -> 'HedgedChatModel':
+        return self.model_copy(
+            update={
+                'primary': self.primary.bind_tools(tools, **kwargs),
+                'backup': self.backup.bind_tools(tools, **kwargs),
+            }
+        )
+
+    def with_structured_output(self, schema, **kwargs) -> Runnable:
+        '''结构化输出，主备模型各自按自身方式生成结构化输出，以完整输出的延迟进行对冲'''
+
+        return HedgedRunnable(
+            self.hedger,
+            [
+                (f'{self.primary_name}/structured', self.primary.with_structured_output(schema, **kwargs)),
+                (f'{self.backup_name}/structured', self.backup.with_structured_output(schema, **kwargs)),
+            ],
+        )
+
+
+class HedgedRunnable(Runnable):
+    '''对冲可运行对象，对完整输出进行对冲，同步调用不对冲，只在主模型报错时改用备用模型'''
+
+    def __init__(self, hedger: LatencyHedger, candidates: list[tuple[str, Runnable]]):
+        self._hedger = hedger
+        self._candidates = candidates
+
+    def invoke(self, input, config: RunnableConfig | None = None, **kwargs):
+        return _invoke_with_failover(self._candidates, input, config, **kwargs)
+
+    async def ainvoke(self, input, config: RunnableConfig | None = None, **kwargs):
+        async def _single_output(runnable: Runnable):
+            yield await runnable.ainvoke(input, config, **kwargs)
+
+        output, _ = await self._hedger.arace(
+            [(name, partial(_single_output, runnable)) for name, runnable in self._candidates]
+        )
+        return output
@@ -0,0 +1,226 @@
+from asyncio import AbstractEventLoop, CancelledError, Future, get_running_loop, run_coroutine_threadsafe
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass, field
+from enum import IntEnum
+from heapq import heappop, heappush
+from itertools import count
+from typing import Any, AsyncIterator
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import Runnable, RunnableConfig
+
+
+class LLMPriority(IntEnum):
+    '''枚举，LLM 请求优先级，值越小越优先'''
+
+    FOREGROUND = 0  # 前台，用户正在等待的对话轮次
+    BACKGROUND = 1  # 后台，对话标题，情景记忆反思，提醒任务提取
+
+
+@dataclass
+class _ProviderSlots:
+    '''供应商并发槽位'''
+
+    limit: int
+    in_flight: int = 0
+    waiters: list = field(default_factory=list)  # 最小堆，(优先级, 序号, 入队时间, Future)
+    admitted: dict[LLMPriority, int] = field(default_factory=lambda: dict.fromkeys(LLMPriority, 0))
+    wait_seconds: dict[LLMPriority, float] = field(default_factory=lambda: dict.fromkeys(LLMPriority, 0.0))
+
+
+class LLMAdmissionController:
+    '''LLM 准入控制器，按供应商限制并发，等待队列按优先级出队，前台请求等待时后台请求延后，并为前台请求保留槽位'''
+
+    def __init__(self, limits: dict[str, int], default_limit: int = 4, foreground_reserved_slots: int = 1):
+        self._limits = limits
+        self._default_limit = default_limit
+        self._foreground_reserved_slots = foreground_reserved_slots
+
+        self._providers: dict[str, _ProviderSlots] = {}
+        self._sequence = count()
+        self._loop: AbstractEventLoop | None = None
+
+    # 辅助相关
+    def _slots(self, provider: str) -> _ProviderSlots:
+        if provider not in self._providers:
+            self._providers[provider] = _ProviderSlots(self._limits.get(provider, self._default_limit))
+        return self._providers[provider]
+
+    def _has_capacity(self, slots: _ProviderSlots, priority: LLMPriority) -> bool:
+        if priority == LLMPriority.FOREGROUND:
+            return slots.in_flight < slots.limit
+        return slots.in_flight < max(1, slots.limit - self._foreground_reserved_slots)
+
+    def _admit(self, slots: _ProviderSlots, priority: LLMPriority, waited: float):
+        slots.in_flight += 1
+        slots.admitted[priority] += 1
+        slots.wait_seconds[priority] += waited
+
+    def _dispatch(self, slots: _ProviderSlots):
+        '''分派，按优先级唤醒等待者，队首等待者无可用槽位时停止，保证后台请求不越过等待中的前台请求'''
+
+        while slots.waiters:
+            priority, _, enqueued_at, future = slots.waiters[0]
+            if future.done():
+                heappop(slots.waiters)
+                continue
+            if not self._has_capacity(slots, priority):
+                break
+
+            heappop(slots.waiters)
+            self._admit(slots, priority, self._loop.time() - enqueued_at)
+            future.set_result(None)
+
+    # 功能相关
+    async def acquire(self, provider: str, priority: LLMPriority):
+        '''获取槽位'''
+
+        self._loop = get_running_loop()
+        slots = self._slots(provider)
+        if not slots.waiters and self._has_capacity(slots, priority):
+            self._admit(slots, priority, 0.0)
+            return
+
+        future: Future = self._loop.create_future()
+        heappush(slots.waiters, (priority, next(self._sequence), self._loop.time(), future))
+        self._dispatch(slots)  # 队首为更低优先级的等待者时，新请求可能立即获得槽位
+        try:
+            await future
+        except CancelledError:
+            if future.done() and not future.cancelled():  # 已获得槽位但调用方被取消
+                self.release(provider)
+            else:
+                self._dispatch(slots)
+            raise
+
+    def release(self, provider: str):
+        '''释放槽位'''
+
+        slots = self._slots(provider)
+        slots.in_flight -= 1
+        self._dispatch(slots)
+
+    @asynccontextmanager
+    async def admit(self, provider: str, priority: LLMPriority):
+        '''准入，异步上下文管理器'''
+
+        await self.acquire(provider, priority)
+        try:
+            yield
+        finally:
+            self.release(provider)
+
+    @contextmanager
+    def admit_threadsafe(self, provider: str, priority: LLMPriority):
+        '''准入，供其他线程中的同步调用使用，通过事件循环获取和释放槽位，在事件循环线程中或事件循环未知时直接放行'''
+
+        loop = self._loop
+        try:
+            on_loop_thread = get_running_loop() is loop
+        except RuntimeError:
+            on_loop_thread = False
+
+        if loop is None or loop.is_closed() or on_loop_thread:
+            yield
+            return
+
+        run_coroutine_threadsafe(self.acquire(provider, priority), loop).result()
+        try:
+            yield
+        finally:
+            loop.call_soon_threadsafe(self.release, provider)
+
+    def snapshot(self) -> dict:
+        snapshot = {}
+        for provider, slots in self._providers.items():
+            waiting = dict.fromkeys(LLMPriority, 0)
+            for priority, _, _, future in slots.waiters:
+                if not future.done():
+                    waiting[priority] += 1
+            snapshot[provider] = {
+                'limit': slots.limit,
+                'in_flight': slots.in_flight,
+                'waiting': {priority.name.lower(): number for priority, number in waiting.items()},
+                'admitted': {priority.name.lower(): number for priority, number in slots.admitted.items()},
+                'wait_seconds': {
+                    priority.name.lower(): round(seconds, 3) for priority, seconds in slots.wait_seconds.items()
+                },
+            }
+        return snapshot
+
+
+class AdmittedChatModel(BaseChatModel):
+    '''准入聊天模型，每次调用前向准入控制器获取所属供应商的槽位，流式调用在整个流期间占用槽位'''
+
+    inner: Runnable
+    controller: LLMAdmissionController
+    provider: str
+    priority: LLMPriority
+
+    @property
+    def _llm_type(self) -> str:
+        return 'admitted-chat-model'
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        with self.controller.admit_threadsafe(self.provider, self.priority):
+            message = self.inner.invoke(messages, stop=stop, **kwargs)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: AsyncCallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        async with self.controller.admit(self.provider, self.priority):
+            message = await self.inner.ainvoke(messages, stop=stop, **kwargs)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: AsyncCallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        async with self.controller.admit(self.provider, self.priority):
+            async for chunk in self.inner.astream(messages, stop=stop, **kwargs):
+                yield ChatGenerationChunk(message=chunk)
+
+    def bind_tools(self, tools, **kwargs) -> 'AdmittedChatModel':
+        return self.model_copy(update={'inner': self.inner.bind_tools(tools, **kwargs)})
+
+    def with_structured_output(self, schema, **kwargs) -> Runnable:
+        '''结构化输出，保留内部模型自身的结构化输出方式'''
+
+        return AdmittedRunnable(
+            self.controller, self.provider, self.priority, self.inner.with_structured_output(schema, **kwargs)
+        )
+
+
+class AdmittedRunnable(Runnable):
+    '''准入可运行对象'''
+
+    def __init__(self, controller: LLMAdmissionController, provider: str, priority: LLMPriority, inner: Runnable):
+        self._controller = controller
+        self._provider = provider
+        self._priority = priority
+        self._inner = inner
+
+    def invoke(self, input, config: RunnableConfig | None = None, **kwargs):
+        with self._controller.admit_threadsafe(self._provider, self._priority):
+            return self._inner.invoke(input, config, **kwargs)
+
+    async def ainvoke(self, input, config: RunnableConfig | None = None, **kwargs):
+        async with self._controller.admit(self._provider, self._priority):
+            return await self._inner.ainvoke(input, config, **kwargs)
@@ -0,0 +1,165 @@
+import logging
+from asyncio import Task, TimeoutError, create_task, gather, shield, wait_for
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from .episode_retriever import EpisodeRetriever
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _MemoryContext:
+    '''对话的情景记忆上下文'''
+
+    user_id: str
+    query: str  # 检索时的用户输入
+    topic: np.ndarray  # 检索时用户输入的向量，已归一化
+    context: str  # 渲染后的情景记忆块
+    stale: bool = False  # 反思写入新记忆后失效
+    generation: int = 0  # 失效次数，刷新期间失效时刷新结果仍为失效
+    refresh: Task | None = field(default=None, repr=False)  # 正在进行的刷新
+
+
+class MemoryContextCache:
+    '''
+    对话级情景记忆上下文缓存，同一对话相邻几轮的话题通常不变，检索到的情景记忆也基本相同。
+    每轮只嵌入用户输入，与缓存的话题向量的余弦距离不超过漂移阈值时直接复用上次检索的情景记忆块，不再检索。
+    话题漂移或缓存失效时在后台刷新，刷新在超时时间内完成则使用新结果，否则本轮沿用旧结果，刷新完成后供下一轮使用。
+    反思写入新记忆后使该用户所有对话的缓存失效，并在后台用上次的用户输入刷新。
+    '''
+
+    def __init__(
+        self,
+        retriever: EpisodeRetriever,
+        embeddings: Embeddings,
+        drift_threshold: float = 0.3,
+        refresh_timeout: float = 1.0,
+        max_threads: int = 256,
+    ):
+        self._retriever = retriever
+        self._embeddings = embeddings
+        self._drift_threshold = drift_threshold  # 余弦距离超过该阈值视为话题漂移
+        self._refresh_timeout = refresh_timeout  # 话题漂移时等待刷新的时间，单位秒
+        self._max_threads = max_threads  # 缓存的最大对话数，超出时淘汰最久未使用的对话
+        self._entries: OrderedDict[str, _MemoryContext] = OrderedDict()
+
+        # 指标相关
+        self._hits = 0
+        self._misses = 0
+        self._drifts = 0
+        self._invalidations = 0
+        self._refreshes = 0
+        self._stale_served = 0  # 刷新超时沿用旧结果的次数
+        self._failed_refreshes = 0
+
+    async def _embed(self, query: str) -> np.ndarray:
+        vector = np.asarray(await self._embeddings.aembed_query(query), np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    async def _refresh(self, entry: _MemoryContext, query: str, topic: np.ndarray) -> str:
+        '''重新检索，刷新期间没有失效时清除失效标记'''
+
+        generation = entry.generation
+        context = await self._retriever.retrieve(entry.user_id, query)
+        entry.query, entry.topic, entry.context = query, topic, context
+        entry.stale = entry.generation != generation
+        self._refreshes += 1
+        return context
+
+    def _start_refresh(self, entry: _MemoryContext, query: str, topic: np.ndarray) -> Task:
+        '''在后台刷新，取消同一对话进行中的旧刷新'''
+
+        if entry.refresh and not entry.refresh.done():
+            entry.refresh.cancel()
+        task = create_task(self._refresh(entry, query, topic))
+
+        def _done(t: Task):
+            if entry.refresh is t:
+                entry.refresh = None
+            if not t.cancelled() and t.exception():
+                self._failed_refreshes += 1
+                logger.error('<_refresh> 刷新情景记忆上下文报错！！！', exc_info=t.exception())
+
+        task.add_done_callback(_done)
+        entry.refresh = task
+        return task
+
+    def _evict(self):
+        while len(self._entries) > self._max_threads:
+            _, entry = self._entries.popitem(last=False)
+            if entry.refresh:
+                entry.refresh.cancel()
+
+    async def get(self, thread_id: str, user_id: str, query: str) -> str:
+        '''获取对话本轮的情景记忆块，话题未漂移且缓存未失效时复用上次的检索结果'''
+
+        entry = self._entries.get(thread_id)
+        if entry is None or entry.user_id != user_id:
+            # 嵌入和检索同时进行，同一批微批量嵌入中的相同文本只嵌入一次
+            topic, context = await gather(self._embed(query), self._retriever.retrieve(user_id, query))
+            self._misses += 1
+            self.discard(thread_id)
+            self._entries[thread_id] = _MemoryContext(user_id, query, topic, context)
+            self._evict()
+            return context
+
+        self._entries.move_to_end(thread_id)
+        topic = await self._embed(query)
+        if not entry.stale and 1 - float(topic @ entry.topic) <= self._drift_threshold:
+            self._hits += 1
+            return entry.context
+
+        if entry.stale:
+            self._misses += 1
+        else:
+            self._drifts += 1
+        try:
+            return await wait_for(shield(self._start_refresh(entry, query, topic)), self._refresh_timeout)
+        except TimeoutError:
+            self._stale_served += 1
+            return entry.context
+
+    def invalidate(self, namespace: tuple[str, ...] | None = None):
+        '''反思写入新记忆后调用，使写入的命名空间对应用户的所有对话失效并在后台刷新，命名空间为空时全部失效'''
+
+        user_id = namespace[-1] if namespace else None
+        for entry in self._entries.values():
+            if user_id is not None and entry.user_id != user_id:
+                continue
+            entry.stale = True
+            entry.generation += 1
+            self._invalidations += 1
+            if not entry.refresh:
+                self._start_refresh(entry, entry.query, entry.topic)
+
+    def discard(self, thread_id: str):
+        '''删除对话的缓存'''
+
+        entry = self._entries.pop(thread_id, None)
+        if entry and entry.refresh:
+            entry.refresh.cancel()
+
+    def clear(self):
+        for thread_id in list(self._entries):
+            self.discard(thread_id)
+
+    def snapshot(self) -> dict:
+        '''获取缓存指标'''
+
+        lookups = self._hits + self._misses + self._drifts
+        return {
+            'threads': len(self._entries),
+            'hits': self._hits,
+            'misses': self._misses,
+            'drifts': self._drifts,
+            'invalidations': self._invalidations,
+            'refreshes': self._refreshes,
+            'stale_served': self._stale_served,
+            'failed_refreshes': self._failed_refreshes,
+            'hit_rate': round(self._hits / lookups, 4) if lookups else 0.0,
+        }
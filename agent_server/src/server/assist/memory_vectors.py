@@ -0,0 +1,93 @@
+from dataclasses import dataclass
+from datetime import datetime
+from textwrap import dedent
+
+import numpy as np
+from langgraph.store.base import BaseStore
+
+from .sqlite_vector_store import SqliteVectorStore
+
+SELECT_VECTORS_SQL = dedent(
+    '''\
+    SELECT s.key, s.updated_at, sv.field_name, sv.embedding::real[] FROM store s
+    JOIN store_vectors sv ON sv.prefix = s.prefix AND sv.key = s.key
+    WHERE s.prefix = %s AND (sv.key, sv.field_name) > (%s, %s) AND (%s::text[] IS NULL OR sv.key = ANY(%s::text[]))
+    ORDER BY sv.key, sv.field_name
+    LIMIT %s
+    '''
+)
+
+INDEX_STATS_SQL = dedent(
+    '''\
+    SELECT
+        (SELECT COUNT(*) FROM store_vectors),
+        (SELECT COALESCE(SUM(pg_relation_size(indexrelid)), 0)::BIGINT FROM pg_index
+            WHERE indrelid = 'store_vectors'::regclass)
+    '''
+)
+
+
+@dataclass
+class MemoryVectors:
+    '''记忆向量，每个条目一行，条目向量为各字段向量之和归一化'''
+
+    keys: list[str]
+    updated_at: list[datetime]
+    vectors: np.ndarray  # 形状为 (条目数, 维度)，已归一化，点积即余弦相似度
+
+
+def _aggregate(owners: list[tuple[str, datetime]], vectors: np.ndarray) -> MemoryVectors:
+    '''按条目合并字段向量，owners 为每个向量所属条目的 (键, 更新时间)，同一条目的向量相邻'''
+
+    if not owners:
+        return MemoryVectors([], [], np.empty((0, vectors.shape[1] if vectors.ndim == 2 else 0), np.float32))
+
+    keys = [key for key, _ in owners]
+    starts = np.flatnonzero([i == 0 or keys[i] != keys[i - 1] for i in range(len(keys))])
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    summed = np.add.reduceat(vectors / np.where(norms == 0, 1, norms), starts, axis=0)
+    norms = np.linalg.norm(summed, axis=1, keepdims=True)
+    return MemoryVectors(
+        [owners[i][0] for i in starts],
+        [owners[i][1] for i in starts],
+        (summed / np.where(norms == 0, 1, norms)).astype(np.float32),
+    )
+
+
+async def load_memory_vectors(
+    store: BaseStore, namespace: tuple[str, ...], keys: list[str] | None = None, page_size: int = 5000
+) -> MemoryVectors:
+    '''读取命名空间下记忆的向量，keys 为空时读取所有记忆，Postgres 按键集分页读取，SQLite 直接读取内存映射文件'''
+
+    if isinstance(store, SqliteVectorStore):
+        return _aggregate(*await store.aload_vectors(namespace, keys))
+
+    owners, rows = [], []
+    after = ('', '')
+    async with store.conn.connection() as conn:
+        async with conn.cursor() as cur:
+            while True:
+                await cur.execute(SELECT_VECTORS_SQL, ('.'.join(namespace), *after, keys, keys, page_size))
+                page = await cur.fetchall()
+                for key, updated_at, _, embedding in page:
+                    owners.append((key, updated_at))
+                    rows.append(embedding)
+                if len(page) < page_size:
+                    break
+                after = page[-1][0], page[-1][2]
+
+    dims = len(rows[0]) if rows else 0
+    return _aggregate(owners, np.asarray(rows, np.float32).reshape(len(rows), dims))
+
+
+async def memory_index_stats(store: BaseStore) -> dict:
+    '''获取向量索引统计，Postgres 为向量表所有索引占用的字节数，SQLite 为有效向量占用的字节数'''
+
+    if isinstance(store, SqliteVectorStore):
+        return await store.aindex_stats()
+
+    async with store.conn.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(INDEX_STATS_SQL)
+            vectors, index_bytes = await cur.fetchone()
+            return {'vectors': vectors, 'index_bytes': index_bytes}
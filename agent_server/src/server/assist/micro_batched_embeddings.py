@@ -0,0 +1,111 @@
+from asyncio import Future, Task, TimerHandle, create_task, gather, get_running_loop
+
+from langchain_core.embeddings import Embeddings
+
+
+class MicroBatchedEmbeddings(Embeddings):
+    '''
+    微批嵌入模型，嵌入模型包装器，在等待时间内收集并发的异步嵌入请求，去重后合并为一次批量嵌入请求，再把向量分发回各个调用方。
+    同步接口直接调用被包装的嵌入模型，不参与合并。
+    '''
+
+    def __init__(self, embeddings: Embeddings, max_batch_size: int = 64, max_wait_ms: float = 5):
+        self._embeddings = embeddings
+        self._max_batch_size = max_batch_size  # 每次批量嵌入的最大文本数，达到后立即发送
+        self._max_wait = max_wait_ms / 1000  # 收集请求的最长等待时间，单位秒
+
+        self._pending: list[tuple[str, Future]] = []  # 等待发送的文本
+        self._flush_handle: TimerHandle | None = None
+        self._inflight: set[Task] = set()  # 正在发送的批量嵌入请求
+
+        # 指标相关
+        self._requests = 0  # 调用方请求数
+        self._texts = 0  # 调用方请求的文本数
+        self._batches = 0  # 批量嵌入请求数
+        self._embedded = 0  # 去重后实际嵌入的文本数
+        self._failed_batches = 0
+        self._max_observed_batch_size = 0
+        self._batch_size_buckets: dict[int, int] = {}  # 批大小分布，键为不超过批大小的最大 2 的幂
+
+    async def _aembed(self, texts: list[str]) -> list[list[float]]:
+        loop = get_running_loop()
+        futures = []
+        for text in texts:
+            future = loop.create_future()
+            self._pending.append((text, future))
+            futures.append(future)
+        self._requests += 1
+        self._texts += len(texts)
+
+        if len(self._pending) >= self._max_batch_size:
+            self._flush()
+        elif not self._flush_handle:
+            self._flush_handle = loop.call_later(self._max_wait, self._flush)
+        return list(await gather(*futures))
+
+    def _flush(self):
+        '''发送等待中的文本，超过最大批大小时切分为多个批量嵌入请求'''
+
+        if self._flush_handle:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        while self._pending:
+            batch = self._pending[: self._max_batch_size]
+            self._pending = self._pending[self._max_batch_size :]
+            task = create_task(self._send(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _send(self, batch: list[tuple[str, Future]]):
+        texts = list(dict.fromkeys(text for text, _ in batch))  # 同一批中的重复文本只嵌入一次
+        self._batches += 1
+        self._embedded += len(texts)
+        self._max_observed_batch_size = max(self._max_observed_batch_size, len(texts))
+        bucket = 1 << (len(texts).bit_length() - 1)
+        self._batch_size_buckets[bucket] = self._batch_size_buckets.get(bucket, 0) + 1
+
+        try:
+            vectors = await self._embeddings.aembed_documents(texts)
+        except Exception as e:
+            self._failed_batches += 1
+            for _, future in batch:
+                if not future.done():  # 调用方可能已取消
+                    future.set_exception(e)
+            return
+
+        vector_by_text = dict(zip(texts, vectors))
+        for text, future in batch:
+            if not future.done():
+                future.set_result(vector_by_text[text])
+
+    def snapshot(self) -> dict:
+        '''获取批量嵌入指标'''
+
+        return {
+            'max_batch_size': self._max_batch_size,
+            'max_wait_ms': self._max_wait * 1000,
+            'requests': self._requests,
+            'texts': self._texts,
+            'batches': self._batches,
+            'embedded': self._embedded,
+            'failed_batches': self._failed_batches,
+            'avg_batch_size': round(self._embedded / self._batches, 2) if self._batches else 0.0,
+            'max_observed_batch_size': self._max_observed_batch_size,
+            'batch_size_buckets': {str(bucket): n for bucket, n in sorted(self._batch_size_buckets.items())},
+        }
+
+    # 嵌入相关
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self._embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embeddings.embed_query(text)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        return await self._aembed(texts)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return (await self._aembed([text]))[0]
@@ -0,0 +1,249 @@
+import json
+from textwrap import dedent
+from typing import Any
+
+import aiosqlite
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+from psycopg_pool import AsyncConnectionPool
+
+from .sqlite_transaction import sqlite_transaction
+
+
+class PendingReflectionManager:
+    '''
+    待办反思管理器，每个对话一行，保存待办反思任务和已反思到的水位线，按对话 upsert。
+    载荷为空表示没有待办任务，部分索引只包含有待办任务的行，执行时间作为任务版本，反思完成时只清理仍是同一版本的任务。
+    '''
+
+    CREATE_TABLE_SQL = dedent(
+        '''\
+        CREATE TABLE IF NOT EXISTS pending_reflections (
+            thread_id TEXT PRIMARY KEY,
+            payload JSONB,
+            config JSONB,
+            execute_at DOUBLE PRECISION,
+            pending_watermark INTEGER,
+            watermark INTEGER DEFAULT 0 NOT NULL,
+            updated_at TIMESTAMP WITHOUT TIME ZONE DEFAULT LOCALTIMESTAMP NOT NULL
+        );
+        '''
+    )
+
+    CREATE_INDEX_SQL = dedent(
+        '''\
+        CREATE INDEX IF NOT EXISTS pending_reflections_execute_at_idx
+            ON pending_reflections (execute_at, thread_id)
+            WHERE payload IS NOT NULL;
+        '''
+    )
+
+    IMPORT_FROM_STORE_SQL = dedent(
+        '''\
+        INSERT INTO pending_reflections (thread_id, payload, config, execute_at, pending_watermark)
+        SELECT key, value->'payload', value->'config', (value->>'execute_at')::DOUBLE PRECISION,
+            (value->>'watermark')::INTEGER
+        FROM store WHERE prefix = 'memories.pending_tasks'
+        ON CONFLICT (thread_id) DO NOTHING;
+        INSERT INTO pending_reflections (thread_id, watermark)
+        SELECT key, (value->>'watermark')::INTEGER FROM store WHERE prefix = 'memories.reflection_watermarks'
+        ON CONFLICT (thread_id) DO UPDATE
+            SET watermark = GREATEST(pending_reflections.watermark, EXCLUDED.watermark);
+        DELETE FROM store WHERE prefix IN ('memories.pending_tasks', 'memories.reflection_watermarks');
+        '''
+    )  # 从长期记忆存储导入旧的待办任务和水位线
+
+    MIGRATIONS = [CREATE_TABLE_SQL, CREATE_INDEX_SQL, IMPORT_FROM_STORE_SQL]  # 模式迁移，只能追加
+
+    UPSERT_SQL = dedent(
+        '''\
+        INSERT INTO pending_reflections (thread_id, payload, config, execute_at, pending_watermark)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (thread_id) DO UPDATE
+            SET payload = EXCLUDED.payload, config = EXCLUDED.config, execute_at = EXCLUDED.execute_at,
+                pending_watermark = EXCLUDED.pending_watermark, updated_at = LOCALTIMESTAMP
+        '''
+    )
+
+    COMPLETE_SQL = dedent(
+        '''\
+        UPDATE pending_reflections
+        SET payload = CASE WHEN execute_at = %s THEN NULL ELSE payload END,
+            watermark = GREATEST(watermark, %s),
+            updated_at = LOCALTIMESTAMP
+        WHERE thread_id = %s
+        '''
+    )
+
+    CANCEL_SQL = 'UPDATE pending_reflections SET payload = NULL, updated_at = LOCALTIMESTAMP WHERE thread_id = %s'
+
+    SELECT_WATERMARK_SQL = 'SELECT watermark FROM pending_reflections WHERE thread_id = %s'
+
+    SELECT_PENDING_SQL = dedent(
+        '''\
+        SELECT thread_id, payload, config, execute_at, pending_watermark FROM pending_reflections
+        WHERE payload IS NOT NULL AND (execute_at, thread_id) > (%s, %s)
+        ORDER BY execute_at, thread_id
+        LIMIT %s
+        '''
+    )
+
+    def __init__(self, pool: AsyncConnectionPool):
+        self._pool = pool
+
+    async def upsert(
+        self,
+        thread_id: str,
+        payload: dict[str, Any],
+        config: dict[str, Any],
+        execute_at: float,
+        pending_watermark: int | None = None,
+    ):
+        '''写入待办任务，覆盖同一对话的旧任务，pending_watermark 为任务完成后的水位线'''
+
+        async with self._pool.connection() as conn:
+            await conn.execute(
+                self.UPSERT_SQL, (thread_id, Jsonb(payload), Jsonb(config), execute_at, pending_watermark)
+            )
+            await conn.commit()
+
+    async def complete(self, thread_id: str, execute_at: float, watermark: int | None):
+        '''完成待办任务，清理同一版本的任务并推进水位线'''
+
+        async with self._pool.connection() as conn:
+            await conn.execute(self.COMPLETE_SQL, (execute_at, watermark or 0, thread_id))
+            await conn.commit()
+
+    async def cancel(self, thread_id: str):
+        '''取消待办任务，保留水位线'''
+
+        async with self._pool.connection() as conn:
+            await conn.execute(self.CANCEL_SQL, (thread_id,))
+            await conn.commit()
+
+    async def get_watermark(self, thread_id: str) -> int:
+        '''获取水位线，未反思过的对话为 0'''
+
+        async with self._pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(self.SELECT_WATERMARK_SQL, (thread_id,))
+                row = await cur.fetchone()
+                return row[0] if row else 0
+
+    async def list_pending(self, limit: int, after: tuple[float, str] | None = None) -> list[dict]:
+        '''按执行时间键集分页读取待办任务，after 为上一页最后一个任务的 (执行时间, thread_id)'''
+
+        async with self._pool.connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                await cur.execute(self.SELECT_PENDING_SQL, (*(after or (float('-inf'), '')), limit))
+                return await cur.fetchall()
+
+
+class SqlitePendingReflectionManager(PendingReflectionManager):
+    '''SQLite 待办反思管理器，接口与待办反思管理器相同，载荷以 JSON 文本保存'''
+
+    CREATE_TABLE_SQL = dedent(
+        '''\
+        CREATE TABLE IF NOT EXISTS pending_reflections (
+            thread_id TEXT PRIMARY KEY,
+            payload TEXT,
+            config TEXT,
+            execute_at REAL,
+            pending_watermark INTEGER,
+            watermark INTEGER DEFAULT 0 NOT NULL,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP NOT NULL
+        );
+        '''
+    )
+
+    IMPORT_FROM_STORE_SQL = dedent(
+        '''\
+        INSERT INTO pending_reflections (thread_id, payload, config, execute_at, pending_watermark)
+        SELECT key, json_extract(value, '$.payload'), json_extract(value, '$.config'),
+            json_extract(value, '$.execute_at'), json_extract(value, '$.watermark')
+        FROM store WHERE prefix = 'memories.pending_tasks'
+        ON CONFLICT (thread_id) DO NOTHING;
+        INSERT INTO pending_reflections (thread_id, watermark)
+        SELECT key, json_extract(value, '$.watermark') FROM store WHERE prefix = 'memories.reflection_watermarks'
+        ON CONFLICT (thread_id) DO UPDATE
+            SET watermark = MAX(pending_reflections.watermark, excluded.watermark);
+        DELETE FROM store WHERE prefix IN ('memories.pending_tasks', 'memories.reflection_watermarks');
+        '''
+    )
+
+    MIGRATIONS = [CREATE_TABLE_SQL, PendingReflectionManager.CREATE_INDEX_SQL, IMPORT_FROM_STORE_SQL]
+
+    UPSERT_SQL = dedent(
+        '''\
+        INSERT INTO pending_reflections (thread_id, payload, config, execute_at, pending_watermark)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (thread_id) DO UPDATE
+            SET payload = excluded.payload, config = excluded.config, execute_at = excluded.execute_at,
+                pending_watermark = excluded.pending_watermark, updated_at = CURRENT_TIMESTAMP
+        '''
+    )
+
+    COMPLETE_SQL = dedent(
+        '''\
+        UPDATE pending_reflections
+        SET payload = CASE WHEN execute_at = ? THEN NULL ELSE payload END,
+            watermark = MAX(watermark, ?),
+            updated_at = CURRENT_TIMESTAMP
+        WHERE thread_id = ?
+        '''
+    )
+
+    CANCEL_SQL = 'UPDATE pending_reflections SET payload = NULL, updated_at = CURRENT_TIMESTAMP WHERE thread_id = ?'
+
+    SELECT_WATERMARK_SQL = 'SELECT watermark FROM pending_reflections WHERE thread_id = ?'
+
+    SELECT_PENDING_SQL = dedent(
+        '''\
+        SELECT thread_id, payload, config, execute_at, pending_watermark FROM pending_reflections
+        WHERE payload IS NOT NULL AND (execute_at, thread_id) > (?, ?)
+        ORDER BY execute_at, thread_id
+        LIMIT ?
+        '''
+    )
+
+    def __init__(self, conn: aiosqlite.Connection):
+        self._conn = conn
+
+    async def upsert(
+        self,
+        thread_id: str,
+        payload: dict[str, Any],
+        config: dict[str, Any],
+        execute_at: float,
+        pending_watermark: int | None = None,
+    ):
+        payload_text = json.dumps(payload, ensure_ascii=False)
+        config_text = json.dumps(config, ensure_ascii=False)
+        async with sqlite_transaction(self._conn) as conn:
+            await conn.execute(self.UPSERT_SQL, (thread_id, payload_text, config_text, execute_at, pending_watermark))
+
+    async def complete(self, thread_id: str, execute_at: float, watermark: int | None):
+        async with sqlite_transaction(self._conn) as conn:
+            await conn.execute(self.COMPLETE_SQL, (execute_at, watermark or 0, thread_id))
+
+    async def cancel(self, thread_id: str):
+        async with sqlite_transaction(self._conn) as conn:
+            await conn.execute(self.CANCEL_SQL, (thread_id,))
+
+    async def get_watermark(self, thread_id: str) -> int:
+        async with self._conn.execute(self.SELECT_WATERMARK_SQL, (thread_id,)) as cur:
+            row = await cur.fetchone()
+            return row[0] if row else 0
+
+    async def list_pending(self, limit: int, after: tuple[float, str] | None = None) -> list[dict]:
+        async with self._conn.execute(self.SELECT_PENDING_SQL, (*(after or (-1e308, '')), limit)) as cur:
+            return [
+                {
+                    'thread_id': thread_id,
+                    'payload': json.loads(payload),
+                    'config': json.loads(config),
+                    'execute_at': execute_at,
+                    'pending_watermark': pending_watermark,
+                }
+                for thread_id, payload, config, execute_at, pending_watermark in await cur.fetchall()
+            ]
@@ -0,0 +1,113 @@
+from __future__ import annotations  # 自动前向引用，不在代码运行时立即计算类型提示，而是当作字符串先存起来
+
+from calendar import monthrange
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+FREQUENCIES = ('HOURLY', 'DAILY', 'WEEKLY', 'MONTHLY', 'YEARLY')
+WEEKDAYS = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+
+
+@dataclass(frozen=True)
+class Recurrence:
+    '''
+    重复规则，iCalendar RRULE 的子集，支持 FREQ，INTERVAL，BYDAY（只用于每周），COUNT 和 UNTIL，
+    例如 FREQ=DAILY 表示每天，FREQ=WEEKLY;BYDAY=MO,WE,FR 表示每周一三五，FREQ=MONTHLY;COUNT=6 表示每月一次共六次。
+    每月和每年按首次发生的日期重复，没有该日期的月份或年份跳过，如每月 31 日跳过小月。
+    '''
+
+    freq: str
+    interval: int = 1
+    by_day: tuple[int, ...] = ()  # 星期几，0 为周一
+    count: int | None = None  # 总发生次数
+    until: datetime | None = None  # 最后发生时间
+
+    @classmethod
+    def parse(cls, rule: str) -> Recurrence:
+        '''解析重复规则，规则不合法或包含不支持的部分时抛出 ValueError'''
+
+        fields = {}
+        for part in rule.strip().removeprefix('RRULE:').split(';'):
+            if not part.strip():
+                continue
+            key, sep, value = part.partition('=')
+            if not sep:
+                raise ValueError(f'重复规则格式错误：{rule}')
+            fields[key.strip().upper()] = value.strip().upper()
+
+        unsupported = fields.keys() - {'FREQ', 'INTERVAL', 'BYDAY', 'COUNT', 'UNTIL'}
+        if unsupported:
+            raise ValueError(f'不支持的重复规则：{', '.join(sorted(unsupported))}')
+        if fields.get('FREQ') not in FREQUENCIES:
+            raise ValueError(f'不支持的重复频率：{fields.get('FREQ')}')
+
+        by_day = ()
+        if 'BYDAY' in fields:
+            if fields['FREQ'] != 'WEEKLY':
+                raise ValueError('BYDAY 只支持每周重复')
+            days = fields['BYDAY'].split(',')
+            if not set(days) <= set(WEEKDAYS):
+                raise ValueError(f'不支持的星期：{fields['BYDAY']}')
+            by_day = tuple(sorted({WEEKDAYS.index(day) for day in days}))
+
+        interval = int(fields.get('INTERVAL', 1))
+        count = int(fields['COUNT']) if 'COUNT' in fields else None
+        until = cls._parse_until(fields['UNTIL']) if 'UNTIL' in fields else None
+        if interval < 1 or (count is not None and count < 1):
+            raise ValueError(f'重复规则的间隔和次数必须为正数：{rule}')
+        return cls(fields['FREQ'], interval, by_day, count, until)
+
+    @staticmethod
+    def _parse_until(value: str) -> datetime:
+        '''解析截止时间，带 Z 或时区的 UTC 时间转换为本地时间，与到期时间一样不带时区'''
+
+        until = datetime.fromisoformat(value)
+        return until.astimezone().replace(tzinfo=None) if until.tzinfo else until
+
+    def __str__(self) -> str:
+        parts = [f'FREQ={self.freq}']
+        if self.interval != 1:
+            parts.append(f'INTERVAL={self.interval}')
+        if self.by_day:
+            parts.append(f'BYDAY={','.join(WEEKDAYS[day] for day in self.by_day)}')
+        if self.count is not None:
+            parts.append(f'COUNT={self.count}')
+        if self.until is not None:
+            parts.append(f'UNTIL={self.until.strftime('%Y%m%dT%H%M%S')}')
+        return ';'.join(parts)
+
+    def _step(self, time: datetime) -> datetime:
+        '''下一次发生时间，不考虑次数和截止时间'''
+
+        if self.freq == 'HOURLY':
+            return time + timedelta(hours=self.interval)
+        if self.freq == 'DAILY':
+            return time + timedelta(days=self.interval)
+        if self.freq == 'WEEKLY':
+            later = [day for day in self.by_day if day > time.weekday()]
+            if later:
+                return time + timedelta(days=later[0] - time.weekday())  # 同一周内的下一个星期几
+            if self.by_day:
+                return time + timedelta(weeks=self.interval, days=self.by_day[0] - time.weekday())
+            return time + timedelta(weeks=self.interval)
+
+        months = self.interval * (12 if self.freq == 'YEARLY' else 1)
+        index = time.year * 12 + time.month - 1
+        while True:
+            index += months
+            year, month = divmod(index, 12)
+            if time.day <= monthrange(year, month + 1)[1]:
+                return time.replace(year=year, month=month + 1)
+
+    def next_occurrence(self, time: datetime, occurrence: int, after: datetime) -> tuple[datetime, int] | None:
+        '''
+        第 occurrence 次发生在 time，返回晚于 after 的下一次发生时间和序号，错过的发生跳过但计入次数，
+        超出次数或截止时间时返回 None。
+        '''
+
+        while True:
+            time, occurrence = self._step(time), occurrence + 1
+            if (self.count is not None and occurrence > self.count) or (self.until and time > self.until):
+                return None
+            if time > after:
+                return time, occurrence
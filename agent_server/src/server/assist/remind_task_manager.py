@@ -1,14 +1,68 @@
-from asyncio import Event, Task
+import hashlib
+import json
+import logging
+from asyncio import Queue, Task
+from contextlib import asynccontextmanager
 from datetime import datetime
+from heapq import heappop, heappush
 from textwrap import dedent
+from typing import AsyncIterator
 
+import aiosqlite
 from psycopg import AsyncConnection
 from psycopg.rows import dict_row
 from psycopg_pool import AsyncConnectionPool
 
+from .recurrence import Recurrence
+from .sqlite_transaction import sqlite_transaction
+
+logger = logging.getLogger(__name__)
+
+
+class RemindTaskQueue:
+    '''提醒任务队列，按到期时间排列的最小堆，只保存任务的 id 和到期时间，同一任务的到期时间变化时旧条目惰性删除'''
+
+    def __init__(self):
+        self._heap: list[tuple[datetime, int]] = []
+        self._due_times: dict[int, datetime] = {}  # 每个任务最新的到期时间
+
+    def __len__(self) -> int:
+        return len(self._due_times)
+
+    def push(self, task_id: int, due_time: datetime):
+        if self._due_times.get(task_id) == due_time:
+            return
+        self._due_times[task_id] = due_time
+        heappush(self._heap, (due_time, task_id))
+
+    def next_due_time(self) -> datetime | None:
+        while self._heap and self._due_times.get(self._heap[0][1]) != self._heap[0][0]:
+            heappop(self._heap)  # 丢弃已被替换的旧条目
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: datetime) -> list[tuple[int, datetime]]:
+        '''取出到期任务的 id 和到期时间'''
+
+        due_tasks = []
+        while (due_time := self.next_due_time()) is not None and due_time <= now:
+            _, task_id = heappop(self._heap)
+            del self._due_times[task_id]
+            due_tasks.append((task_id, due_time))
+        return due_tasks
+
+    def clear(self):
+        self._heap.clear()
+        self._due_times.clear()
+
 
 class RemindTaskManager:
-    '''提醒任务管理器'''
+    '''
+    提醒任务管理器，新增任务和修改到期时间时由触发器通过 NOTIFY 通知，其他进程添加的任务也能收到，
+    重复任务只占一行，到期时间即下一次发生时间，认领时原地推进到下一次发生时间，仍由到期时间的部分索引覆盖。
+    批量添加任务时一条语句插入多行，未完成的任务按内容哈希唯一，重复提取的任务不会重复插入和通知。
+    调度器启动时读取一次未完成的任务，之后只监听通知，到期时才认领任务，不轮询数据库。
+    认领在一条语句中跳过其他进程已锁定的行并标记完成，多个进程可同时调度而不重复提醒。
+    '''
 
     CREATE_TABLE_SQL = dedent(
         '''\
@@ -34,70 +88,385 @@ class RemindTaskManager:
 
     INSERT_SQL = dedent(
         '''\
-        INSERT INTO remind_tasks (description, due_time, context)
-        VALUES (%s, %s, %s)
+        INSERT INTO remind_tasks (description, due_time, context, recurrence, content_hash)
+        VALUES {}
+        ON CONFLICT (content_hash) WHERE is_completed = FALSE DO NOTHING
+        RETURNING id, due_time
         '''
     )
 
-    SELECT_NEXT_TASK_DUE_TIME_SQL = dedent(
+    INSERT_ROW_SQL = '(%s, %s, %s, %s, %s)'
+
+    CREATE_NOTIFY_FUNCTION_SQL = dedent(
         '''\
-        SELECT due_time FROM remind_tasks WHERE is_completed = FALSE AND due_time > %s ORDER BY due_time ASC LIMIT 1
+        CREATE OR REPLACE FUNCTION notify_remind_task() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('remind_tasks', json_build_object('id', NEW.id, 'due_time', NEW.due_time)::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
         '''
     )
 
-    SELECT_DUE_TASKS_SQL = dedent(
+    CREATE_NOTIFY_TRIGGER_SQL = dedent(
         '''\
-        SELECT * FROM remind_tasks WHERE is_completed = FALSE AND due_time <= %s ORDER BY due_time ASC
+        CREATE TRIGGER remind_tasks_notify
+            AFTER INSERT OR UPDATE OF due_time, is_completed ON remind_tasks
+            FOR EACH ROW WHEN (NEW.is_completed = FALSE)
+            EXECUTE FUNCTION notify_remind_task();
         '''
     )
 
-    UPDATE_SQL = 'UPDATE remind_tasks SET is_completed = TRUE, completed_at = LOCALTIMESTAMP WHERE id = %s'
+    SELECT_PENDING_TASKS_SQL = 'SELECT id, due_time FROM remind_tasks WHERE is_completed = FALSE'
+
+    CLAIM_DUE_TASKS_SQL = dedent(
+        '''\
+        UPDATE remind_tasks SET is_completed = TRUE, completed_at = LOCALTIMESTAMP
+        WHERE id IN (
+            SELECT id FROM remind_tasks
+            WHERE is_completed = FALSE AND due_time <= %s
+            ORDER BY due_time ASC
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING *
+        '''
+    )
+
+    CREATE_CONTENT_HASH_INDEX_SQL = dedent(
+        '''\
+        CREATE UNIQUE INDEX IF NOT EXISTS content_hash_idx
+            ON remind_tasks (content_hash)
+            WHERE is_completed = FALSE;
+        '''
+    )
+
+    ADVANCE_SQL = dedent(
+        '''\
+        UPDATE remind_tasks SET due_time = %s, occurrence = %s, is_completed = FALSE, completed_at = NULL
+        WHERE id = %s
+        '''
+    )
+
+    # 已有相同内容的未完成任务时不恢复，由该任务提醒
+    RELEASE_SQL = dedent(
+        '''\
+        UPDATE remind_tasks r SET due_time = %s, occurrence = %s, is_completed = FALSE, completed_at = NULL
+        WHERE id = %s
+            AND NOT EXISTS (
+                SELECT 1 FROM remind_tasks d
+                WHERE d.content_hash = r.content_hash AND d.is_completed = FALSE AND d.id <> r.id
+            )
+        '''
+    )
+
+    MIGRATIONS = [
+        CREATE_TABLE_SQL,
+        CREATE_INDEX_SQL,
+        CREATE_NOTIFY_FUNCTION_SQL,
+        CREATE_NOTIFY_TRIGGER_SQL,
+        'ALTER TABLE remind_tasks ADD COLUMN IF NOT EXISTS recurrence TEXT',  # 重复规则，为空时只提醒一次
+        'ALTER TABLE remind_tasks ADD COLUMN IF NOT EXISTS occurrence INTEGER DEFAULT 1 NOT NULL',  # 当前是第几次发生
+        'ALTER TABLE remind_tasks ADD COLUMN IF NOT EXISTS content_hash TEXT',  # 内容哈希，用于去重
+        CREATE_CONTENT_HASH_INDEX_SQL,
+    ]  # 模式迁移，只能追加
+
+    CHANNEL = 'remind_tasks'  # 通知频道
 
-    def __init__(self, pool: AsyncConnectionPool, remind_task_scheduler_wakeup_event: Event):
+    def __init__(self, pool: AsyncConnectionPool):
         self._pool = pool
-        self._remind_task_scheduler_wakeup_event = remind_task_scheduler_wakeup_event
 
     @staticmethod
-    async def setup(conn: AsyncConnection):
+    def _normalize_recurrence(task: Task) -> str | None:
+        '''规范化任务的重复规则，规则不合法时按一次性任务添加'''
+
+        rule = getattr(task, 'recurrence', None)
+        if not rule:
+            return None
         try:
-            async with conn.cursor() as cur:
-                await cur.execute(RemindTaskManager.CREATE_TABLE_SQL)
-                await cur.execute(RemindTaskManager.CREATE_INDEX_SQL)
-            await conn.commit()
-        except Exception:
-            raise
+            return str(Recurrence.parse(rule))
+        except ValueError as e:
+            logger.warning(f'<add_tasks> 重复规则 {rule} 不合法，按一次性任务添加：{e}')
+            return None
+
+    @staticmethod
+    def _advance(tasks: list[dict], now: datetime) -> list[tuple[datetime, int, int]]:
+        '''计算认领到的重复任务的下一次发生时间，记录在任务的 next_due_time 中，返回 (到期时间, 序号, id)'''
+
+        advances = []
+        for task in tasks:
+            task['next_due_time'] = None
+            if task['recurrence']:
+                occurrence = Recurrence.parse(task['recurrence']).next_occurrence(
+                    task['due_time'], task['occurrence'], now
+                )
+                if occurrence:
+                    task['next_due_time'] = occurrence[0]
+                    advances.append((*occurrence, task['id']))
+        return advances
+
+    @staticmethod
+    def _content_hash(task: Task, recurrence: str | None) -> str:
+        '''任务的内容哈希，由描述，到期时间和重复规则计算，上下文由 LLM 每次重新总结，不参与计算'''
+
+        due_time = task.due_time.isoformat() if task.due_time else ''
+        content = '\x1f'.join((task.description.strip(), due_time, recurrence or ''))
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def _rows(self, tasks: list[Task]) -> list[tuple]:
+        '''待插入的行，跳过没有到期时间的任务，同一批中内容相同的任务只保留一个'''
+
+        rows = {}
+        for task in tasks:
+            if task.due_time is None:  # LLM 无法推测到期时间，任务无法调度
+                logger.warning(f'<add_tasks> 任务 {task.description} 没有到期时间，跳过')
+                continue
+            recurrence = self._normalize_recurrence(task)
+            content_hash = self._content_hash(task, recurrence)
+            rows.setdefault(content_hash, (task.description, task.due_time, task.context, recurrence, content_hash))
+        return list(rows.values())
 
     async def add_task(self, task: Task):
-        '''添加任务，将任务添加到数据库并激活提醒任务调度器唤醒事件'''
+        '''添加任务'''
+
+        await self.add_tasks([task])
 
-        task_description = task.description
+    async def add_tasks(self, tasks: list[Task]) -> int:
+        '''批量添加任务，一条语句插入，已有相同内容的未完成任务时跳过，由触发器在提交时通知调度器，返回插入的任务数'''
+
+        rows = self._rows(tasks)
+        if not rows:
+            return 0
+
+        sql = self.INSERT_SQL.format(', '.join([self.INSERT_ROW_SQL] * len(rows)))
         async with self._pool.connection() as conn:
-            await conn.execute(self.INSERT_SQL, (task_description, task.due_time, task.context))
+            async with conn.cursor() as cur:
+                await cur.execute(sql, [value for row in rows for value in row])
+                inserted = await cur.fetchall()
             await conn.commit()
+        return len(inserted)
 
-            self._remind_task_scheduler_wakeup_event.set()
-
-    async def get_next_task_due_time(self) -> datetime | None:
-        '''获取下一个任务的到期时间'''
+    async def get_pending_tasks(self) -> list[tuple[int, datetime]]:
+        '''获取所有未完成任务的 id 和到期时间，包括已过期的任务'''
 
         async with self._pool.connection() as conn:
             async with conn.cursor() as cur:
-                await cur.execute(self.SELECT_NEXT_TASK_DUE_TIME_SQL, (datetime.now(),))
-                row = await cur.fetchone()
-                return row[0] if row else None
+                await cur.execute(self.SELECT_PENDING_TASKS_SQL)
+                return await cur.fetchall()
 
-    async def get_due_tasks(self) -> list[dict]:
-        '''获取到期任务'''
+    async def claim_due_tasks(self, limit: int) -> list[dict]:
+        '''
+        认领最多 limit 个到期任务并标记完成，跳过其他进程正在认领的任务，按到期时间返回认领到的任务。
+        重复任务在同一事务中推进到下一次发生时间并恢复为未完成，由触发器通知调度器。
+        '''
 
+        now = datetime.now()
         async with self._pool.connection() as conn:
             async with conn.cursor(row_factory=dict_row) as cur:
-                await cur.execute(self.SELECT_DUE_TASKS_SQL, (datetime.now(),))
-                return await cur.fetchall()
+                await cur.execute(self.CLAIM_DUE_TASKS_SQL, (now, limit))
+                tasks = await cur.fetchall()
+                advances = self._advance(tasks, now)
+                if advances:
+                    await cur.executemany(self.ADVANCE_SQL, advances)
+            await conn.commit()
+        return sorted(tasks, key=lambda task: task['due_time'])
 
-    async def mark_task_completed(self, task_id: int):
-        '''标记任务已完成'''
+    async def release_tasks(self, tasks: list[dict]):
+        '''
+        释放认领后未能提醒的任务，恢复为认领前的到期时间和序号并标记未完成，重复任务的推进一并撤销，
+        由触发器通知调度器重新认领，保证每个任务至少提醒一次。
+        '''
+
+        if not tasks:
+            return
 
         async with self._pool.connection() as conn:
             async with conn.cursor() as cur:
-                await cur.execute(self.UPDATE_SQL, (task_id,))
+                await cur.executemany(
+                    self.RELEASE_SQL, [(task['due_time'], task['occurrence'], task['id']) for task in tasks]
+                )
             await conn.commit()
+
+    @asynccontextmanager
+    async def listen(self) -> AsyncIterator[AsyncIterator[tuple[int, datetime]]]:
+        '''监听任务通知，使用连接池之外的专用连接，进入时已开始监听，产出任务的 id 和到期时间，连接断开时抛出异常'''
+
+        async with await AsyncConnection.connect(self._pool.conninfo, autocommit=True) as conn:
+            await conn.execute(f'LISTEN {self.CHANNEL}')
+
+            async def notifications():
+                async for notify in conn.notifies():
+                    payload = json.loads(notify.payload)
+                    yield payload['id'], datetime.fromisoformat(payload['due_time'])
+
+            yield notifications()
+
+
+class SqliteRemindTaskManager(RemindTaskManager):
+    '''SQLite 提醒任务管理器，单机嵌入式存储下的提醒任务管理器，接口与提醒任务管理器相同，时间以 ISO 格式文本保存'''
+
+    CREATE_TABLE_SQL = dedent(
+        '''\
+        CREATE TABLE IF NOT EXISTS remind_tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            description TEXT NOT NULL,
+            due_time TEXT NOT NULL,
+            context TEXT,
+            is_completed INTEGER DEFAULT 0 NOT NULL,
+            created_at TEXT NOT NULL,
+            completed_at TEXT
+        );
+        '''
+    )
+
+    CREATE_INDEX_SQL = dedent(
+        '''\
+        CREATE INDEX IF NOT EXISTS due_time_idx
+            ON remind_tasks (due_time)
+            WHERE is_completed = 0;
+        '''
+    )
+
+    INSERT_SQL = dedent(
+        '''\
+        INSERT INTO remind_tasks (description, due_time, context, recurrence, content_hash, created_at)
+        VALUES {}
+        ON CONFLICT (content_hash) WHERE is_completed = 0 DO NOTHING
+        RETURNING id, due_time
+        '''
+    )
+
+    INSERT_ROW_SQL = '(?, ?, ?, ?, ?, ?)'
+
+    SELECT_PENDING_TASKS_SQL = 'SELECT id, due_time FROM remind_tasks WHERE is_completed = 0'
+
+    CLAIM_DUE_TASKS_SQL = dedent(
+        '''\
+        UPDATE remind_tasks SET is_completed = 1, completed_at = ?
+        WHERE id IN (
+            SELECT id FROM remind_tasks WHERE is_completed = 0 AND due_time <= ? ORDER BY due_time ASC LIMIT ?
+        )
+        RETURNING *
+        '''
+    )
+
+    CREATE_CONTENT_HASH_INDEX_SQL = dedent(
+        '''\
+        CREATE UNIQUE INDEX IF NOT EXISTS content_hash_idx
+            ON remind_tasks (content_hash)
+            WHERE is_completed = 0;
+        '''
+    )
+
+    ADVANCE_SQL = dedent(
+        '''\
+        UPDATE remind_tasks SET due_time = ?, occurrence = ?, is_completed = 0, completed_at = NULL
+        WHERE id = ?
+        '''
+    )
+
+    RELEASE_SQL = dedent(
+        '''\
+        UPDATE remind_tasks AS r SET due_time = ?, occurrence = ?, is_completed = 0, completed_at = NULL
+        WHERE id = ?
+            AND NOT EXISTS (
+                SELECT 1 FROM remind_tasks d
+                WHERE d.content_hash = r.content_hash AND d.is_completed = 0 AND d.id <> r.id
+            )
+        '''
+    )
+
+    MIGRATIONS = [
+        CREATE_TABLE_SQL,
+        CREATE_INDEX_SQL,
+        'ALTER TABLE remind_tasks ADD COLUMN recurrence TEXT',
+        'ALTER TABLE remind_tasks ADD COLUMN occurrence INTEGER DEFAULT 1 NOT NULL',
+        'ALTER TABLE remind_tasks ADD COLUMN content_hash TEXT',
+        CREATE_CONTENT_HASH_INDEX_SQL,
+    ]
+
+    DATETIME_COLUMNS = ('due_time', 'created_at', 'completed_at')
+
+    def __init__(self, conn: aiosqlite.Connection):
+        self._conn = conn
+        self._notifications: Queue[tuple[int, datetime]] = Queue()  # 单进程独占数据库文件，通知在进程内传递
+
+    @staticmethod
+    def _to_text(time: datetime) -> str:
+        return time.isoformat(sep=' ', timespec='microseconds')  # 固定格式，文本比较与时间比较一致
+
+    async def add_tasks(self, tasks: list[Task]) -> int:
+        '''批量添加任务，一条语句插入，已有相同内容的未完成任务时跳过，提交后通知调度器，返回插入的任务数'''
+
+        rows = self._rows(tasks)
+        if not rows:
+            return 0
+
+        created_at = self._to_text(datetime.now())
+        sql = self.INSERT_SQL.format(', '.join([self.INSERT_ROW_SQL] * len(rows)))
+        values = [
+            value
+            for description, due_time, context, recurrence, content_hash in rows
+            for value in (description, self._to_text(due_time), context, recurrence, content_hash, created_at)
+        ]
+        async with sqlite_transaction(self._conn) as conn:
+            async with conn.execute(sql, values) as cur:
+                inserted = await cur.fetchall()
+
+        for task_id, due_time in inserted:
+            self._notifications.put_nowait((task_id, datetime.fromisoformat(due_time)))
+        return len(inserted)
+
+    async def get_pending_tasks(self) -> list[tuple[int, datetime]]:
+        '''获取所有未完成任务的 id 和到期时间，包括已过期的任务'''
+
+        async with self._conn.execute(self.SELECT_PENDING_TASKS_SQL) as cur:
+            return [(task_id, datetime.fromisoformat(due_time)) for task_id, due_time in await cur.fetchall()]
+
+    async def claim_due_tasks(self, limit: int) -> list[dict]:
+        '''认领最多 limit 个到期任务并标记完成，单进程独占数据库文件，无需跳过锁定的行，重复任务推进后通知调度器'''
+
+        now = datetime.now()
+        now_text = self._to_text(now)
+        async with sqlite_transaction(self._conn) as conn:  # 认领和推进重复任务在同一事务中
+            async with conn.execute(self.CLAIM_DUE_TASKS_SQL, (now_text, now_text, limit)) as cur:
+                columns = [column[0] for column in cur.description]
+                tasks = [dict(zip(columns, row)) for row in await cur.fetchall()]
+
+            for task in tasks:
+                task['is_completed'] = bool(task['is_completed'])
+                for column in self.DATETIME_COLUMNS:
+                    if task[column]:
+                        task[column] = datetime.fromisoformat(task[column])
+            advances = self._advance(tasks, now)
+            if advances:
+                await conn.executemany(
+                    self.ADVANCE_SQL, [(self._to_text(due_time), *rest) for due_time, *rest in advances]
+                )
+
+        for due_time, _, task_id in advances:
+            self._notifications.put_nowait((task_id, due_time))
+        return sorted(tasks, key=lambda task: task['due_time'])
+
+    async def release_tasks(self, tasks: list[dict]):
+        '''释放认领后未能提醒的任务，恢复为认领前的到期时间和序号并标记未完成，通知调度器重新认领'''
+
+        if not tasks:
+            return
+
+        async with sqlite_transaction(self._conn) as conn:
+            await conn.executemany(
+                self.RELEASE_SQL, [(self._to_text(task['due_time']), task['occurrence'], task['id']) for task in tasks]
+            )
+        for task in tasks:
+            self._notifications.put_nowait((task['id'], task['due_time']))
+
+    @asynccontextmanager
+    async def listen(self) -> AsyncIterator[AsyncIterator[tuple[int, datetime]]]:
+        '''监听任务通知，产出本进程添加的任务的 id 和到期时间'''
+
+        async def notifications():
+            while True:
+                yield await self._notifications.get()
+
+        yield notifications()
@@ -0,0 +1,170 @@
+import sqlite3
+from dataclasses import dataclass
+from textwrap import dedent
+from typing import Any, Awaitable, Callable
+
+import aiosqlite
+from psycopg import AsyncConnection
+from psycopg.errors import UndefinedTable
+
+from .sqlite_transaction import sqlite_transaction
+
+Migration = str | Callable[[Any], Awaitable[None]]  # SQL 或接收数据库连接的异步函数
+
+
+@dataclass
+class _Component:
+    '''组件，一组按顺序执行的迁移'''
+
+    name: str
+    migrations: list[Migration]
+    version: int | None  # 为空时等于迁移数
+
+
+class SchemaMigrator:
+    '''
+    模式迁移器，在 schema_versions 表中记录每个组件的模式版本，启动时只读取一次版本，模式已是最新时跳过所有准备动作。
+    组件自带迁移机制时，如检查点保存器和长期记忆存储，可只注册一个 setup 迁移并指定版本，版本变化时重新运行 setup。
+    '''
+
+    CREATE_TABLE_SQL = dedent(
+        '''\
+        CREATE TABLE IF NOT EXISTS schema_versions (
+            component TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            applied_at TIMESTAMP WITHOUT TIME ZONE DEFAULT LOCALTIMESTAMP NOT NULL
+        );
+        '''
+    )
+
+    SELECT_VERSIONS_SQL = 'SELECT component, version FROM schema_versions'
+
+    UPSERT_VERSION_SQL = dedent(
+        '''\
+        INSERT INTO schema_versions (component, version)
+        VALUES (%s, %s)
+        ON CONFLICT (component) DO UPDATE
+            SET version = EXCLUDED.version, applied_at = LOCALTIMESTAMP
+        '''
+    )
+
+    LOCK_KEY = 0x61676E74  # 咨询锁键，多个进程同时启动时只有一个执行迁移
+
+    def __init__(self, conninfo: str):
+        self._conninfo = conninfo
+        self._components: list[_Component] = []
+
+    def register(self, name: str, migrations: list[Migration], version: int | None = None):
+        '''注册组件，按注册顺序迁移'''
+
+        self._components.append(_Component(name, migrations, version))
+
+    def _pending(self, versions: dict[str, int]) -> list[tuple[_Component, int, int]]:
+        pending = []
+        for component in self._components:
+            target = component.version if component.version is not None else len(component.migrations)
+            current = versions.get(component.name, 0)
+            if current < target:
+                pending.append((component, current, target))
+        return pending
+
+    @staticmethod
+    async def _apply(conn, migrations: list[Migration]):
+        for migration in migrations:
+            if isinstance(migration, str):
+                await conn.execute(migration)
+            else:
+                await migration(conn)
+
+    async def _read_versions(self, conn: AsyncConnection) -> dict[str, int]:
+        try:
+            async with conn.cursor() as cur:
+                await cur.execute(self.SELECT_VERSIONS_SQL)
+                return dict(await cur.fetchall())
+        except UndefinedTable:
+            return {}
+
+    async def migrate(self) -> dict[str, tuple[int, int]]:
+        '''迁移，返回已迁移的组件及其迁移前后的版本，模式已是最新时只执行一次查询'''
+
+        async with await AsyncConnection.connect(self._conninfo, autocommit=True) as conn:
+            if not self._pending(await self._read_versions(conn)):
+                return {}
+
+            await conn.execute(self.CREATE_TABLE_SQL)
+            await conn.execute('SELECT pg_advisory_lock(%s)', (self.LOCK_KEY,))
+            try:
+                applied = {}
+                for component, current, target in self._pending(await self._read_versions(conn)):
+                    if component.version is None:
+                        async with conn.transaction():  # 迁移和版本在同一事务中提交
+                            await self._apply(conn, component.migrations[current:])
+                            await conn.execute(self.UPSERT_VERSION_SQL, (component.name, target))
+                    else:
+                        await self._apply(conn, component.migrations)  # 组件的 setup 可能在事务外建索引，不包裹事务
+                        await conn.execute(self.UPSERT_VERSION_SQL, (component.name, target))
+                    applied[component.name] = (current, target)
+                return applied
+            finally:
+                await conn.execute('SELECT pg_advisory_unlock(%s)', (self.LOCK_KEY,))
+
+
+class SqliteSchemaMigrator(SchemaMigrator):
+    '''SQLite 模式迁移器，SQL 迁移可包含多条语句，每个组件的迁移和版本在同一事务中提交'''
+
+    CREATE_TABLE_SQL = dedent(
+        '''\
+        CREATE TABLE IF NOT EXISTS schema_versions (
+            component TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            applied_at TEXT DEFAULT CURRENT_TIMESTAMP NOT NULL
+        );
+        '''
+    )
+
+    UPSERT_VERSION_SQL = dedent(
+        '''\
+        INSERT INTO schema_versions (component, version)
+        VALUES (?, ?)
+        ON CONFLICT (component) DO UPDATE
+            SET version = excluded.version, applied_at = CURRENT_TIMESTAMP
+        '''
+    )
+
+    def __init__(self, conn: aiosqlite.Connection):
+        self._conn = conn
+        self._components: list[_Component] = []
+
+    @staticmethod
+    def _split(script: str) -> list[str]:
+        '''把脚本拆分为单条语句，字符串和触发器语句体中的分号不拆分'''
+
+        statements, statement = [], ''
+        for part in script.split(';'):
+            statement += part + ';'
+            if sqlite3.complete_statement(statement):
+                if statement.strip(' \n;'):
+                    statements.append(statement.strip())
+                statement = ''
+        return statements
+
+    async def migrate(self) -> dict[str, tuple[int, int]]:
+        async with sqlite_transaction(self._conn) as conn:
+            await conn.execute(self.CREATE_TABLE_SQL)
+        async with self._conn.execute(self.SELECT_VERSIONS_SQL) as cur:
+            versions = dict(await cur.fetchall())
+
+        applied = {}
+        for component, current, target in self._pending(versions):
+            migrations = component.migrations if component.version is not None else component.migrations[current:]
+            # executescript 会先提交未提交的事务，迁移逐条执行，与版本在同一事务中提交，失败时整体回滚
+            async with sqlite_transaction(self._conn) as conn:
+                for migration in migrations:
+                    if isinstance(migration, str):
+                        for statement in self._split(migration):
+                            await conn.execute(statement)
+                    else:
+                        await migration(conn)
+                await conn.execute(self.UPSERT_VERSION_SQL, (component.name, target))
+            applied[component.name] = (current, target)
+        return applied
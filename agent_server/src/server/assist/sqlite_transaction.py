@@ -0,0 +1,26 @@
+from asyncio import Lock
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+from weakref import WeakKeyDictionary
+
+import aiosqlite
+
+_locks: WeakKeyDictionary[aiosqlite.Connection, Lock] = WeakKeyDictionary()  # 每个连接一把锁
+
+
+@asynccontextmanager
+async def sqlite_transaction(conn: aiosqlite.Connection) -> AsyncIterator[aiosqlite.Connection]:
+    '''
+    SQLite 写事务，多个管理器共用同一连接并发执行，连接上的提交和回滚作用于所有未提交的语句，
+    因此同一连接上的写事务用锁串行执行，BEGIN IMMEDIATE 开始时即获取数据库写锁，正常退出时提交，异常时回滚。
+    '''
+
+    lock = _locks.setdefault(conn, Lock())
+    async with lock:
+        await conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            await conn.rollback()
+            raise
+        await conn.commit()
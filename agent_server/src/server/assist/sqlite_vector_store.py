@@ -0,0 +1,415 @@
+import json
+import sqlite3
+from asyncio import gather, to_thread
+from datetime import datetime, timezone
+from os import path
+from threading import RLock
+from typing import Any, Iterable
+
+import numpy as np
+from langgraph.store.base import (
+    BaseStore,
+    GetOp,
+    IndexConfig,
+    Item,
+    ListNamespacesOp,
+    MatchCondition,
+    Op,
+    PutOp,
+    Result,
+    SearchItem,
+    SearchOp,
+    ensure_embeddings,
+    get_text_at_path,
+    tokenize_path,
+)
+
+
+class SqliteVectorStore(BaseStore):
+    '''
+    SQLite 向量存储，单机嵌入式的长期记忆存储，替代 AsyncPostgresStore。
+    条目保存在 SQLite 的 store 表中，向量保存在内存映射文件中，store_vectors 表记录向量所在的槽位，检索时用 NumPy 暴力计算相似度。
+    '''
+
+    CREATE_TABLES_SQL = (
+        '''\
+        CREATE TABLE IF NOT EXISTS store (
+            prefix TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (prefix, key)
+        )''',
+        '''\
+        CREATE TABLE IF NOT EXISTS store_vectors (
+            prefix TEXT NOT NULL,
+            key TEXT NOT NULL,
+            field_name TEXT NOT NULL,
+            slot INTEGER NOT NULL UNIQUE,
+            PRIMARY KEY (prefix, key, field_name)
+        )''',
+    )
+
+    INITIAL_CAPACITY = 1024  # 向量文件的初始槽位数，写满后翻倍
+
+    def __init__(self, conn_path: str, vector_path: str, index: IndexConfig | None = None):
+        self._conn_path = conn_path
+        self._vector_path = vector_path
+        self._lock = RLock()
+        self._conn: sqlite3.Connection | None = None
+
+        self.index_config = None
+        self.embeddings = None
+        if index:
+            self.index_config = index.copy()
+            self.embeddings = ensure_embeddings(index.get('embed'))
+            self.index_config['__tokenized_fields'] = [
+                (field, tokenize_path(field)) if field != '$' else (field, field)
+                for field in (index.get('fields') or ['$'])
+            ]
+            self._distance_type = index.get('distance_type', 'cosine')
+            if self._distance_type not in ('cosine', 'inner_product', 'l2'):
+                raise ValueError(f'不支持的距离类型：{self._distance_type}')
+
+        self._vectors: np.memmap | None = None
+        self._free_slots: list[int] = []
+
+    # 准备相关
+    async def setup(self):
+        '''准备，建表，打开向量文件并找出空闲槽位'''
+
+        await to_thread(self._setup)
+
+    def _setup(self):
+        with self._lock:
+            self._conn = sqlite3.connect(self._conn_path, check_same_thread=False, isolation_level=None)
+            self._conn.execute('PRAGMA journal_mode = WAL')
+            self._conn.execute('PRAGMA busy_timeout = 5000')
+            for sql in self.CREATE_TABLES_SQL:
+                self._conn.execute(sql)
+
+            if not self.index_config:
+                return
+
+            dims = self.index_config['dims']
+            if path.exists(self._vector_path):
+                capacity = path.getsize(self._vector_path) // (dims * 4)
+                self._vectors = np.memmap(self._vector_path, np.float32, 'r+', shape=(capacity, dims))
+            else:
+                self._vectors = np.memmap(self._vector_path, np.float32, 'w+', shape=(self.INITIAL_CAPACITY, dims))
+
+            used_slots = {row[0] for row in self._conn.execute('SELECT slot FROM store_vectors')}
+            self._free_slots = [slot for slot in range(len(self._vectors) - 1, -1, -1) if slot not in used_slots]
+
+    def close(self):
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+                self._vectors = None
+            if self._conn:
+                self._conn.close()
+                self._conn = None
+
+    # 向量相关
+    def _allocate_slot(self) -> int:
+        '''分配槽位，没有空闲槽位时向量文件容量翻倍'''
+
+        if not self._free_slots:
+            capacity, dims = self._vectors.shape
+            self._vectors.flush()
+            with open(self._vector_path, 'r+b') as file:
+                file.truncate(capacity * 2 * dims * 4)
+            self._vectors = np.memmap(self._vector_path, np.float32, 'r+', shape=(capacity * 2, dims))
+            self._free_slots = list(range(capacity * 2 - 1, capacity - 1, -1))
+        return self._free_slots.pop()
+
+    def _normalize(self, vectors: np.ndarray) -> np.ndarray:
+        if self._distance_type != 'cosine':
+            return vectors
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def _score(self, query: list[float], slots: np.ndarray) -> np.ndarray:
+        query_vector = self._normalize(np.asarray(query, np.float32))
+        if self._distance_type == 'l2':
+            return -np.linalg.norm(self._vectors[slots] - query_vector, axis=1)
+        return self._vectors[slots] @ query_vector
+
+    # 批处理相关
+    def batch(self, ops: Iterable[Op]) -> list[Result]:
+        ops = list(ops)
+        queries, texts = self._collect_texts(ops)
+        query_vectors = [self.embeddings.embed_query(query) for query in queries] if queries else []
+        text_vectors = self.embeddings.embed_documents(texts) if texts else []
+        return self._apply(ops, dict(zip(queries, query_vectors)), dict(zip(texts, text_vectors)))
+
+    async def abatch(self, ops: Iterable[Op]) -> list[Result]:
+        ops = list(ops)
+        queries, texts = self._collect_texts(ops)
+        query_vectors = await gather(*(self.embeddings.aembed_query(query) for query in queries))
+        text_vectors = await self.embeddings.aembed_documents(texts) if texts else []
+        return await to_thread(self._apply, ops, dict(zip(queries, query_vectors)), dict(zip(texts, text_vectors)))
+
+    def _collect_texts(self, ops: list[Op]) -> tuple[list[str], list[str]]:
+        '''收集需要嵌入的查询和文本，在持有锁之前完成嵌入'''
+
+        if not self.index_config:
+            return [], []
+
+        queries, texts = set(), set()
+        for op in ops:
+            if isinstance(op, SearchOp) and op.query:
+                queries.add(op.query)
+            elif isinstance(op, PutOp):
+                for _, texts_at_path in self._extract_texts(op):
+                    texts.update(texts_at_path)
+        return list(queries), list(texts)
+
+    def _extract_texts(self, op: PutOp) -> list[tuple[str, list[str]]]:
+        if not self.index_config or op.value is None or op.index is False:
+            return []
+
+        if op.index is None:
+            fields = self.index_config['__tokenized_fields']
+        else:
+            fields = [(field, tokenize_path(field)) for field in op.index]
+
+        extracted = []
+        for field, tokenized_field in fields:
+            texts = get_text_at_path(op.value, tokenized_field)
+            if len(texts) > 1:
+                extracted.extend((f'{field}.{i}', [text]) for i, text in enumerate(texts))
+            elif texts:
+                extracted.append((field, texts))
+        return extracted
+
+    def _apply(self, ops: list[Op], query_vectors: dict, text_vectors: dict) -> list[Result]:
+        with self._lock:
+            results: list[Result] = []
+            put_ops: dict[tuple[tuple[str, ...], str], PutOp] = {}
+            for op in ops:
+                if isinstance(op, PutOp):
+                    put_ops[(op.namespace, op.key)] = op
+                    results.append(None)
+                elif isinstance(op, GetOp):
+                    results.append(self._get(op))
+                elif isinstance(op, SearchOp):
+                    results.append(self._search(op, query_vectors.get(op.query)))
+                elif isinstance(op, ListNamespacesOp):
+                    results.append(self._list_namespaces(op))
+                else:
+                    raise ValueError(f'未知的操作类型：{type(op)}')
+
+            if put_ops:
+                self._put(put_ops.values(), text_vectors)
+            return results
+
+    # 操作相关
+    @staticmethod
+    def _row_to_item(row: tuple, item_class: type = Item, **kwargs) -> Item:
+        prefix, key, value, created_at, updated_at = row[:5]
+        return item_class(
+            namespace=tuple(prefix.split('.')),
+            key=key,
+            value=json.loads(value),
+            created_at=datetime.fromisoformat(created_at),
+            updated_at=datetime.fromisoformat(updated_at),
+            **kwargs,
+        )
+
+    def _get(self, op: GetOp) -> Item | None:
+        row = self._conn.execute(
+            'SELECT prefix, key, value, created_at, updated_at FROM store WHERE prefix = ? AND key = ?',
+            ('.'.join(op.namespace), op.key),
+        ).fetchone()
+        return self._row_to_item(row) if row else None
+
+    def _put(self, put_ops: Iterable[PutOp], text_vectors: dict):
+        '''写入，在同一事务中更新条目和槽位，向量先落盘再提交事务'''
+
+        now = datetime.now(timezone.utc).isoformat()
+        released_slots, allocated_slots = [], []
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            for op in put_ops:
+                prefix = '.'.join(op.namespace)
+                released_slots += [
+                    row[0]
+                    for row in self._conn.execute(
+                        'DELETE FROM store_vectors WHERE prefix = ? AND key = ? RETURNING slot', (prefix, op.key)
+                    )
+                ]
+                if op.value is None:
+                    self._conn.execute('DELETE FROM store WHERE prefix = ? AND key = ?', (prefix, op.key))
+                    continue
+
+                self._conn.execute(
+                    '''\
+                    INSERT INTO store (prefix, key, value, created_at, updated_at) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (prefix, key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at''',
+                    (prefix, op.key, json.dumps(op.value, ensure_ascii=False), now, now),
+                )
+                for field_name, texts in self._extract_texts(op):
+                    slot = self._allocate_slot()
+                    allocated_slots.append(slot)
+                    self._vectors[slot] = self._normalize(np.asarray(text_vectors[texts[0]], np.float32))
+                    self._conn.execute(
+                        'INSERT INTO store_vectors (prefix, key, field_name, slot) VALUES (?, ?, ?, ?)',
+                        (prefix, op.key, field_name, slot),
+                    )
+
+            if self._vectors is not None:
+                self._vectors.flush()
+            self._conn.execute('COMMIT')
+            self._free_slots += released_slots
+        except Exception:
+            self._conn.execute('ROLLBACK')
+            self._free_slots += allocated_slots
+            raise
+
+    @staticmethod
+    def _prefix_condition(namespace_prefix: tuple[str, ...], alias: str = '') -> tuple[str, tuple]:
+        if not namespace_prefix:
+            return '1 = 1', ()
+        prefix = '.'.join(namespace_prefix)
+        return (
+            f'({alias}prefix = ? OR substr({alias}prefix, 1, ?) = ?)',
+            (prefix, len(prefix) + 1, f'{prefix}.'),
+        )
+
+    def _search(self, op: SearchOp, query_vector: list[float] | None) -> list[SearchItem]:
+        condition, params = self._prefix_condition(op.namespace_prefix)
+        if query_vector is None or self._vectors is None:
+            rows = self._conn.execute(
+                f'''\
+                SELECT prefix, key, value, created_at, updated_at FROM store
+                WHERE {condition} ORDER BY updated_at DESC''',
+                params,
+            )
+            items = (self._row_to_item(row, SearchItem) for row in rows)
+            matched = [item for item in items if self._matches_filter(item.value, op.filter)]
+            return matched[op.offset : op.offset + op.limit]
+
+        slot_rows = self._conn.execute(
+            f'SELECT prefix, key, slot FROM store_vectors WHERE {condition}', params
+        ).fetchall()
+        if not slot_rows:
+            return []
+
+        scores = self._score(query_vector, np.fromiter((row[2] for row in slot_rows), np.int64, len(slot_rows)))
+        best_scores: dict[tuple[str, str], float] = {}  # 同一条目的多个字段取最高分
+        for index in np.argsort(-scores):
+            best_scores.setdefault(slot_rows[index][:2], float(scores[index]))
+
+        results = []
+        ranked_keys = list(best_scores)
+        needed = op.offset + op.limit
+        for start in range(0, len(ranked_keys), max(needed, 16)):
+            chunk = ranked_keys[start : start + max(needed, 16)]
+            rows = self._conn.execute(
+                f'''\
+                SELECT prefix, key, value, created_at, updated_at FROM store
+                WHERE (prefix, key) IN ({', '.join(['(?, ?)'] * len(chunk))})''',
+                [label for pair in chunk for label in pair],
+            ).fetchall()
+            rows_by_key = {row[:2]: row for row in rows}
+            for prefix_key in chunk:
+                row = rows_by_key.get(prefix_key)
+                if row and self._matches_filter(json.loads(row[2]), op.filter):
+                    results.append(self._row_to_item(row, SearchItem, score=best_scores[prefix_key]))
+            if len(results) >= needed:
+                break
+        return results[op.offset : needed]
+
+    def _list_namespaces(self, op: ListNamespacesOp) -> list[tuple[str, ...]]:
+        namespaces = [tuple(row[0].split('.')) for row in self._conn.execute('SELECT DISTINCT prefix FROM store')]
+        if op.match_conditions:
+            namespaces = [
+                namespace
+                for namespace in namespaces
+                if all(self._matches_condition(condition, namespace) for condition in op.match_conditions)
+            ]
+        if op.max_depth is not None:
+            namespaces = {namespace[: op.max_depth] for namespace in namespaces}
+        return sorted(namespaces)[op.offset : op.offset + op.limit]
+
+    # 整理相关
+    async def aload_vectors(
+        self, namespace: tuple[str, ...], keys: list[str] | None = None
+    ) -> tuple[list[tuple[str, datetime]], np.ndarray]:
+        '''
+        读取命名空间下条目的向量，keys 为空时读取所有条目。
+        返回每个向量所属条目的 (键, 更新时间) 和向量矩阵，同一条目的多个字段向量相邻。
+        '''
+
+        return await to_thread(self._load_vectors, namespace, keys)
+
+    def _load_vectors(
+        self, namespace: tuple[str, ...], keys: list[str] | None
+    ) -> tuple[list[tuple[str, datetime]], np.ndarray]:
+        key_condition = f'AND s.key IN ({', '.join(['?'] * len(keys))})' if keys is not None else ''
+        with self._lock:
+            rows = self._conn.execute(
+                f'''\
+                SELECT s.key, s.updated_at, sv.slot FROM store s
+                JOIN store_vectors sv ON sv.prefix = s.prefix AND sv.key = s.key
+                WHERE s.prefix = ? {key_condition} ORDER BY s.key, sv.field_name''',
+                ('.'.join(namespace), *(keys or ())),
+            ).fetchall()
+            if not rows or self._vectors is None:
+                return [], np.empty((0, self.index_config['dims'] if self.index_config else 0), np.float32)
+
+            owners = [(key, datetime.fromisoformat(updated_at)) for key, updated_at, _ in rows]
+            slots = np.fromiter((row[2] for row in rows), np.int64, len(rows))
+            return owners, np.array(self._vectors[slots])
+
+    async def aindex_stats(self) -> dict:
+        '''获取向量索引统计，向量数和有效向量占用的字节数'''
+
+        return await to_thread(self._index_stats)
+
+    def _index_stats(self) -> dict:
+        with self._lock:
+            (vectors,) = self._conn.execute('SELECT COUNT(*) FROM store_vectors').fetchone()
+            dims = self.index_config['dims'] if self.index_config else 0
+            return {'vectors': vectors, 'index_bytes': vectors * dims * 4}
+
+    # 过滤相关
+    @staticmethod
+    def _matches_condition(condition: MatchCondition, namespace: tuple[str, ...]) -> bool:
+        if len(namespace) < len(condition.path):
+            return False
+        labels = namespace if condition.match_type == 'prefix' else namespace[len(namespace) - len(condition.path) :]
+        return all(pattern in ('*', label) for pattern, label in zip(condition.path, labels))
+
+    @classmethod
+    def _matches_filter(cls, value: dict, filter: dict[str, Any] | None) -> bool:
+        if not filter:
+            return True
+        return all(cls._compare(value.get(key), expected) for key, expected in filter.items())
+
+    @classmethod
+    def _compare(cls, value: Any, expected: Any) -> bool:
+        if isinstance(expected, dict):
+            if any(key.startswith('$') for key in expected):
+                return all(cls._apply_operator(value, operator, operand) for operator, operand in expected.items())
+            return isinstance(value, dict) and all(cls._compare(value.get(k), v) for k, v in expected.items())
+        return value == expected
+
+    @staticmethod
+    def _apply_operator(value: Any, operator: str, operand: Any) -> bool:
+        match operator:
+            case '$eq':
+                return value == operand
+            case '$ne':
+                return value != operand
+            case '$gt':
+                return value is not None and float(value) > float(operand)
+            case '$gte':
+                return value is not None and float(value) >= float(operand)
+            case '$lt':
+                return value is not None and float(value) < float(operand)
+            case '$lte':
+                return value is not None and float(value) <= float(operand)
+        raise ValueError(f'不支持的过滤运算符：{operator}')
@@ -0,0 +1,308 @@
+from datetime import datetime
+from textwrap import dedent
+
+import aiosqlite
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+from .sqlite_transaction import sqlite_transaction
+
+
+class ThreadIndexManager:
+    '''对话索引管理器，维护每个对话一行的 threads 表，保存标题和对话轮数，替代在 checkpoints 表上开窗查询和改写元数据'''
+
+    CREATE_TABLE_SQL = dedent(
+        '''\
+        CREATE TABLE IF NOT EXISTS threads (
+            thread_id TEXT PRIMARY KEY,
+            title TEXT DEFAULT '新对话' NOT NULL,
+            message_count INTEGER DEFAULT 0 NOT NULL,
+            title_generated BOOLEAN DEFAULT FALSE NOT NULL,
+            chat_round INTEGER DEFAULT 0 NOT NULL,
+            created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT LOCALTIMESTAMP NOT NULL,
+            updated_at TIMESTAMP WITHOUT TIME ZONE DEFAULT LOCALTIMESTAMP NOT NULL
+        );
+        '''
+    )
+
+    ADD_COLUMNS_SQL = dedent(
+        '''\
+        ALTER TABLE threads
+            ADD COLUMN IF NOT EXISTS title_generated BOOLEAN DEFAULT FALSE NOT NULL,
+            ADD COLUMN IF NOT EXISTS chat_round INTEGER DEFAULT 0 NOT NULL;
+        UPDATE threads SET title_generated = TRUE WHERE title <> '新对话' AND title_generated = FALSE;
+        '''
+    )
+
+    CREATE_INDEX_SQL = dedent(
+        '''\
+        CREATE INDEX IF NOT EXISTS threads_updated_at_idx
+            ON threads (updated_at DESC, thread_id DESC);
+        '''
+    )
+
+    BACKFILL_SQL = dedent(
+        '''\
+        WITH LatestCheckpoints AS (
+            SELECT thread_id, checkpoint, metadata,
+                ROW_NUMBER() OVER (PARTITION BY thread_id ORDER BY checkpoint_id DESC) as rn
+            FROM checkpoints
+            WHERE checkpoint_ns = ''
+        )
+        INSERT INTO threads (thread_id, title, title_generated, chat_round, created_at, updated_at)
+        SELECT thread_id, COALESCE(metadata->>'title', '新对话'),
+            COALESCE((metadata->>'title_generated')::boolean, FALSE),
+            COALESCE((metadata->>'chat_round')::integer, 0),
+            (checkpoint->>'ts')::timestamptz::timestamp, (checkpoint->>'ts')::timestamptz::timestamp
+        FROM LatestCheckpoints
+        WHERE rn = 1 AND NOT EXISTS (SELECT 1 FROM threads)
+        ON CONFLICT (thread_id) DO NOTHING
+        '''
+    )
+
+    # 回填的对话消息数未知，消息序列化保存在 checkpoint_blobs 表中，无法在 SQL 中计算，置为 NULL 后由启动回填从最新检查点补全
+    RESET_MESSAGE_COUNT_SQL = dedent(
+        '''\
+        ALTER TABLE threads ALTER COLUMN message_count DROP NOT NULL;
+        UPDATE threads t SET message_count = NULL
+        WHERE message_count = 0
+            AND EXISTS (SELECT 1 FROM checkpoints c WHERE c.thread_id = t.thread_id AND c.checkpoint_ns = '');
+        '''
+    )
+
+    BEGIN_TURN_SQL = dedent(
+        '''\
+        INSERT INTO threads (thread_id, chat_round)
+        VALUES (%s, 1)
+        ON CONFLICT (thread_id) DO UPDATE
+            SET chat_round = threads.chat_round + 1
+        RETURNING chat_round, title_generated
+        '''
+    )
+
+    UPSERT_TURN_SQL = dedent(
+        '''\
+        INSERT INTO threads (thread_id, message_count)
+        VALUES (%s, %s)
+        ON CONFLICT (thread_id) DO UPDATE
+            SET message_count = EXCLUDED.message_count, updated_at = LOCALTIMESTAMP
+        '''
+    )
+
+    UPDATE_TITLE_SQL = 'UPDATE threads SET title = %s, title_generated = TRUE WHERE thread_id = %s'
+
+    SELECT_UNKNOWN_MESSAGE_COUNT_SQL = 'SELECT thread_id FROM threads WHERE message_count IS NULL'
+
+    UPDATE_MESSAGE_COUNT_SQL = 'UPDATE threads SET message_count = %s WHERE thread_id = %s AND message_count IS NULL'
+
+    SELECT_FIRST_PAGE_SQL = dedent(
+        '''\
+        SELECT thread_id, title, message_count, created_at, updated_at FROM threads
+        ORDER BY updated_at DESC, thread_id DESC LIMIT %s
+        '''
+    )
+
+    SELECT_NEXT_PAGE_SQL = dedent(
+        '''\
+        SELECT thread_id, title, message_count, created_at, updated_at FROM threads
+        WHERE (updated_at, thread_id) < (%s, %s)
+        ORDER BY updated_at DESC, thread_id DESC LIMIT %s
+        '''
+    )
+
+    # 模式迁移，只能追加，threads 表为空时从 checkpoints 表回填一次，需在检查点保存器迁移之后执行
+    MIGRATIONS = [CREATE_TABLE_SQL, ADD_COLUMNS_SQL, CREATE_INDEX_SQL, BACKFILL_SQL, RESET_MESSAGE_COUNT_SQL]
+
+    def __init__(self, pool: AsyncConnectionPool):
+        self._pool = pool
+
+    @staticmethod
+    def _encode_cursor(row: dict) -> str:
+        return f'{row['updated_at'].isoformat()}|{row['thread_id']}'
+
+    @staticmethod
+    def _decode_cursor(cursor: str) -> tuple[datetime, str]:
+        '''解析游标，游标格式错误时抛出 ValueError'''
+
+        try:
+            updated_at, thread_id = cursor.split('|', 1)
+            return datetime.fromisoformat(updated_at), thread_id
+        except ValueError:
+            raise ValueError(f'无效的游标：{cursor}') from None
+
+    async def begin_turn(self, thread_id: str) -> tuple[int, bool]:
+        '''开始对话轮次，单行自增对话轮数，新对话则插入，返回对话轮数和标题是否已生成'''
+
+        async with self._pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(self.BEGIN_TURN_SQL, (thread_id,))
+                chat_round, title_generated = await cur.fetchone()
+            await conn.commit()
+        return chat_round, title_generated
+
+    async def record_turn(self, thread_id: str, message_count: int):
+        '''记录对话轮次，对话轮次提交后更新消息数和更新时间，新对话则插入'''
+
+        async with self._pool.connection() as conn:
+            await conn.execute(self.UPSERT_TURN_SQL, (thread_id, message_count))
+            await conn.commit()
+
+    async def set_title(self, thread_id: str, title: str):
+        '''设置对话标题'''
+
+        async with self._pool.connection() as conn:
+            await conn.execute(self.UPDATE_TITLE_SQL, (title, thread_id))
+            await conn.commit()
+
+    async def unknown_message_count_threads(self) -> list[str]:
+        '''获取消息数未知的对话，用于回填'''
+
+        async with self._pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(self.SELECT_UNKNOWN_MESSAGE_COUNT_SQL)
+                return [row[0] for row in await cur.fetchall()]
+
+    async def fill_message_count(self, thread_id: str, message_count: int):
+        '''补全消息数，只更新消息数未知的对话，不覆盖回填期间对话轮次记录的消息数'''
+
+        async with self._pool.connection() as conn:
+            await conn.execute(self.UPDATE_MESSAGE_COUNT_SQL, (message_count, thread_id))
+            await conn.commit()
+
+    async def list_threads(self, limit: int | None, cursor: str | None = None) -> tuple[list[dict], str | None]:
+        '''列出对话，按更新时间倒序键集分页，返回本页对话和下一页游标，limit 为空时返回所有对话'''
+
+        async with self._pool.connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                if cursor:
+                    await cur.execute(self.SELECT_NEXT_PAGE_SQL, (*self._decode_cursor(cursor), limit))
+                else:
+                    await cur.execute(self.SELECT_FIRST_PAGE_SQL, (limit,))
+                rows = await cur.fetchall()
+
+        next_cursor = self._encode_cursor(rows[-1]) if limit and len(rows) == limit else None
+        return rows, next_cursor
+
+
+class SqliteThreadIndexManager(ThreadIndexManager):
+    '''SQLite 对话索引管理器，单机嵌入式存储下的对话索引管理器，接口与对话索引管理器相同，时间以 ISO 格式文本保存'''
+
+    CREATE_TABLE_SQL = dedent(
+        '''\
+        CREATE TABLE IF NOT EXISTS threads (
+            thread_id TEXT PRIMARY KEY,
+            title TEXT DEFAULT '新对话' NOT NULL,
+            message_count INTEGER DEFAULT 0 NOT NULL,
+            title_generated INTEGER DEFAULT 0 NOT NULL,
+            chat_round INTEGER DEFAULT 0 NOT NULL,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        );
+        '''
+    )
+
+    CREATE_INDEX_SQL = dedent(
+        '''\
+        CREATE INDEX IF NOT EXISTS threads_updated_at_idx
+            ON threads (updated_at DESC, thread_id DESC);
+        '''
+    )
+
+    BEGIN_TURN_SQL = dedent(
+        '''\
+        INSERT INTO threads (thread_id, chat_round, created_at, updated_at)
+        VALUES (?, 1, ?, ?)
+        ON CONFLICT (thread_id) DO UPDATE
+            SET chat_round = threads.chat_round + 1
+        RETURNING chat_round, title_generated
+        '''
+    )
+
+    UPSERT_TURN_SQL = dedent(
+        '''\
+        INSERT INTO threads (thread_id, message_count, created_at, updated_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (thread_id) DO UPDATE
+            SET message_count = excluded.message_count, updated_at = excluded.updated_at
+        '''
+    )
+
+    UPDATE_TITLE_SQL = 'UPDATE threads SET title = ?, title_generated = 1 WHERE thread_id = ?'
+
+    UPDATE_MESSAGE_COUNT_SQL = 'UPDATE threads SET message_count = ? WHERE thread_id = ? AND message_count IS NULL'
+
+    SELECT_FIRST_PAGE_SQL = dedent(
+        '''\
+        SELECT thread_id, title, message_count, created_at, updated_at FROM threads
+        ORDER BY updated_at DESC, thread_id DESC LIMIT ?
+        '''
+    )
+
+    SELECT_NEXT_PAGE_SQL = dedent(
+        '''\
+        SELECT thread_id, title, message_count, created_at, updated_at FROM threads
+        WHERE (updated_at, thread_id) < (?, ?)
+        ORDER BY updated_at DESC, thread_id DESC LIMIT ?
+        '''
+    )
+
+    MIGRATIONS = [CREATE_TABLE_SQL, CREATE_INDEX_SQL]
+
+    def __init__(self, conn: aiosqlite.Connection):
+        self._conn = conn
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.now().isoformat(timespec='microseconds')  # 固定格式，文本比较与时间比较一致
+
+    async def begin_turn(self, thread_id: str) -> tuple[int, bool]:
+        '''开始对话轮次，单行自增对话轮数，新对话则插入，返回对话轮数和标题是否已生成'''
+
+        now = self._now()
+        async with sqlite_transaction(self._conn) as conn:
+            async with conn.execute(self.BEGIN_TURN_SQL, (thread_id, now, now)) as cur:
+                chat_round, title_generated = await cur.fetchone()
+        return chat_round, bool(title_generated)
+
+    async def record_turn(self, thread_id: str, message_count: int):
+        '''记录对话轮次，对话轮次提交后更新消息数和更新时间，新对话则插入'''
+
+        now = self._now()
+        async with sqlite_transaction(self._conn) as conn:
+            await conn.execute(self.UPSERT_TURN_SQL, (thread_id, message_count, now, now))
+
+    async def set_title(self, thread_id: str, title: str):
+        '''设置对话标题'''
+
+        async with sqlite_transaction(self._conn) as conn:
+            await conn.execute(self.UPDATE_TITLE_SQL, (title, thread_id))
+
+    async def unknown_message_count_threads(self) -> list[str]:
+        async with self._conn.execute(self.SELECT_UNKNOWN_MESSAGE_COUNT_SQL) as cur:
+            return [row[0] for row in await cur.fetchall()]
+
+    async def fill_message_count(self, thread_id: str, message_count: int):
+        async with sqlite_transaction(self._conn) as conn:
+            await conn.execute(self.UPDATE_MESSAGE_COUNT_SQL, (message_count, thread_id))
+
+    async def list_threads(self, limit: int | None, cursor: str | None = None) -> tuple[list[dict], str | None]:
+        '''列出对话，按更新时间倒序键集分页，返回本页对话和下一页游标，limit 为空时返回所有对话'''
+
+        limit_param = limit or -1  # SQLite 中 LIMIT -1 表示不限制
+        if cursor:
+            updated_at, thread_id = self._decode_cursor(cursor)
+            params = (updated_at.isoformat(timespec='microseconds'), thread_id, limit_param)
+            sql = self.SELECT_NEXT_PAGE_SQL
+        else:
+            params = (limit_param,)
+            sql = self.SELECT_FIRST_PAGE_SQL
+
+        async with self._conn.execute(sql, params) as cur:
+            columns = [column[0] for column in cur.description]
+            rows = [dict(zip(columns, row)) for row in await cur.fetchall()]
+        for row in rows:
+            row['created_at'] = datetime.fromisoformat(row['created_at'])
+            row['updated_at'] = datetime.fromisoformat(row['updated_at'])
+
+        next_cursor = self._encode_cursor(rows[-1]) if limit and len(rows) == limit else None
+        return rows, next_cursor
@@ -29,6 +29,21 @@ class ActivationRequest(BaseModel):
     activation: bool
 
 
+class ChatHistoryRequest(BaseModel):
+    '''对话历史请求'''
+
+    limit: int | None = Field(None, ge=1, le=500)  # 为空时不分页，返回所有对话
+    cursor: str | None = None  # 上一页返回的游标，为空则从第一页开始
+
+
+class ChatSearchRequest(BaseModel):
+    '''对话搜索请求'''
+
+    query: str = Field(..., min_length=1, max_length=200)
+    limit: int = Field(20, ge=1, le=100)
+    offset: int = Field(0, ge=0)  # 上一页返回的偏移量，为 0 则从第一页开始
+
+
 # 情景记忆相关
 class EpisodeMemory(BaseModel):
     '''
@@ -12,8 +12,8 @@ class Settings(BaseSettings):
         env_file=path.join(ROOT_DIR, '.env'), env_file_encoding='utf-8', case_sensitive=True
     )
 
-    # Postgres 相关
-    POSTGRES_CONNECTION_STRING: str
+    # Postgres 相关，使用 SQLite 存储后端时可不配置
+    POSTGRES_CONNECTION_STRING: str | None = None
 
     # GPT_SoVITS 相关
     GPT_WEIGHTS_PATH: str
@@ -30,6 +30,9 @@ class Config:
     def __init__(self):
         self._related_to_graph_state()
         self._related_to_llm()
+        self._related_to_storage()
+        self._related_to_checkpoint()
+        self._related_to_episode_memory()
         self._related_to_gpt_sovits()
 
     def _related_to_graph_state(self):
@@ -94,6 +97,77 @@ class Config:
         self.deepseek_temperature = None
         self.deepseek_max_tokens = None
 
+        # 对冲相关，备用 LLM 为空时不启用对冲
+        self.hedge_backup_platform = None  # 备用 LLM 平台
+        self.hedge_backup_llm = None  # 备用 LLM
+        self.hedge_percentile = 0.95  # 对冲阈值分位数，主 LLM 首个 token 延迟超过该分位数时发起备用请求
+        self.hedge_default_delay = 3.0  # 默认对冲延迟，延迟样本不足时使用
+        self.hedge_min_delay = 0.5
+        self.hedge_max_delay = 15.0
+        self.hedge_min_samples = 20  # 启用分位数阈值所需的最少延迟样本数
+
+        # 准入相关
+        self.llm_concurrency_limits = {'ollama': 2, 'deepseek': 8}  # 各供应商的并发上限
+        self.llm_default_concurrency_limit = 4
+        self.llm_foreground_reserved_slots = 1  # 为前台请求保留的槽位数，后台请求不能占用
+
+    def _related_to_storage(self):
+        '''存储相关'''
+
+        # 存储后端，'postgres' 使用 Postgres 和 pgvector，'sqlite' 使用单机嵌入式的 SQLite 和内存映射向量文件
+        self.storage_backend = 'postgres'
+        self.sqlite_path = path.join(ROOT_DIR, 'data', 'agent.sqlite')  # SQLite 数据库文件路径
+        self.sqlite_vector_path = path.join(ROOT_DIR, 'data', 'memory_vectors.f32')  # 向量内存映射文件路径
+
+        # 嵌入相关，在等待时间内收集并发的嵌入请求，合并为一次批量嵌入请求
+        self.embedding_max_batch_size = 64  # 每次批量嵌入的最大文本数
+        self.embedding_max_wait_ms = 5  # 收集嵌入请求的最长等待时间，单位毫秒
+
+        # 向量相关，只对 Postgres 存储后端生效，向量表保留全精度向量，只对紧凑表示建立索引，检索后用全精度向量重新打分
+        # 切换格式前先运行 python -m scripts.migrate_memory_vectors 建立新索引，否则启动时建立
+        self.memory_vector_format = 'vector'  # 'vector' 全精度，'halfvec' 半精度，'binary' 二值量化，需要 pgvector 0.7
+        self.memory_vector_compact_dims = None  # Matryoshka 截断维度，如 256 或 512，为空时不截断
+        self.memory_vector_rescore_factor = 4  # 重新打分的候选数倍数
+
+    def _related_to_checkpoint(self):
+        '''检查点相关'''
+
+        # 持久化相关，'exit' 只在每轮对话结束时写入检查点，中间超步保存在内存中，崩溃时回退到上一轮对话
+        # 'async' 每个超步在后台异步写入检查点，'sync' 每个超步同步写入检查点
+        self.checkpoint_durability = 'exit'
+
+        # 压缩相关，保留每个对话最新的若干检查点，以及每轮对话结束时的检查点
+        self.checkpoint_compaction_interval = 3600  # 压缩间隔，单位秒
+        self.checkpoint_keep_latest = 1  # 每个对话保留的最新检查点数，至少为 1
+        self.checkpoint_keep_turn_boundaries = True  # 是否保留轮次边界检查点，即每轮对话结束时的检查点
+        self.checkpoint_min_age_seconds = 600  # 只压缩早于该时长的检查点，避开进行中的对话
+        self.checkpoint_compaction_batch_size = 20  # 每批压缩的对话数，每批一个事务
+
+        # 序列化相关，序列化结果超过阈值时压缩后写入
+        self.checkpoint_compression_threshold = 1024  # 压缩阈值，单位字节
+        self.checkpoint_compression_codec = None  # 压缩算法，'zstd', 'zlib'，为空时优先使用 zstd
+        self.checkpoint_compression_level = 3
+
+    def _related_to_episode_memory(self):
+        '''情景记忆相关'''
+
+        # 检索相关，从候选集中去掉不相关的记忆，按最大边际相关性重排，并限制情景记忆块的 token 数
+        self.episode_retrieval_threshold = 0.5  # 与用户输入的余弦相似度低于该阈值的记忆不进入提示词
+        self.episode_retrieval_candidates = 12  # 候选记忆数
+        self.episode_retrieval_max_episodes = 3  # 每轮对话最多使用的记忆数
+        self.episode_retrieval_mmr_lambda = 0.7  # 相关性的权重，越小越偏向多样性
+        self.episode_retrieval_token_budget = 800  # 情景记忆块的 token 上限
+
+        # 上下文缓存相关，同一对话话题未漂移时复用上次检索的情景记忆，反思写入新记忆后失效
+        self.memory_context_drift_threshold = 0.3  # 用户输入与上次检索时的余弦距离超过该阈值视为话题漂移，重新检索
+        self.memory_context_refresh_timeout = 1.0  # 话题漂移时等待重新检索的时间，单位秒，超时本轮沿用旧结果
+        self.memory_context_max_threads = 256  # 缓存的最大对话数
+
+        # 整理相关，合并近似重复的情景记忆，并按更新时间淘汰超出上限的旧记忆
+        self.episode_consolidation_interval = 3600 * 24  # 整理间隔，单位秒
+        self.episode_similarity_threshold = 0.95  # 余弦相似度不低于该阈值的两条记忆视为重复，只保留最新的一条
+        self.episode_max_memories_per_user = 2000  # 每个用户保留的最大记忆数
+
     def _related_to_gpt_sovits(self):
         '''GPT_SoVITS 相关'''
 
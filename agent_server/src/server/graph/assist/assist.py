@@ -58,8 +58,9 @@ class RemindTaskExtractor(BaseStructuredOutputExtractor):
            b. **格式要求：** 必须将所有相对时间描述（如“明天早上 9 点”、“下周一”）准确地转换为 **不带时区的 ISO 8601 格式**，例如 **"2025-11-13T14:30:00"**。
            c. **日期完整性：** 如果用户只提到时间（例如“下午三点”），你必须推断为**最近的、最合理的**那个下午三点（例如今天下午三点，如果时间已过，则为明天下午三点），并补全完整日期。
            d. **不可推断性：** 如果任务没有时间信息，且无法根据上下文合理推断出时间（例如“等我有空了提醒我”），你应该尽量尝试推测一个比较可能的时间，否则则将 `due_time` 字段设置为 **null**。
-        3. **上下文总结：** `context` 字段必须是与该提醒任务相关的**简短的、可独立阅读的**上下文总结。
-        4. **空列表处理：** 如果在对话中没有检测到任何符合上述标准的提醒或待办任务，请返回一个**空列表**。
+        3. **重复提醒：** 如果用户要求周期性地提醒（如“每天早上 8 点提醒我”、“每周一三五提醒我”），只提取**一个**任务，`due_time` 为第一次提醒的时间，`recurrence` 为重复规则；只提醒一次的任务 `recurrence` 为 **null**。
+        4. **上下文总结：** `context` 字段必须是与该提醒任务相关的**简短的、可独立阅读的**上下文总结。
+        5. **空列表处理：** 如果在对话中没有检测到任何符合上述标准的提醒或待办任务，请返回一个**空列表**。
         ---
         **请严格按照**你的输出模式的 JSON 结构**返回任务列表**，不要输出任何额外的解释、Markdown 格式或任何非 JSON 文本。
     '''
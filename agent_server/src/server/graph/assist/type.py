@@ -48,6 +48,10 @@ class RemindTask(BaseModel):
         None,
         description='与提醒任务相关的简短的上下文信息，用于辅助提醒任务内容的简短的上下文总结信息，例如：“明天是假期第一天，计划明天先写作业再娱乐。”',
     )
+    recurrence: str | None = Field(
+        None,
+        description='重复提醒的规则，使用 iCalendar RRULE 的子集，支持 FREQ（HOURLY, DAILY, WEEKLY, MONTHLY, YEARLY），INTERVAL，BYDAY（只用于 WEEKLY，如 MO,WE,FR），COUNT 和 UNTIL，例如“每天早上 8 点”为 “FREQ=DAILY”，“每两周的周一和周五”为 “FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,FR”。due_time 为第一次提醒的时间。只提醒一次的任务为 None',
+    )
 
 
 class RemindTaskList(BaseModel):
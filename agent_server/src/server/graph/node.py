@@ -86,13 +86,16 @@ async def remind_task_extraction_node(state, config: RunnableConfig, llm: BaseCh
         chain = create_remind_task_extractor_chain(llm)
         remind_task_list = await chain.ainvoke({'messages': state.messages, 'time': datetime.now()}, config=config)
         if remind_task_list and remind_task_list.tasks:
-            for remind_task in remind_task_list.tasks:
-                await remind_task_manager.add_task(remind_task)
-            return {
-                'response_draft': AIMessage(
-                    f'好的，我已提取并添加 {len(remind_task_list.tasks)} 个提醒/待办的任务，我会在任务到期时通知你喵！'
-                )
-            }
+            # 批量添加，重复提取的和没有到期时间的任务不会添加
+            inserted = await remind_task_manager.add_tasks(remind_task_list.tasks)
+            skipped = len(remind_task_list.tasks) - inserted
+            if not inserted:
+                content = '这些提醒/待办的任务已经添加过或缺少到期时间，没有新增任务喵！'
+            else:
+                content = f'好的，我已提取并添加 {inserted} 个提醒/待办的任务，我会在任务到期时通知你喵！'
+                if skipped:
+                    content += f'另有 {skipped} 个任务已经添加过或缺少到期时间，没有添加。'
+            return {'response_draft': AIMessage(content)}
         return {}
     except Exception:
         raise
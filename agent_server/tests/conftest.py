@@ -0,0 +1,5 @@
+import os
+
+# 导入服务器包时会读取配置，单元测试不需要真实的 GPT_SoVITS 路径
+for name in ('GPT_WEIGHTS_PATH', 'SOVITS_WEIGHTS_PATH', 'REF_AUDIO_PATH'):
+    os.environ.setdefault(name, '')
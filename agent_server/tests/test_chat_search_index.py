@@ -0,0 +1,55 @@
+import asyncio
+
+import aiosqlite
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.checkpoint.base import empty_checkpoint
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+from src.server.assist import SqliteChatSearchIndex, SqliteSchemaMigrator
+from src.server.assist.chat_search_index import ChatSearchIndex, highlight, tokenize, tokenize_query
+
+
+def test_tokenize_splits_mixed_chinese_latin_and_digits_at_script_boundaries():
+    assert tokenize('我用Python写代码，今天3点开会') == [
+        '我', '我用', '用', 'python', '写', '写代', '代', '代码', '码', '今', '今天', '天', '3', '点', '点开', '开', '开会', '会'
+    ]  # fmt: skip
+
+
+def test_tokenize_keeps_latin_and_digits_together():
+    assert tokenize('GPT4o模型v2版本') == ['gpt4o', '模', '模型', '型', 'v2', '版', '版本', '本']
+    assert tokenize('snake_case ÉCOLE') == ['snake', 'case', 'école']
+
+
+def test_tokenize_query_matches_mixed_text():
+    assert tokenize_query('Python写代码 3点') == [['python'], ['写代', '代码'], ['3'], ['点']]
+    document = set(tokenize('我用Python写代码，今天3点开会'))
+    assert all(document & set(group) for group in tokenize_query('python 代码 3点'))
+
+
+def test_highlight_marks_query_words():
+    snippet, spans = highlight('我用Python写代码', 'python 代码')
+    assert [snippet[start:end] for start, end in spans] == ['Python', '代码']
+
+
+def test_to_tsvector_skips_oversize_lexemes():
+    long_word = 'x' * (ChatSearchIndex.MAX_LEXEME_BYTES + 1)
+    assert ChatSearchIndex._to_tsvector(['好', long_word, "it's", '好']) == "'好':1,4 'it''s':3"
+
+
+def test_unindexed_threads_include_threads_before_index():
+    async def run():
+        async with aiosqlite.connect(':memory:') as conn:
+            checkpointer = AsyncSqliteSaver(conn)
+            await checkpointer.setup()
+            for thread_id, checkpoint_ns in (('old', ''), ('indexed', ''), ('old', 'subgraph'), ('subgraph', 'node')):
+                config = {'configurable': {'thread_id': thread_id, 'checkpoint_ns': checkpoint_ns}}
+                await checkpointer.aput(config, empty_checkpoint(), {}, {})
+
+            schema_migrator = SqliteSchemaMigrator(conn)
+            schema_migrator.register('chat_messages', SqliteChatSearchIndex.MIGRATIONS)
+            await schema_migrator.migrate()
+            chat_search_index = SqliteChatSearchIndex(conn)
+            await chat_search_index.index_messages('indexed', [HumanMessage('你好'), AIMessage('你好呀')])
+            return await chat_search_index.unindexed_threads()
+
+    assert asyncio.run(run()) == ['old']
@@ -0,0 +1,46 @@
+from os import urandom
+
+import pytest
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from src.server.assist import CompressedSerializer
+from src.server.assist.compressed_serializer import zstd
+
+CODECS = ['zlib', pytest.param('zstd', marks=pytest.mark.skipif(not zstd, reason='zstd 不可用'))]
+
+
+@pytest.mark.parametrize('codec', CODECS)
+def test_small_payload_is_stored_uncompressed(codec):
+    serde = CompressedSerializer(threshold=1024, codec=codec)
+    obj = {'messages': ['你好']}
+    typ, data = serde.dumps_typed(obj)
+    assert typ == JsonPlusSerializer().dumps_typed(obj)[0]
+    assert serde.loads_typed((typ, data)) == obj
+
+
+@pytest.mark.parametrize('codec', CODECS)
+def test_large_payload_round_trips_compressed(codec):
+    serde = CompressedSerializer(threshold=1024, codec=codec)
+    obj = {'messages': ['你好，今天天气不错'] * 500}
+    typ, data = serde.dumps_typed(obj)
+    assert typ.endswith(f'+{codec}')
+    assert len(data) < len(JsonPlusSerializer().dumps_typed(obj)[1])
+    assert serde.loads_typed((typ, data)) == obj
+
+
+def test_incompressible_payload_is_stored_as_is():
+    serde = CompressedSerializer(threshold=16, codec='zlib')
+    obj = urandom(4096)
+    typ, data = serde.dumps_typed(obj)
+    assert '+' not in typ
+    assert serde.loads_typed((typ, data)) == obj
+
+
+def test_reads_uncompressed_data_written_before_compression():
+    obj = {'messages': ['旧数据'] * 500}
+    assert CompressedSerializer(threshold=16).loads_typed(JsonPlusSerializer().dumps_typed(obj)) == obj
+
+
+def test_rejects_unknown_codec():
+    with pytest.raises(ValueError):
+        CompressedSerializer(codec='lz4')
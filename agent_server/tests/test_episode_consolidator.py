@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from src.server.assist import EpisodeConsolidator, MemoryVectors
+
+NOW = datetime(2026, 1, 1)
+
+
+def memories(*vectors: list[float]) -> MemoryVectors:
+    '''第 i 条记忆的键为 m{i}，更新时间依次变新'''
+
+    vectors = np.asarray(vectors, np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return MemoryVectors(
+        [f'm{i}' for i in range(len(vectors))], [NOW + timedelta(minutes=i) for i in range(len(vectors))], vectors
+    )
+
+
+def test_plan_keeps_newest_of_each_cluster():
+    consolidator = EpisodeConsolidator(None, similarity_threshold=0.95, block_size=2)
+    duplicates, capped = consolidator._plan(
+        memories([1, 0, 0], [0, 1, 0], [1, 0.01, 0], [0, 0, 1], [0.999, 0.02, 0], [0, 1, 0.01])
+    )
+    assert sorted(duplicates) == ['m0', 'm1', 'm2']
+    assert capped == []
+
+
+def test_plan_merges_clusters_transitively_across_blocks():
+    consolidator = EpisodeConsolidator(None, similarity_threshold=0.99, block_size=1)
+    angles = np.radians([0, 6, 12])  # 相邻两条相似度约 0.995，首尾约 0.978
+    duplicates, _ = consolidator._plan(memories(*[[np.cos(a), np.sin(a)] for a in angles]))
+    assert sorted(duplicates) == ['m0', 'm1']
+
+
+def test_plan_caps_survivors_by_recency():
+    consolidator = EpisodeConsolidator(None, max_memories_per_user=2)
+    duplicates, capped = consolidator._plan(memories([1, 0, 0], [0, 1, 0], [0, 0, 1], [0, 0, 0.99]))
+    assert duplicates == ['m2']
+    assert capped == ['m0']  # 重复的记忆不计入上限，保留最新的 m3 和 m1
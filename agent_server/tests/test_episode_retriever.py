@@ -0,0 +1,35 @@
+import numpy as np
+
+from src.server.assist import EpisodeRetriever, estimate_tokens
+
+
+def normalize(*vectors: list[float]) -> np.ndarray:
+    vectors = np.asarray(vectors, np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_mmr_with_full_relevance_weight_sorts_by_relevance():
+    retriever = EpisodeRetriever(None, mmr_lambda=1.0)
+    relevance = np.array([0.6, 0.9, 0.7], np.float32)
+    assert retriever._mmr(relevance, normalize([1, 0], [1, 0], [0, 1])) == [1, 2, 0]
+
+
+def test_mmr_prefers_diverse_episode_over_near_duplicate():
+    retriever = EpisodeRetriever(None, mmr_lambda=0.5)
+    relevance = np.array([0.9, 0.88, 0.7], np.float32)
+    vectors = normalize([1, 0], [1, 0.01], [0, 1])  # 前两条几乎相同
+    assert retriever._mmr(relevance, vectors) == [0, 2, 1]
+
+
+def test_mmr_returns_every_candidate_once():
+    retriever = EpisodeRetriever(None)
+    rng = np.random.default_rng(0)
+    order = retriever._mmr(rng.random(8).astype(np.float32), normalize(*rng.normal(size=(8, 4))))
+    assert sorted(order) == list(range(8))
+
+
+def test_estimate_tokens_counts_cjk_per_character():
+    assert estimate_tokens('') == 0
+    assert estimate_tokens('你好') == 2
+    assert estimate_tokens('abcd') == 1
+    assert estimate_tokens('你好abcde') == 4
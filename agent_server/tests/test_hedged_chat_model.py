@@ -0,0 +1,71 @@
+from asyncio import run, sleep
+
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.runnables import RunnableLambda
+
+from src.server.assist import HedgedChatModel, LatencyHedger
+from src.server.assist.hedged_chat_model import LatencyHistogram
+
+
+def stream(delay: float, *chunks):
+    async def _stream():
+        await sleep(delay)
+        for chunk in chunks:
+            yield chunk
+
+    return _stream
+
+
+def test_histogram_percentile_returns_bucket_upper_bound():
+    histogram = LatencyHistogram()
+    assert histogram.percentile(0.5) is None
+
+    for _ in range(90):
+        histogram.observe(0.04)
+    for _ in range(10):
+        histogram.observe(1.0)
+    assert histogram.percentile(0.5) == 0.05
+    assert histogram.percentile(0.9) == 0.05
+    assert histogram.percentile(0.95) == 1.281  # 1.0 落在上界为 0.05 * 1.5**8 的桶中
+    assert histogram.snapshot()['total'] == 100
+
+
+def test_histogram_halves_counts_over_max_samples():
+    histogram = LatencyHistogram(max_samples=10)
+    for _ in range(11):
+        histogram.observe(0.1)
+    assert histogram.total == 5
+
+
+def test_arace_primary_wins_without_hedging():
+    hedger = LatencyHedger(default_delay=0.2)
+    chunk, iterator = run(hedger.arace([('primary', stream(0, 'a', 'b')), ('backup', stream(0, 'x'))]))
+    assert chunk == 'a'
+    assert hedger.snapshot()['hedged_count'] == 0
+    assert hedger.snapshot()['histograms']['primary']['total'] == 1
+
+
+def test_arace_records_losing_primary_as_lower_bound():
+    hedger = LatencyHedger(default_delay=0.05)
+    chunk, _ = run(hedger.arace([('primary', stream(1, 'slow')), ('backup', stream(0, 'fast'))]))
+    snapshot = hedger.snapshot()
+    assert chunk == 'fast'
+    assert snapshot['hedged_count'] == 1
+    assert snapshot['backup_win_count'] == 1
+    # 主请求落败时也记录已等待的时间，直方图不会只收集快样本
+    assert snapshot['histograms']['primary']['total'] == 1
+    assert snapshot['histograms']['primary']['p50'] >= 0.05
+
+
+def test_sync_invoke_fails_over_to_backup():
+    def fail(messages, **kwargs):
+        raise RuntimeError('primary down')
+
+    model = HedgedChatModel(
+        primary=RunnableLambda(fail),
+        backup=FakeListChatModel(responses=['backup']),
+        primary_name='primary',
+        backup_name='backup',
+        hedger=LatencyHedger(),
+    )
+    assert model.invoke('hi').content == 'backup'
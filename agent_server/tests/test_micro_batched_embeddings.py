@@ -0,0 +1,74 @@
+from asyncio import gather, run
+
+from langchain_core.embeddings import Embeddings
+
+from src.server.assist import MicroBatchedEmbeddings
+
+
+class RecordingEmbeddings(Embeddings):
+    '''记录每次批量嵌入请求的嵌入模型，向量为文本长度'''
+
+    def __init__(self, fail: bool = False):
+        self.batches: list[list[str]] = []
+        self.fail = fail
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.batches.append(texts)
+        if self.fail:
+            raise RuntimeError('嵌入失败')
+        return [[float(len(text))] for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+
+def test_concurrent_requests_are_deduplicated_into_one_batch():
+    inner = RecordingEmbeddings()
+    embeddings = MicroBatchedEmbeddings(inner, max_wait_ms=5)
+
+    async def main():
+        return await gather(
+            embeddings.aembed_query('a'),
+            embeddings.aembed_documents(['bb', 'a']),
+            embeddings.aembed_query('ccc'),
+        )
+
+    assert run(main()) == [[1.0], [[2.0], [1.0]], [3.0]]
+    assert inner.batches == [['a', 'bb', 'ccc']]
+    snapshot = embeddings.snapshot()
+    assert (snapshot['requests'], snapshot['texts'], snapshot['batches'], snapshot['embedded']) == (3, 4, 1, 3)
+
+
+def test_full_batch_is_sent_without_waiting_and_split():
+    inner = RecordingEmbeddings()
+    embeddings = MicroBatchedEmbeddings(inner, max_batch_size=2, max_wait_ms=10_000)
+
+    async def main():
+        return await embeddings.aembed_documents(['a', 'bb', 'ccc'])
+
+    assert run(main()) == [[1.0], [2.0], [3.0]]
+    assert inner.batches == [['a', 'bb'], ['ccc']]
+
+
+def test_batch_failure_is_raised_to_every_caller():
+    embeddings = MicroBatchedEmbeddings(RecordingEmbeddings(fail=True))
+
+    async def main():
+        return await gather(embeddings.aembed_query('a'), embeddings.aembed_query('b'), return_exceptions=True)
+
+    results = run(main())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert embeddings.snapshot()['failed_batches'] == 1
+
+
+def test_empty_documents():
+    assert run(MicroBatchedEmbeddings(RecordingEmbeddings()).aembed_documents([])) == []
+
+
+def test_sync_interface_bypasses_batching():
+    inner = RecordingEmbeddings()
+    embeddings = MicroBatchedEmbeddings(inner)
+    assert embeddings.embed_query('你好') == [2.0]
+    assert embeddings.embed_documents(['a', 'a']) == [[1.0], [1.0]]
+    assert inner.batches == [['你好'], ['a', 'a']]
+    assert embeddings.snapshot()['batches'] == 0
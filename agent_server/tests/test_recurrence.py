@@ -0,0 +1,112 @@
+from datetime import UTC, datetime, timedelta
+
+import pytest
+
+from src.server.assist import Recurrence
+
+MONDAY = datetime(2026, 1, 5, 9)
+
+
+def occurrences(recurrence: Recurrence, time: datetime, n: int) -> list[datetime]:
+    '''从第 1 次发生开始依次推进，返回之后的 n 次发生时间'''
+
+    times, occurrence = [], 1
+    for _ in range(n):
+        time, occurrence = recurrence.next_occurrence(time, occurrence, time)
+        times.append(time)
+    return times
+
+
+def test_parse_normalizes_rule():
+    recurrence = Recurrence.parse('RRULE:freq=weekly; byday=FR,MO,WE,MO; interval=2; count=4')
+    assert recurrence == Recurrence('WEEKLY', 2, (0, 2, 4), 4)
+    assert str(recurrence) == 'FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,WE,FR;COUNT=4'
+    assert Recurrence.parse(str(recurrence)) == recurrence
+
+
+@pytest.mark.parametrize(
+    'rule',
+    [
+        '',
+        'FREQ=SECONDLY',
+        'FREQ=DAILY;BYDAY=MO',
+        'FREQ=WEEKLY;BYDAY=XX',
+        'FREQ=DAILY;BYMONTH=1',
+        'FREQ=DAILY;INTERVAL=0',
+        'FREQ=DAILY;COUNT=0',
+        'FREQ=DAILY;UNTIL=tomorrow',
+        'FREQ',
+    ],
+)
+def test_parse_rejects_invalid_rules(rule):
+    with pytest.raises(ValueError):
+        Recurrence.parse(rule)
+
+
+def test_daily_and_hourly_interval():
+    assert occurrences(Recurrence.parse('FREQ=DAILY;INTERVAL=3'), MONDAY, 2) == [
+        MONDAY + timedelta(days=3),
+        MONDAY + timedelta(days=6),
+    ]
+    assert occurrences(Recurrence.parse('FREQ=HOURLY;INTERVAL=2'), MONDAY, 1) == [MONDAY + timedelta(hours=2)]
+
+
+def test_weekly_by_day_steps_within_week_then_wraps():
+    recurrence = Recurrence.parse('FREQ=WEEKLY;BYDAY=MO,WE,FR')
+    assert [time.strftime('%a %d') for time in occurrences(recurrence, MONDAY, 4)] == [
+        'Wed 07',
+        'Fri 09',
+        'Mon 12',
+        'Wed 14',
+    ]
+
+
+def test_weekly_by_day_with_interval_skips_weeks():
+    recurrence = Recurrence.parse('FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,FR')
+    assert [time.strftime('%a %d') for time in occurrences(recurrence, MONDAY, 3)] == ['Fri 09', 'Mon 19', 'Fri 23']
+
+
+def test_weekly_by_day_from_unlisted_weekday():
+    tuesday = MONDAY + timedelta(days=1)
+    assert occurrences(Recurrence.parse('FREQ=WEEKLY;BYDAY=MO'), tuesday, 1) == [MONDAY + timedelta(weeks=1)]
+
+
+def test_monthly_skips_months_without_the_day():
+    recurrence = Recurrence.parse('FREQ=MONTHLY')
+    assert [time.date().isoformat() for time in occurrences(recurrence, datetime(2026, 1, 31, 8), 3)] == [
+        '2026-03-31',
+        '2026-05-31',
+        '2026-07-31',
+    ]
+
+
+def test_yearly_leap_day_waits_for_next_leap_year():
+    assert occurrences(Recurrence.parse('FREQ=YEARLY'), datetime(2024, 2, 29), 1) == [datetime(2028, 2, 29)]
+
+
+def test_count_limits_total_occurrences():
+    recurrence = Recurrence.parse('FREQ=DAILY;COUNT=3')
+    assert recurrence.next_occurrence(MONDAY, 2, MONDAY) == (MONDAY + timedelta(days=1), 3)
+    assert recurrence.next_occurrence(MONDAY, 3, MONDAY) is None
+
+
+def test_missed_occurrences_are_skipped_but_counted():
+    recurrence = Recurrence.parse('FREQ=DAILY;COUNT=5')
+    after = MONDAY + timedelta(days=2, hours=12)
+    assert recurrence.next_occurrence(MONDAY, 1, after) == (MONDAY + timedelta(days=3), 4)
+    assert recurrence.next_occurrence(MONDAY, 1, MONDAY + timedelta(days=10)) is None
+
+
+def test_until_is_inclusive():
+    recurrence = Recurrence.parse('FREQ=DAILY;UNTIL=20260107T090000')
+    assert recurrence.until == datetime(2026, 1, 7, 9)
+    assert recurrence.next_occurrence(MONDAY + timedelta(days=1), 2, MONDAY) == (MONDAY + timedelta(days=2), 3)
+    assert recurrence.next_occurrence(MONDAY + timedelta(days=2), 3, MONDAY) is None
+
+
+def test_until_in_utc_is_converted_to_local_time():
+    recurrence = Recurrence.parse('FREQ=DAILY;UNTIL=20260107T090000Z')
+    local = datetime(2026, 1, 7, 9, tzinfo=UTC).astimezone().replace(tzinfo=None)
+    assert recurrence.until == local
+    assert recurrence.until.tzinfo is None
+    assert Recurrence.parse(str(recurrence)) == recurrence
@@ -0,0 +1,44 @@
+from datetime import datetime, timedelta
+
+from src.server.assist import RemindTaskQueue
+
+NOW = datetime(2026, 1, 1, 9)
+
+
+def test_pop_due_returns_due_tasks_in_order():
+    queue = RemindTaskQueue()
+    queue.push(1, NOW + timedelta(minutes=2))
+    queue.push(2, NOW - timedelta(minutes=1))
+    queue.push(3, NOW)
+    assert queue.next_due_time() == NOW - timedelta(minutes=1)
+    assert queue.pop_due(NOW) == [(2, NOW - timedelta(minutes=1)), (3, NOW)]
+    assert len(queue) == 1
+    assert queue.next_due_time() == NOW + timedelta(minutes=2)
+
+
+def test_rescheduled_task_drops_stale_entry():
+    queue = RemindTaskQueue()
+    queue.push(1, NOW)
+    queue.push(1, NOW + timedelta(hours=1))  # 到期时间推迟，旧条目惰性删除
+    assert len(queue) == 1
+    assert queue.next_due_time() == NOW + timedelta(hours=1)
+    assert queue.pop_due(NOW) == []
+    assert queue.pop_due(NOW + timedelta(hours=1)) == [(1, NOW + timedelta(hours=1))]
+    assert queue.next_due_time() is None
+
+
+def test_rescheduled_earlier_task_pops_once():
+    queue = RemindTaskQueue()
+    queue.push(1, NOW + timedelta(hours=1))
+    queue.push(1, NOW)
+    queue.push(1, NOW)  # 相同到期时间不重复入堆
+    assert queue.pop_due(NOW + timedelta(days=1)) == [(1, NOW)]
+    assert len(queue) == 0
+
+
+def test_clear():
+    queue = RemindTaskQueue()
+    queue.push(1, NOW)
+    queue.clear()
+    assert len(queue) == 0
+    assert queue.next_due_time() is None